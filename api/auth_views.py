@@ -19,7 +19,9 @@ from rest_framework import status
 from rest_framework.decorators import api_view, permission_classes
 from rest_framework.response import Response
 from rest_framework.authtoken.models import Token
-from rest_framework.permissions import AllowAny, IsAuthenticated
+from rest_framework.permissions import AllowAny, IsAdminUser, IsAuthenticated
+
+from .authentication import token_cache
 
 
 @api_view(['POST'])
@@ -177,3 +179,17 @@ def verify_token(request):
         'user_id': request.user.id,
         'email': request.user.email
     }, status=status.HTTP_200_OK)
+
+
+@api_view(['GET'])
+@permission_classes([IsAdminUser])  # Staff only
+def token_cache_stats(request):
+    """
+    Report hit/miss statistics of this process's token cache.
+    
+    Requires: staff user
+    
+    Returns:
+    - 200: Cache size, hits, misses, evictions and hit rate
+    """
+    return Response(token_cache.stats(), status=status.HTTP_200_OK)
@@ -0,0 +1,54 @@
+"""
+Cached token authentication.
+
+Drop-in replacement for DRF's TokenAuthentication that remembers which user
+a token key belongs to, so most API requests authenticate without the
+`Token` + `User` query. Deleting a token (logout) or saving or deleting its
+user (password, active flag or profile changes) invalidates the user's auth
+version in the shared cache (see base.auth_versions), and every worker checks
+that version before trusting a cached entry. Entries expire after
+TOKEN_CACHE_TTL seconds regardless, and the cache is off by default unless
+that shared cache really is shared between workers (REDIS_URL).
+"""
+
+import copy
+
+from django.conf import settings
+from django.db.models.signals import post_delete
+from django.dispatch import receiver
+from rest_framework import exceptions
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.authtoken.models import Token
+
+from base.auth_versions import get_auth_version, invalidate_auth
+from base.ttl_cache import TTLCache
+
+token_cache = TTLCache(
+    max_size=getattr(settings, 'TOKEN_CACHE_SIZE', 10000),
+    ttl=getattr(settings, 'TOKEN_CACHE_TTL', 60),
+)
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """TokenAuthentication backed by the process-wide `token_cache`."""
+
+    def authenticate_credentials(self, key):
+        cached = token_cache.get(key)
+        if cached is not None:
+            user, token, version = cached
+            if version == get_auth_version(user.pk):
+                if not user.is_active:
+                    raise exceptions.AuthenticationFailed('User inactive or deleted.')
+                # Each request gets its own instance, so per-request changes never leak
+                return copy.copy(user), token
+            token_cache.delete(key)
+        user, token = super().authenticate_credentials(key)
+        token_cache.set(key, (copy.copy(user), token, get_auth_version(user.pk)))
+        return user, token
+
+
+@receiver(post_delete, sender=Token)
+def token_deleted(sender, instance, **kwargs):
+    token_cache.delete(instance.key)
+    invalidate_auth(instance.user_id)
+
@@ -0,0 +1,95 @@
+"""
+Keyset (cursor) pagination for function-based API views.
+
+Pages are selected with a `WHERE (field, id) < (last_field, last_id)` style
+filter on an indexed ordering instead of OFFSET, so fetching any page costs
+the same however much history a user has.
+"""
+
+import base64
+import json
+from datetime import date
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Q
+from rest_framework.exceptions import ValidationError
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+MAX_PAGE_SIZE = 1000
+
+
+class KeysetPagination:
+    """Paginate a queryset on `(field, id)`, newest first unless `descending` is False."""
+
+    cursor_query_param = 'cursor'
+    page_size_query_param = 'limit'
+
+    def __init__(self, field, descending=True):
+        self.field = field
+        self.descending = descending
+        self.next_cursor = None
+        self.request = None
+        self.page_size = None
+
+    def get_page_size(self, request):
+        default = settings.REST_FRAMEWORK.get('PAGE_SIZE') or 100
+        try:
+            size = int(request.GET.get(self.page_size_query_param, default))
+        except ValueError:
+            raise ValidationError({'limit': 'Must be an integer'})
+        return max(1, min(size, MAX_PAGE_SIZE))
+
+    def encode_cursor(self, obj):
+        value = getattr(obj, self.field)
+        if isinstance(value, date):
+            # Full precision: DjangoJSONEncoder cuts datetimes to milliseconds
+            value = value.isoformat()
+        position = [value, obj.pk]
+        return base64.urlsafe_b64encode(json.dumps(position, cls=DjangoJSONEncoder).encode()).decode()
+
+    def decode_cursor(self, queryset, cursor):
+        try:
+            value, pk = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+            value = queryset.model._meta.get_field(self.field).to_python(value)
+            return value, int(pk)
+        except Exception:
+            raise ValidationError({'cursor': 'Invalid cursor'})
+
+    def page_query(self, queryset, request):
+        """Return the query selecting this page plus one row to detect a next page."""
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        lookup = 'lt' if self.descending else 'gt'
+        prefix = '-' if self.descending else ''
+
+        cursor = request.GET.get(self.cursor_query_param)
+        if cursor:
+            value, pk = self.decode_cursor(queryset, cursor)
+            queryset = queryset.filter(
+                Q(**{f'{self.field}__{lookup}': value}) | Q(**{self.field: value, f'id__{lookup}': pk})
+            )
+        return queryset.order_by(f'{prefix}{self.field}', f'{prefix}id')[:self.page_size + 1]
+
+    def finish_page(self, rows):
+        if len(rows) > self.page_size:
+            rows = rows[:self.page_size]
+            self.next_cursor = self.encode_cursor(rows[-1])
+        return rows
+
+    def paginate_queryset(self, queryset, request):
+        return self.finish_page(list(self.page_query(queryset, request)))
+
+    async def apaginate_queryset(self, queryset, request):
+        """Async version of `paginate_queryset`, using the async ORM."""
+        return self.finish_page([row async for row in self.page_query(queryset, request)])
+
+    def get_next_link(self):
+        if not self.next_cursor:
+            return None
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_query_param, self.next_cursor)
+
+    def get_paginated_response(self, data):
+        return Response({'next': self.get_next_link(), 'results': data})
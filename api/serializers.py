@@ -1,14 +1,40 @@
 from rest_framework import serializers
+from base.change_log import record_change
 from base.models import Habit, SleepLog
-from base.models import MoodLog
+from base.models import MoodLog, Rollup
+
+
+class ChangeLogMixin:
+    """Record creates and updates made through the serializer in the owner's change log."""
+    change_kind = None
+
+    def create(self, validated_data):
+        instance = super().create(validated_data)
+        record_change(instance.user, self.change_kind, instance.pk, 'create', self.to_representation(instance))
+        return instance
+
+    def update(self, instance, validated_data):
+        instance = super().update(instance, validated_data)
+        record_change(instance.user, self.change_kind, instance.pk, 'update', self.to_representation(instance))
+        return instance
+
+
+class HabitSerializer(ChangeLogMixin, serializers.ModelSerializer):
+    change_kind = 'habit'
+    # Stored streak only counts while it is still alive (completed today or yesterday)
+    current_streak = serializers.SerializerMethodField()
+
+    def get_current_streak(self, obj):
+        return obj.active_streak()
 
-class HabitSerializer(serializers.ModelSerializer):
     class Meta:
         model = Habit
         fields = '__all__'
-        read_only_fields = ['user']
+        read_only_fields = ['user', 'longest_streak', 'total_completions', 'last_completed']
+
+class SleepLogSerializer(ChangeLogMixin, serializers.ModelSerializer):
+    change_kind = 'sleep'
 
-class SleepLogSerializer(serializers.ModelSerializer):
     def create(self, validated_data):
         start = validated_data['start']
         end = validated_data['end']
@@ -28,8 +54,20 @@ class SleepLogSerializer(serializers.ModelSerializer):
         read_only_fields = ['user']
 
 
-class MoodLogSerializer(serializers.ModelSerializer):
+class MoodLogSerializer(ChangeLogMixin, serializers.ModelSerializer):
+    change_kind = 'mood'
+
     class Meta:
         model = MoodLog
         fields = ['id', 'date', 'mood', 'note']
-        read_only_fields = ['user']
\ No newline at end of file
+        read_only_fields = ['user']
+
+
+class RollupSerializer(serializers.ModelSerializer):
+    completion_rate = serializers.FloatField(read_only=True)
+    average_mood = serializers.FloatField(read_only=True)
+
+    class Meta:
+        model = Rollup
+        fields = ['period', 'start', 'habits_completed', 'habit_count', 'completion_rate',
+                  'sleep_minutes', 'sleep_nights', 'mood_count', 'average_mood']
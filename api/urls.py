@@ -8,20 +8,36 @@ urlpatterns = [
     path('auth/login/', auth_views.login, name='api_login'),
     path('auth/logout/', auth_views.logout, name='api_logout'),
     path('auth/verify/', auth_views.verify_token, name='api_verify_token'),
+    path('auth/token-cache/', auth_views.token_cache_stats, name='api_token_cache_stats'),
 
     # Habit URLs
     path('habits/', views.getData, name="get_data"),
     path('habits/add_habit/', views.addHabit, name="add_habit"),
     path('habits/delete/<int:pk>/', views.deleteHabit, name="delete_habit"),
     path('habits/toggle/', views.toggle_habit_log, name="toggle_habit_log"),
+    path('habits/batch/', views.batch_habit_logs, name="batch_habit_logs"),
     path('habits/update/<int:pk>/', views.updateHabit, name="update_habit"),
     path('habits/archive/<int:id>/', views.toggle_archive, name='toggle_archive'),
 
     # SleepLog URLs
     path('sleep/', views.get_sleep_logs, name="get_sleep_logs"),
     path('sleep/delete_day/', views.sleep_log_delete_day, name='sleep_log_delete_day'),
+    path('sleep/stats/', views.sleep_stats, name='sleep_stats'),
 
     # MoodLog URLs
     path('mood/', views.mood_log_create, name="mood_log_create"),
     path('mood/delete_day/', views.mood_log_delete_day, name="mood_log_delete_day"),
+
+    # Rollup URLs
+    path('summary/', views.rollup_summary, name="rollup_summary"),
+
+    # Heatmap URLs
+    path('heatmap/', views.year_heatmap, name="year_heatmap"),
+
+    # Import/export URLs
+    path('import/', views.import_history, name="import_history"),
+    path('export/', views.export_history, name="export_history"),
+
+    # Sync URLs
+    path('sync/', views.sync_changes, name="sync_changes"),
 ]
\ No newline at end of file
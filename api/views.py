@@ -2,10 +2,14 @@ from .serializers import HabitSerializer, SleepLogSerializer, MoodLogSerializer
 from rest_framework.decorators import api_view
 from rest_framework import status
 from rest_framework.response import Response
+from base.change_log import record_change, record_changes
 from base.models import MoodLog
+from base.rollups import refresh_day
+from base.versioning import bumps_data_version, etag_by_data_version
 
 
 @api_view(['POST'])
+@bumps_data_version
 def mood_log_create(request):
     """
     Create or update mood log for authenticated user for a given day.
@@ -24,10 +28,13 @@ def mood_log_create(request):
         date=mood_date,
         defaults={'mood': mood}
     )
+    refresh_day(request.user, mood_date, sections=('mood',))
     serializer = MoodLogSerializer(mood_log)
+    record_change(request.user, 'mood', mood_log.id, 'create' if created else 'update', serializer.data)
     return Response({'mood': mood_log.mood, 'created': created, 'id': mood_log.id}, status=status.HTTP_201_CREATED)
 
 @api_view(['DELETE'])
+@bumps_data_version
 def mood_log_delete_day(request):
     """
     Delete mood log for authenticated user for a given day.
@@ -40,12 +47,20 @@ def mood_log_delete_day(request):
         mood_date = datetime.strptime(date_str, "%Y-%m-%d").date()
     except ValueError:
         return Response({'error': 'Invalid date format'}, status=status.HTTP_400_BAD_REQUEST)
-    deleted, _ = MoodLog.objects.filter(user=request.user, date=mood_date).delete()
+    logs = MoodLog.objects.filter(user=request.user, date=mood_date)
+    removed_ids = list(logs.values_list('id', flat=True))
+    deleted, _ = logs.delete()
+    refresh_day(request.user, mood_date, sections=('mood',))
+    record_changes(request.user, [('mood', log_id, 'delete', None) for log_id in removed_ids])
     return Response({'deleted': deleted}, status=status.HTTP_200_OK)
 from datetime import date, datetime, timedelta, time
 import json
 
-from django.http import JsonResponse
+from adrf.decorators import api_view as async_api_view
+from asgiref.sync import sync_to_async
+from django.core.handlers.asgi import ASGIRequest
+from django.db import transaction
+from django.http import JsonResponse, StreamingHttpResponse
 from django.utils.dateparse import parse_datetime
 from django.utils.timezone import make_aware, get_current_timezone
 from django.utils import timezone as django_timezone
@@ -54,39 +69,60 @@ from rest_framework import status
 from rest_framework.decorators import api_view
 from rest_framework.response import Response
 
-from base.models import Habit, HabitLog, SleepLog
-from .serializers import HabitSerializer, SleepLogSerializer
+from base.bitmaps import apply_completions, bitmaps_enabled, set_completion
+from base.change_log import FullResyncRequired, changes_since, habit_log_key
+from base.data_export import aiter_chunks, stream_ndjson, stream_zipped_csv
+from base.data_import import import_stream
+from base.heatmap import HEATMAPS, SECTIONS, build_heatmap, year_range
+from base.models import Habit, HabitLog, Rollup, SleepLog
+from base.rollups import refresh_days, refresh_habit_count, refresh_sleep_intervals
+from base.sleep_stats import MAX_STATS_DAYS, cached_sleep_stats
+from base.streaks import lock_habit, record_batch, record_completion, record_removal
+from .pagination import KeysetPagination
+from .serializers import HabitSerializer, RollupSerializer, SleepLogSerializer
 
 # --- Habit endpoints ---
 
-@api_view(['GET'])
-def getData(request):
+@async_api_view(['GET'])
+@etag_by_data_version
+async def getData(request):
     """Return all habits for authenticated user."""
-    habits = Habit.objects.filter(user=request.user)
+    habits = [habit async for habit in Habit.objects.filter(user=request.user)]
     serializer = HabitSerializer(habits, many=True)
     return Response(serializer.data)
 
 @api_view(['POST'])
+@bumps_data_version
 def addHabit(request):
     """Add a new habit for authenticated user."""
     serializer = HabitSerializer(data=request.data)
     if serializer.is_valid():
         # Associate habit with current user
         serializer.save(user=request.user)
+        refresh_habit_count(request.user)
         return Response(serializer.data, status=201)
     return Response(serializer.errors, status=400)
 
 @api_view(['DELETE'])
+@bumps_data_version
 def deleteHabit(request, pk):
     """Delete a habit by primary key (only if owned by user)."""
     try:
         habit = Habit.objects.get(id=pk, user=request.user)
+        # Removing a habit drops its logs on every day it was completed
+        days = list(HabitLog.objects.filter(habit=habit, completed=True).values_list('date', flat=True))
         habit.delete()
+        refresh_days(request.user, days, sections=('habits',))
+        if not habit.archived:
+            refresh_habit_count(request.user)
+        # Clients drop the habit's logs along with it
+        record_change(request.user, 'habit', pk, 'delete')
         return Response({'message': 'Habit deleted successfully'}, status=204)
     except Habit.DoesNotExist:
         return Response({'error': 'Habit not found'}, status=404)
 
 @api_view(['PATCH'])
+@bumps_data_version
 def updateHabit(request, pk):
     """Update habit name (only if owned by user)."""
     try:
@@ -97,10 +133,12 @@ def updateHabit(request, pk):
     if not new_name:
         return Response({'error': 'Name is required'}, status=400)
     habit.name = new_name
-    habit.save()
+    habit.save(update_fields=['name'])
+    record_change(request.user, 'habit', habit.id, 'update', HabitSerializer(habit).data)
     return Response({'message': 'Habit updated successfully'}, status=200)
 
 @api_view(['PATCH'])
+@bumps_data_version
 def toggle_archive(request, id):
     """Toggle habit archived status (only if owned by user)."""
     try:
@@ -108,10 +146,20 @@ def toggle_archive(request, id):
     except Habit.DoesNotExist:
         return Response({"error": "Habit not found"}, status=404)
     habit.archived = not habit.archived
-    habit.save()
+    habit.save(update_fields=['archived'])
+    refresh_habit_count(request.user)
+    record_change(request.user, 'habit', habit.id, 'update', HabitSerializer(habit).data)
     return Response({"archived": habit.archived}, status=200)
 
+def parse_log_date(date_str):
+    """Parse a habit log date sent as YYYY-MM-DD or "Month DD, YYYY"."""
+    try:
+        return date.fromisoformat(date_str)
+    except ValueError:
+        return datetime.strptime(date_str, "%B %d, %Y").date()
+
 @api_view(['POST'])
+@bumps_data_version
 def toggle_habit_log(request):
     """
     Toggle habit log for a given habit and date.
@@ -123,46 +171,187 @@ def toggle_habit_log(request):
     if not habit_id or not date_str:
         return Response({"error": "Missing habit_id or date"}, status=400)
     try:
-        try:
-            log_date = date.fromisoformat(date_str)
-        except ValueError:
-            log_date = datetime.strptime(date_str, "%B %d, %Y").date()
+        log_date = parse_log_date(date_str)
     except Exception as e:
         return Response({"error": f"Invalid date format: {e}"}, status=400)
-    try:
-        habit = Habit.objects.get(id=habit_id, user=request.user)
-    except Habit.DoesNotExist:
-        return Response({"error": "Habit not found"}, status=404)
-    log, created = HabitLog.objects.get_or_create(habit=habit, date=log_date)
+    with transaction.atomic():
+        try:
+            habit = lock_habit(habit_id, request.user)
+        except Habit.DoesNotExist:
+            return Response({"error": "Habit not found"}, status=404)
+        log, created = HabitLog.objects.get_or_create(habit=habit, date=log_date)
+        if not created:
+            log.delete()
+            record_removal(habit, log_date)
+        else:
+            log.completed = True
+            log.save()
+            record_completion(habit, log_date)
+        if bitmaps_enabled():
+            set_completion(habit.id, log_date, created)
+        refresh_day(request.user, log_date, sections=('habits',))
+        record_change(
+            request.user, 'habit_log', habit_log_key(habit.id, log_date),
+            'create' if created else 'delete',
+            {'habit': habit.id, 'date': log_date.isoformat(), 'completed': created},
+        )
     if not created:
-        log.delete()
         return Response({"message": "Log removed"}, status=204)
-    else:
-        log.completed = True
-        log.save()
-        return Response({"message": "Log created"}, status=201)
+    return Response({"message": "Log created"}, status=201)
+
+MAX_BATCH_OPERATIONS = 1000
+
+@api_view(['POST'])
+@bumps_data_version
+def batch_habit_logs(request):
+    """
+    Apply many habit log changes in one request.
+    Expects JSON: {"operations": [{"habit_id": int, "date": "YYYY-MM-DD", "completed": bool}, ...]}
+    Ownership is checked with one query and all valid changes are applied in a
+    single transaction. Returns one result per operation, in request order.
+    """
+    operations = request.data.get("operations")
+    if not isinstance(operations, list):
+        return Response({"error": "operations must be a list"}, status=400)
+    if len(operations) > MAX_BATCH_OPERATIONS:
+        return Response({"error": f"At most {MAX_BATCH_OPERATIONS} operations per batch"}, status=400)
+
+    results = [None] * len(operations)
+    wanted = {}  # (habit_id, date) -> completed, later operations win
+    for i, op in enumerate(operations):
+        try:
+            key = (int(op["habit_id"]), parse_log_date(op["date"]))
+            completed = op.get("completed", True)
+            if not isinstance(completed, bool):
+                raise ValueError("completed must be true or false")
+        except Exception as e:
+            results[i] = {"status": "error", "error": f"Invalid operation: {e}"}
+            continue
+        wanted[key] = completed
+        results[i] = key
+
+    with transaction.atomic():
+        habits = {
+            habit.id: habit
+            for habit in Habit.objects.select_for_update().filter(
+                user=request.user, id__in={habit_id for habit_id, _ in wanted},
+            )
+        }
+        wanted = {key: completed for key, completed in wanted.items() if key[0] in habits}
+        existing = {}
+        if wanted:
+            existing = {
+                (habit_id, log_date): log_id
+                for log_id, habit_id, log_date in HabitLog.objects.filter(
+                    habit_id__in=habits.keys(),
+                    date__in={day for _, day in wanted},
+                ).values_list('id', 'habit_id', 'date')
+            }
+        to_create = [key for key, completed in wanted.items() if completed and key not in existing]
+        to_delete = [key for key, completed in wanted.items() if not completed and key in existing]
+
+        HabitLog.objects.bulk_create(
+            [HabitLog(habit_id=habit_id, user=request.user, date=log_date, completed=True)
+             for habit_id, log_date in to_create],
+            ignore_conflicts=True,
+        )
+        HabitLog.objects.filter(id__in=[existing[key] for key in to_delete]).delete()
+
+        changes = [(habit_id, day, True) for habit_id, day in to_create]
+        changes += [(habit_id, day, False) for habit_id, day in to_delete]
+        if changes:
+            if bitmaps_enabled():
+                apply_completions(changes)
+            by_habit = {}
+            for habit_id, day, completed in changes:
+                by_habit.setdefault(habit_id, {})[day] = completed
+            for habit_id, habit_changes in by_habit.items():
+                record_batch(habits[habit_id], habit_changes)
+            refresh_days(request.user, {day for _, day, _ in changes}, sections=('habits',))
+            record_changes(request.user, [
+                ('habit_log', habit_log_key(habit_id, day), 'create' if completed else 'delete',
+                 {'habit': habit_id, 'date': day.isoformat(), 'completed': completed})
+                for habit_id, day, completed in changes
+            ])
+
+    created, deleted = set(to_create), set(to_delete)
+    for i, key in enumerate(results):
+        if isinstance(key, dict):
+            continue
+        habit_id, log_date = key
+        if habit_id not in habits:
+            results[i] = {"status": "error", "error": "Habit not found"}
+            continue
+        if key in created:
+            outcome = "created"
+        elif key in deleted:
+            outcome = "removed"
+        else:
+            outcome = "unchanged"
+        results[i] = {"habit_id": habit_id, "date": log_date.isoformat(), "status": outcome}
+    return Response({"results": results}, status=200)
 
 # --- SleepLog endpoints ---
 
-@api_view(['GET', 'POST'])
-def get_sleep_logs(request):
+def parse_range_bound(value, end=False):
+    """
+    Parse a ?from=/?to= value given as YYYY-MM-DD or an ISO datetime.
+    A plain date used as the end of a range includes that whole day.
+    """
+    if not value:
+        return None
+    try:
+        day = date.fromisoformat(value)
+    except ValueError:
+        parsed = parse_datetime(value)
+        if parsed is None:
+            raise ValueError(f"Invalid date or datetime: {value!r}")
+    else:
+        parsed = datetime.combine(day + timedelta(days=1) if end else day, time.min)
+    if django_timezone.is_naive(parsed):
+        parsed = make_aware(parsed)
+    return parsed
+
+@async_api_view(['GET', 'POST'])
+@etag_by_data_version
+@bumps_data_version
+async def get_sleep_logs(request):
     """
-    GET: Return all sleep logs for authenticated user (newest first).
+    GET: Return sleep logs for authenticated user (newest first), one page at a time.
+         Optional ?from= and ?to= (YYYY-MM-DD or ISO datetime) keep logs overlapping
+         that range; follow "next" (?cursor=) for older logs, ?limit= sets the page size.
     POST: Add a new sleep log for authenticated user.
     """
     if request.method == 'GET':
-        sleep_logs = SleepLog.objects.filter(user=request.user).order_by('-end')
-        serializer = SleepLogSerializer(sleep_logs, many=True)
-        return Response(serializer.data)
+        sleep_logs = SleepLog.objects.filter(user=request.user)
+        try:
+            range_start = parse_range_bound(request.GET.get('from'))
+            range_end = parse_range_bound(request.GET.get('to'), end=True)
+        except ValueError:
+            return Response({'error': 'Invalid from/to'}, status=status.HTTP_400_BAD_REQUEST)
+        if range_end:
+            sleep_logs = sleep_logs.filter(start__lt=range_end)
+        if range_start:
+            sleep_logs = sleep_logs.filter(end__gt=range_start)
+        paginator = KeysetPagination('end')
+        page = await paginator.apaginate_queryset(sleep_logs, request)
+        serializer = SleepLogSerializer(page, many=True)
+        return paginator.get_paginated_response(serializer.data)
     elif request.method == 'POST':
-        serializer = SleepLogSerializer(data=request.data)
-        if serializer.is_valid():
-            # Associate sleep log with current user
-            serializer.save(user=request.user)
-            return Response(serializer.data, status=status.HTTP_201_CREATED)
-        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        return await sync_to_async(create_sleep_log)(request)
+
+def create_sleep_log(request):
+    """Validate and save a sleep log posted to get_sleep_logs."""
+    serializer = SleepLogSerializer(data=request.data)
+    if serializer.is_valid():
+        # Associate sleep log with current user
+        log = serializer.save(user=request.user)
+        refresh_sleep_intervals(request.user, [(log.start, log.end)])
+        return Response(serializer.data, status=status.HTTP_201_CREATED)
+    return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
 @api_view(['POST'])
+@bumps_data_version
 def sleep_log_create(request):
     """
     Create a new sleep log for authenticated user. Deletes previous log for the same night period.
@@ -179,17 +368,23 @@ def sleep_log_create(request):
     night_end = night_start + timedelta(hours=24)
     
     # Delete overlapping logs for this user in this night period
-    SleepLog.objects.filter(
+    overlapping = SleepLog.objects.filter(
         user=request.user,
         start__lt=night_end,
         end__gt=night_start
-    ).delete()
+    )
+    removed = list(overlapping.values_list('id', 'start', 'end'))
+    overlapping.delete()
     
     log = SleepLog.objects.create(user=request.user, start=start, end=end)
+    refresh_sleep_intervals(request.user, [(s, e) for _, s, e in removed] + [(start, end)])
+    record_changes(request.user, [('sleep', log_id, 'delete', None) for log_id, _, _ in removed]
+                   + [('sleep', log.id, 'create', SleepLogSerializer(log).data)])
     duration = (end - start).total_seconds() / 3600
     return Response({'id': log.id, 'duration': duration}, status=status.HTTP_201_CREATED)
 
 @api_view(['DELETE'])
+@bumps_data_version
 def sleep_log_delete_day(request):
     """
     Delete all sleep logs for authenticated user for a given day.
@@ -204,18 +399,159 @@ def sleep_log_delete_day(request):
         return Response({'error': 'Invalid date'}, status=status.HTTP_400_BAD_REQUEST)
     night_start = make_aware(datetime.combine(day - timedelta(days=1), time(20, 0)), get_current_timezone())
     night_end = night_start + timedelta(hours=16)
-    deleted, _ = SleepLog.objects.filter(
+    logs = SleepLog.objects.filter(
         user=request.user,
         start__lt=night_end,
         end__gt=night_start
-    ).delete()
+    )
+    removed = list(logs.values_list('id', 'start', 'end'))
+    deleted, _ = logs.delete()
+    refresh_sleep_intervals(request.user, [(start, end) for _, start, end in removed])
+    record_changes(request.user, [('sleep', log_id, 'delete', None) for log_id, _, _ in removed])
     return Response({'deleted': deleted}, status=status.HTTP_200_OK)
 
+
+@api_view(['GET'])
+@etag_by_data_version
+def sleep_stats(request):
+    """
+    Return sleep statistics for authenticated user.
+    Expects optional ?from=YYYY-MM-DD&to=YYYY-MM-DD (wake-up days, inclusive);
+    defaults to the 30 nights ending today.
+    """
+    try:
+        last_day = date.fromisoformat(request.GET['to']) if request.GET.get('to') else date.today()
+        first_day = (date.fromisoformat(request.GET['from']) if request.GET.get('from')
+                     else last_day - timedelta(days=29))
+    except ValueError:
+        return Response({'error': 'Invalid date format'}, status=status.HTTP_400_BAD_REQUEST)
+    if first_day > last_day:
+        return Response({'error': 'from must not be after to'}, status=status.HTTP_400_BAD_REQUEST)
+    if (last_day - first_day).days >= MAX_STATS_DAYS:
+        return Response({'error': f'Range is limited to {MAX_STATS_DAYS} days'},
+                        status=status.HTTP_400_BAD_REQUEST)
+    return Response(cached_sleep_stats(request.user, first_day, last_day), status=status.HTTP_200_OK)
+
+# --- Rollup endpoints ---
+
+@api_view(['GET'])
+@etag_by_data_version
+def rollup_summary(request):
+    """
+    Return pre-aggregated rollups for authenticated user, oldest first, one page at a time.
+    Expects ?period=day|week|month and optional ?from=YYYY-MM-DD&to=YYYY-MM-DD.
+    """
+    period = request.GET.get('period', 'week')
+    if period not in dict(Rollup.PERIOD_CHOICES):
+        return Response({'error': 'Invalid period'}, status=status.HTTP_400_BAD_REQUEST)
+    rollups = Rollup.objects.filter(user=request.user, period=period)
+    try:
+        if request.GET.get('from'):
+            rollups = rollups.filter(start__gte=date.fromisoformat(request.GET['from']))
+        if request.GET.get('to'):
+            rollups = rollups.filter(start__lte=date.fromisoformat(request.GET['to']))
+    except ValueError:
+        return Response({'error': 'Invalid date format'}, status=status.HTTP_400_BAD_REQUEST)
+    paginator = KeysetPagination('start', descending=False)
+    page = paginator.paginate_queryset(rollups, request)
+    serializer = RollupSerializer(page, many=True)
+    return paginator.get_paginated_response(serializer.data)
+
+# --- Heatmap endpoints ---
+
+@api_view(['GET'])
+@etag_by_data_version
+def year_heatmap(request):
+    """
+    Return year-at-a-glance mood and habit heatmaps for authenticated user.
+    Expects optional ?year=YYYY (default: this year) and ?section=mood|habits (default: both).
+    See base.heatmap for the encoding.
+    """
+    try:
+        year = int(request.GET.get('year') or date.today().year)
+        year_range(year)
+    except ValueError:
+        return Response({'error': 'Invalid year'}, status=status.HTTP_400_BAD_REQUEST)
+    section = request.GET.get('section')
+    if section and section not in HEATMAPS:
+        return Response({'error': 'Invalid section'}, status=status.HTTP_400_BAD_REQUEST)
+    sections = (section,) if section else SECTIONS
+    return Response(build_heatmap(request.user, year, sections), status=status.HTTP_200_OK)
+
+# --- Import endpoints ---
+
+@api_view(['POST'])
+@bumps_data_version
+def import_history(request):
+    """
+    Import habit, sleep and mood history for authenticated user.
+    The request body is streamed as NDJSON (default) or CSV (Content-Type: text/csv),
+    one record per line; see base.data_import for the record format.
+    """
+    fmt = 'csv' if request.content_type.startswith('text/csv') else 'ndjson'
+    # Read the raw stream so the body is never parsed or buffered as a whole
+    summary = import_stream(request.user, request.stream or [], fmt=fmt)
+    return Response(summary, status=status.HTTP_200_OK)
+
+# --- Sync endpoints ---
+
+@api_view(['GET'])
+def sync_changes(request):
+    """
+    Return the authenticated user's changes after a sync token, oldest first.
+    Expects ?since=<token> (0 or omitted for the whole log).
+    Create and update entries carry the object's current data and should be
+    applied as upserts. Responds 410 with a fresh token when the token is older
+    than the compacted log; the client must then refetch everything and sync
+    from that token.
+    """
+    try:
+        since = int(request.GET.get('since') or 0)
+    except ValueError:
+        return Response({'error': 'Invalid sync token'}, status=status.HTTP_400_BAD_REQUEST)
+    try:
+        entries, token, has_more = changes_since(request.user, since)
+    except FullResyncRequired as e:
+        return Response({'full_resync': True, 'token': e.token}, status=status.HTTP_410_GONE)
+    changes = [
+        {'kind': entry.kind, 'key': entry.key, 'action': entry.action, 'data': entry.data}
+        for entry in entries
+    ]
+    return Response({'changes': changes, 'token': token, 'has_more': has_more})
+
+# --- Export endpoints ---
+
+@api_view(['GET'])
+@etag_by_data_version
+def export_history(request):
+    """
+    Stream all habits, habit logs, sleep logs and mood logs of authenticated user.
+    Use ?fmt=ndjson (default) or ?fmt=csv for a zip with one CSV file per table.
+    """
+    fmt = request.GET.get('fmt', 'ndjson')
+    stamp = date.today().isoformat()
+    # Under ASGI a sync iterator would be read into memory whole before the first byte
+    asgi = isinstance(request._request, ASGIRequest)
+
+    def body(chunks):
+        return aiter_chunks(chunks) if asgi else chunks
+
+    if fmt == 'csv':
+        response = StreamingHttpResponse(body(stream_zipped_csv(request.user)), content_type='application/zip')
+        response['Content-Disposition'] = f'attachment; filename="habits-export-{stamp}.zip"'
+    elif fmt == 'ndjson':
+        response = StreamingHttpResponse(body(stream_ndjson(request.user)), content_type='application/x-ndjson')
+        response['Content-Disposition'] = f'attachment; filename="habits-export-{stamp}.ndjson"'
+    else:
+        return Response({'error': 'Invalid format'}, status=status.HTTP_400_BAD_REQUEST)
+    return response
+
 # --- Legacy/alternative sleep log save (not used by REST API) ---
 
 from django.views.decorators.csrf import csrf_exempt
 
 @csrf_exempt
+@bumps_data_version
 def save_sleep(request):
     """
     Save sleep log for authenticated user (used by non-REST API clients).
@@ -238,12 +574,17 @@ def save_sleep(request):
     sleep_date = end.date()
     night_start = make_aware(datetime.combine(sleep_date - timedelta(days=1), time(20, 0)))
     night_end = make_aware(datetime.combine(sleep_date, time(12, 0)))
-    SleepLog.objects.filter(
+    overlapping = SleepLog.objects.filter(
         user=request.user,
         start__lt=night_end,
         end__gt=night_start
-    ).delete()
+    )
+    removed = list(overlapping.values_list('id', 'start', 'end'))
+    overlapping.delete()
     new_log = SleepLog.objects.create(user=request.user, start=start, end=end)
+    refresh_sleep_intervals(request.user, [(s, e) for _, s, e in removed] + [(start, end)])
+    record_changes(request.user, [('sleep', log_id, 'delete', None) for log_id, _, _ in removed]
+                   + [('sleep', new_log.id, 'create', SleepLogSerializer(new_log).data)])
     return JsonResponse({
         "id": new_log.id,
         "start": new_log.start.isoformat(),
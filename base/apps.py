@@ -1,6 +1,14 @@
 from django.apps import AppConfig
+from django.conf import settings
 
 
 class BaseConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'base'
+
+    def ready(self):
+        # Connect the user cache invalidation signals
+        from . import auth_backends  # noqa: F401
+        if settings.SLOW_QUERY_THRESHOLD_MS > 0:
+            from .slow_queries import install
+            install()
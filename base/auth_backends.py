@@ -0,0 +1,64 @@
+"""
+Authentication backend with a cached user loader.
+
+`AuthenticationMiddleware` resolves request.user from the session on every
+page view, which costs a `User` query before any tracker work starts. This
+backend keeps recently loaded users in a small per-process TTL cache. Django
+still checks the session auth hash against the cached user. Logout and saving
+or deleting the user (e.g. a password change or deactivation) invalidate the
+user's auth version in the shared cache (see base.auth_versions), which every
+process checks before trusting a cached user. Entries expire after
+USER_CACHE_TTL seconds regardless, and the cache is off by default unless
+that shared cache really is shared between workers (REDIS_URL).
+"""
+
+import copy
+
+from django.conf import settings
+from django.contrib.auth.backends import ModelBackend
+from django.contrib.auth.signals import user_logged_out
+from django.dispatch import receiver
+
+from .auth_versions import aget_auth_version, get_auth_version, invalidate_auth
+from .ttl_cache import TTLCache
+
+user_cache = TTLCache(
+    max_size=getattr(settings, 'USER_CACHE_SIZE', 10000),
+    ttl=getattr(settings, 'USER_CACHE_TTL', 60),
+)
+
+
+class CachedModelBackend(ModelBackend):
+    """ModelBackend whose get_user() is served from `user_cache` when possible."""
+
+    def _cached(self, user_id, version):
+        entry = user_cache.get(int(user_id))
+        if entry is None or entry[1] != version:
+            return None
+        # Each request gets its own instance, so per-request changes never leak
+        return copy.copy(entry[0])
+
+    def _remember(self, user, version):
+        if user is not None:
+            user_cache.set(user.pk, (copy.copy(user), version))
+        return user
+
+    def get_user(self, user_id):
+        # The version is read before the query, so a change racing with it leaves the entry stale
+        version = get_auth_version(user_id)
+        return self._cached(user_id, version) or self._remember(super().get_user(user_id), version)
+
+    async def aget_user(self, user_id):
+        version = await aget_auth_version(user_id)
+        return self._cached(user_id, version) or self._remember(await super().aget_user(user_id), version)
+
+
+def invalidate_user(user_id):
+    user_cache.delete(user_id)
+    invalidate_auth(user_id)
+
+
+@receiver(user_logged_out)
+def user_logged_out_handler(sender, request, user, **kwargs):
+    if user is not None:
+        invalidate_user(user.pk)
@@ -0,0 +1,65 @@
+"""
+Per-user authentication versions in the shared cache.
+
+The in-process token and user caches can only be cleared directly in the
+worker that handled a logout, password change or deactivation. Every other worker checks the
+user's auth version in the shared Django cache before trusting an entry, and
+`invalidate_auth` gives the user a new version, so stale entries are rejected
+by every worker on their next use.
+
+A version is a random string rather than a counter: when the shared cache
+loses a key, the next reader creates a fresh version, which can never match an
+entry cached before the key was lost.
+"""
+
+import uuid
+
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+
+def auth_version_key(user_id):
+    return f'auth_version:{user_id}'
+
+
+def get_auth_version(user_id):
+    """Return the user's current auth version, creating one if there is none."""
+    key = auth_version_key(user_id)
+    version = cache.get(key)
+    if version is None:
+        # add() keeps whichever version a concurrent reader stored first
+        version = uuid.uuid4().hex
+        if not cache.add(key, version, timeout=None):
+            version = cache.get(key) or version
+    return version
+
+
+async def aget_auth_version(user_id):
+    """Async version of `get_auth_version`."""
+    key = auth_version_key(user_id)
+    version = await cache.aget(key)
+    if version is None:
+        version = uuid.uuid4().hex
+        if not await cache.aadd(key, version, timeout=None):
+            version = await cache.aget(key) or version
+    return version
+
+
+def invalidate_auth(user_id):
+    """Make every worker's cached tokens and users for `user_id` stale."""
+    key = auth_version_key(user_id)
+    cache.delete(key)
+    # Again once the change is committed, in case another worker cached the old row meanwhile
+    transaction.on_commit(lambda: cache.delete(key))
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def user_changed(sender, instance, update_fields=None, **kwargs):
+    # Logins only touch last_login, which cached users need not reflect
+    if update_fields is not None and set(update_fields) == {'last_login'}:
+        return
+    invalidate_auth(instance.pk)
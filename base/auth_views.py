@@ -138,7 +138,7 @@ def register_view(request):
         )
         
         # Log the user in automatically after registration
-        auth_login(request, user)
+        auth_login(request, user, backend='base.auth_backends.CachedModelBackend')
         messages.success(request, 'Account created successfully! Welcome to Habit Tracker.')
         return redirect('tracker', section='habits', period='week')
     
@@ -0,0 +1,284 @@
+"""
+Seeded load generation and end-to-end benchmarks.
+
+`seed_dataset` creates benchmark users (usernames starting with
+BENCH_PREFIX and a per-run tag, with unusable passwords) with years of habit, sleep and mood history drawn from a
+seeded random generator, so two runs with the same arguments see the same
+data. `run_benchmark` then drives every tracker page and API endpoint
+through the test client and reports latency percentiles, query counts and response
+sizes per endpoint. `compare_plans` shows how user-wide habit log reads are
+planned and how long they take when joined through `Habit` versus filtered
+on the denormalized `HabitLog.user`. Used by the `benchmark` management command.
+"""
+
+import json
+import random
+import secrets
+import time
+from datetime import date, datetime, timedelta
+from datetime import time as day_time
+
+import numpy as np
+from django.contrib.auth.hashers import UNUSABLE_PASSWORD_PREFIX
+from django.contrib.auth.models import User
+from django.db import connection
+from django.db.models import Count
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from django.utils.timezone import make_aware
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from base.bitmaps import bitmaps_enabled, rebuild_bitmaps
+from base.models import Habit, HabitLog, MoodLog, SleepLog
+from base.rollups import rebuild_user
+from base.slow_queries import explain, plan_usage
+from base.streaks import rebuild_stats
+from base.versioning import bump_versions
+
+BENCH_PREFIX = 'bench-'
+HABIT_NAMES = ['Exercise', 'Read', 'Meditate', 'Journal', 'Stretch', 'Language practice',
+               'No sugar', 'Walk', 'Floss', 'Cold shower', 'Practice guitar', 'Plan the day']
+SECTIONS = ('habits', 'sleep', 'mood')
+PERIODS = ('day', 'week', 'month')
+SCRATCH_HABIT = 'Benchmark scratch'
+
+
+def delete_dataset(users):
+    """
+    Delete the benchmark users returned by `seed_dataset` and, through
+    cascades, their data. Only those ids are deleted, never real accounts
+    that happen to share the prefix.
+    """
+    deleted, _ = User.objects.filter(
+        pk__in=[user.pk for user in users], password__startswith=UNUSABLE_PASSWORD_PREFIX,
+    ).delete()
+    return deleted
+
+
+def _habit_days(rng, days):
+    """Yield the days a habit was completed, with streaks and a per-habit base rate."""
+    base = rng.uniform(0.25, 0.9)
+    completed = False
+    for day in days:
+        # Completing a habit makes the next day more likely, missing it less likely
+        chance = min(base + 0.25, 0.97) if completed else max(base - 0.2, 0.03)
+        completed = rng.random() < chance
+        if completed:
+            yield day
+
+
+def _sleep_log(rng, user, day):
+    """A night waking on `day`: bedtime around 23:15, about 7.5 hours long."""
+    bedtime = rng.gauss(23.25, 0.9) + (1.0 if day.weekday() >= 5 else 0.0)
+    hours = min(max(rng.gauss(7.4, 0.9), 4), 11)
+    start = make_aware(datetime.combine(day - timedelta(days=1), day_time.min) + timedelta(hours=bedtime))
+    return SleepLog(user=user, start=start, end=start + timedelta(hours=hours))
+
+
+def seed_dataset(num_users, num_habits, years, seed=0, batch_size=2000):
+    """
+    Create `num_users` benchmark users with `num_habits` habits each and
+    `years` years of history ending today. Returns the users and row counts.
+    """
+    # Seeded so runs are reproducible; nothing here is security sensitive
+    rng = random.Random(seed)  # nosec B311
+    last_day = date.today()
+    days = [last_day - timedelta(days=i) for i in range(round(365 * years) - 1, -1, -1)]
+    # A fresh tag per run keeps the usernames clear of existing accounts and kept runs
+    tag = secrets.token_hex(4)
+    usernames = [f'{BENCH_PREFIX}{tag}-{i}' for i in range(num_users)]
+    users = [User(username=username) for username in usernames]
+    for user in users:
+        user.set_unusable_password()
+    User.objects.bulk_create(users)
+    users = list(User.objects.filter(username__in=usernames).order_by('id'))
+    Token.objects.bulk_create([Token(user=user, key=Token.generate_key()) for user in users])
+
+    counts = {'habit_logs': 0, 'sleep_logs': 0, 'mood_logs': 0}
+    for user in users:
+        habits = Habit.objects.bulk_create([
+            Habit(user=user, name=HABIT_NAMES[i % len(HABIT_NAMES)], archived=rng.random() < 0.1)
+            for i in range(num_habits)
+        ])
+        logs = [HabitLog(habit=habit, user=user, date=day) for habit in habits for day in _habit_days(rng, days)]
+        sleep = [_sleep_log(rng, user, day) for day in days if rng.random() < 0.85]
+        moods = [
+            MoodLog(user=user, date=day, mood=min(max(round(rng.gauss(6.5, 1.8)), 0), 10))
+            for day in days if rng.random() < 0.55
+        ]
+        HabitLog.objects.bulk_create(logs, batch_size=batch_size)
+        SleepLog.objects.bulk_create(sleep, batch_size=batch_size)
+        MoodLog.objects.bulk_create(moods, batch_size=batch_size)
+        counts['habit_logs'] += len(logs)
+        counts['sleep_logs'] += len(sleep)
+        counts['mood_logs'] += len(moods)
+
+        for habit in Habit.objects.filter(user=user):
+            rebuild_stats(habit)
+        rebuild_user(user)
+    if bitmaps_enabled():
+        rebuild_bitmaps(Habit.objects.filter(user__in=users).values_list('id', flat=True))
+    bump_versions(user.pk for user in users)
+    return users, counts
+
+
+def _page_requests(day):
+    """Yield (name, method, path, params) for every tracker page around `day`."""
+    params = {
+        'day': {'start_date': day.isoformat()},
+        'week': {'week': day.isoformat()},
+        'month': {'month': day.strftime('%Y-%m')},
+    }
+    for section in SECTIONS:
+        for period in PERIODS:
+            path = f'/track/{section}/{period}/'
+            # The habit tracker takes start_date for every period
+            yield path, 'get', path, params['day'] if section == 'habits' else params[period]
+
+
+def _api_requests(rng, day, habit_ids):
+    """
+    Yield (name, method, path, data) for every API endpoint that is safe to
+    repeat. Writes are paired so the seeded data keeps its shape. Register,
+    login and logout are left out: registered users would outlive the run,
+    benchmark users have unusable passwords, and logging out would revoke
+    the token the run authenticates with.
+    """
+    year_ago = (day - timedelta(days=364)).isoformat()
+    yield 'GET /api/auth/verify/', 'get', '/api/auth/verify/', None
+    yield 'GET /api/habits/', 'get', '/api/habits/', None
+    yield 'GET /api/sleep/', 'get', '/api/sleep/', {'from': year_ago, 'to': day.isoformat()}
+    yield 'GET /api/sleep/stats/', 'get', '/api/sleep/stats/', {'from': year_ago, 'to': day.isoformat()}
+    for period in ('day', 'week', 'month'):
+        yield f'GET /api/summary/?period={period}', 'get', '/api/summary/', {'period': period, 'from': year_ago}
+    yield 'GET /api/heatmap/', 'get', '/api/heatmap/', {'year': day.year}
+    yield 'GET /api/sync/', 'get', '/api/sync/', {'since': 0}
+    yield 'GET /api/export/', 'get', '/api/export/', {'fmt': 'ndjson'}
+    if habit_ids:
+        habit_id = rng.choice(habit_ids)
+        # Toggled twice so the dataset ends up unchanged
+        for _ in range(2):
+            yield 'POST /api/habits/toggle/', 'post', '/api/habits/toggle/', {'habit_id': habit_id, 'date': day.isoformat()}
+        operations = [{'habit_id': habit_id, 'date': day.isoformat(), 'completed': completed}
+                      for completed in (True, False)]
+        yield 'POST /api/habits/batch/', 'post', '/api/habits/batch/', {'operations': operations}
+    yield 'POST /api/habits/add_habit/', 'post', '/api/habits/add_habit/', {'name': SCRATCH_HABIT}
+    # The night waking on `day` is deleted and logged again
+    yield 'DELETE /api/sleep/delete_day/', 'delete', f'/api/sleep/delete_day/?date={day.isoformat()}', None
+    night = _sleep_log(rng, None, day)
+    yield 'POST /api/sleep/', 'post', '/api/sleep/', {'start': night.start.isoformat(), 'end': night.end.isoformat()}
+    yield 'DELETE /api/mood/delete_day/', 'delete', f'/api/mood/delete_day/?date={day.isoformat()}', None
+    yield 'POST /api/mood/', 'post', '/api/mood/', {'date': day.isoformat(), 'mood': rng.randint(0, 10)}
+    record = {'type': 'mood', 'date': day.isoformat(), 'mood': rng.randint(0, 10)}
+    yield 'POST /api/import/', 'post', '/api/import/', json.dumps(record) + '\n'
+
+
+def _scratch_habit_requests(habit_id, day):
+    """Yield (name, method, path, data) that rename, archive, log and delete the habit `habit_id`."""
+    yield 'PATCH /api/habits/update/', 'patch', f'/api/habits/update/{habit_id}/', {'name': f'{SCRATCH_HABIT} (renamed)'}
+    # Archived and restored so the delete below takes the unarchived path
+    for _ in range(2):
+        yield 'PATCH /api/habits/archive/', 'patch', f'/api/habits/archive/{habit_id}/', None
+    yield 'POST /api/habits/toggle/', 'post', '/api/habits/toggle/', {'habit_id': habit_id, 'date': day.isoformat()}
+    yield 'DELETE /api/habits/delete/', 'delete', f'/api/habits/delete/{habit_id}/', None
+
+
+def _measure(client, method, path, data):
+    """Send one request and return (status, seconds, queries, bytes). String data is sent as NDJSON."""
+    send = getattr(client, method)
+    if isinstance(data, str):
+        kwargs = {'content_type': 'application/x-ndjson'}
+    else:
+        kwargs = {'format': 'json'} if method != 'get' else {}
+    with CaptureQueriesContext(connection) as ctx:
+        started = time.perf_counter()
+        response = send(path, data, secure=True, **kwargs)
+        body = b''.join(response.streaming_content) if response.streaming else response.content
+        elapsed = time.perf_counter() - started
+    return response.status_code, elapsed, len(ctx.captured_queries), len(body)
+
+
+def _summarize(samples):
+    seconds, queries, sizes = (np.array(values) for values in zip(*(s[1:] for s in samples)))
+    statuses = {}
+    for sample in samples:
+        statuses[str(sample[0])] = statuses.get(str(sample[0]), 0) + 1
+    p50, p95, p99 = np.percentile(seconds * 1000, [50, 95, 99])
+    return {
+        'requests': len(samples),
+        'status': statuses,
+        'p50_ms': round(float(p50), 3),
+        'p95_ms': round(float(p95), 3),
+        'p99_ms': round(float(p99), 3),
+        'mean_ms': round(float(seconds.mean() * 1000), 3),
+        'queries': {'mean': round(float(queries.mean()), 2), 'max': int(queries.max())},
+        'bytes': {'mean': round(float(sizes.mean()), 1), 'max': int(sizes.max())},
+    }
+
+
+def _range_reads(day):
+    """Yield (name, queryset factory) for user-wide habit log reads around `day`."""
+    month_start = day.replace(day=1)
+    year_start = day.replace(month=1, day=1)
+    yield 'completions in month', lambda owner: HabitLog.objects.filter(
+        **owner, date__gte=month_start, date__lt=month_start + timedelta(days=31), completed=True,
+    ).values_list('habit_id', 'date')
+    yield 'completions per day in year', lambda owner: HabitLog.objects.filter(
+        **owner, date__gte=year_start, date__lt=year_start.replace(year=year_start.year + 1), completed=True,
+    ).values('date').annotate(count=Count('id')).values_list('date', 'count').order_by()
+
+
+def compare_plans(user, day, runs=20):
+    """
+    EXPLAIN and time each user-wide habit log read, once joined through
+    `Habit` (before) and once on the denormalized `HabitLog.user` (after).
+    """
+    plans = {}
+    for name, build in _range_reads(day):
+        plans[name] = {}
+        for variant, owner in (('before', {'habit__user': user}), ('after', {'user': user})):
+            queryset = build(owner)
+            sql, params = queryset.query.get_compiler(using=queryset.db).as_sql()
+            plan = explain(connection, sql, params)
+            indexes, full_scans = plan_usage(plan)
+            timings = []
+            for _ in range(runs):
+                started = time.perf_counter()
+                list(build(owner))
+                timings.append(time.perf_counter() - started)
+            plans[name][variant] = {
+                'plan': plan,
+                'indexes': indexes,
+                'full_scans': full_scans,
+                'median_ms': round(float(np.median(timings)) * 1000, 3),
+            }
+    return plans
+
+
+def run_benchmark(users, iterations, years, seed=0):
+    """
+    Request every tracker page and API endpoint `iterations` times per user,
+    each time around a random day of the seeded range. Returns per-endpoint stats.
+    """
+    # Seeded so runs are reproducible; nothing here is security sensitive
+    rng = random.Random(seed)  # nosec B311
+    span = max(round(365 * years) - 1, 0)
+    samples = {}
+    for user in users:
+        browser = Client()
+        browser.force_login(user)
+        api = APIClient()
+        api.credentials(HTTP_AUTHORIZATION=f'Token {Token.objects.get(user=user).key}')
+        habit_ids = list(Habit.objects.filter(user=user).values_list('id', flat=True))
+        for _ in range(iterations):
+            day = date.today() - timedelta(days=rng.randint(0, span))
+            requests = [(browser, *request) for request in _page_requests(day)]
+            requests += [(api, *request) for request in _api_requests(rng, day, habit_ids)]
+            for client, name, method, path, data in requests:
+                samples.setdefault(name, []).append(_measure(client, method, path, data))
+            # The habit added above is changed and deleted again
+            scratch_id = Habit.objects.filter(user=user, name=SCRATCH_HABIT).order_by('id').values_list('id', flat=True).last()
+            for name, method, path, data in _scratch_habit_requests(scratch_id, day):
+                samples.setdefault(name, []).append(_measure(api, method, path, data))
+    return {name: _summarize(endpoint_samples) for name, endpoint_samples in samples.items()}
@@ -0,0 +1,152 @@
+"""
+Bitmap-backed habit completion store.
+
+Keeps one `HabitYearBitmap` row per habit per year, where bit N marks day N
+of the year as completed. The bitmaps are maintained alongside `HabitLog`
+when `HABIT_BITMAPS_ENABLED` is on, and let month grids, streaks and yearly
+views read a few bytes per habit-year instead of one row per completed day.
+"""
+
+from datetime import date, timedelta
+
+from django.conf import settings
+from django.db import transaction
+
+from base.models import HabitLog, HabitYearBitmap
+
+BITMAP_BYTES = 46  # 366 bits, rounded up to whole bytes
+
+
+def bitmaps_enabled():
+    return getattr(settings, 'HABIT_BITMAPS_ENABLED', False)
+
+
+def day_index(day):
+    """Return the bit index of `day` within its year."""
+    return day.timetuple().tm_yday - 1
+
+
+def is_set(bits, index):
+    return bool(bits[index >> 3] & (1 << (index & 7)))
+
+
+def set_bit(bits, index, value):
+    """Set or clear a bit in a mutable bytearray."""
+    if value:
+        bits[index >> 3] |= 1 << (index & 7)
+    else:
+        bits[index >> 3] &= ~(1 << (index & 7)) & 0xFF
+
+
+def set_completion(habit_id, day, completed):
+    """
+    Mark `day` as completed (or not) in the habit's bitmap for that year.
+    The row is locked while it is updated, so concurrent toggles on the same
+    habit-year cannot lose each other's bits.
+    """
+    with transaction.atomic():
+        row, _ = HabitYearBitmap.objects.get_or_create(habit_id=habit_id, year=day.year)
+        row = HabitYearBitmap.objects.select_for_update().get(pk=row.pk)
+        bits = bytearray(row.bits)
+        set_bit(bits, day_index(day), completed)
+        row.bits = bytes(bits)
+        row.save(update_fields=['bits'])
+
+
+def apply_completions(changes):
+    """
+    Apply many (habit_id, day, completed) changes at once, locking and
+    rewriting each affected habit-year bitmap a single time.
+    """
+    keys = {(habit_id, day.year) for habit_id, day, _ in changes}
+    if not keys:
+        return
+    with transaction.atomic():
+        HabitYearBitmap.objects.bulk_create(
+            [HabitYearBitmap(habit_id=habit_id, year=year) for habit_id, year in keys],
+            ignore_conflicts=True,
+        )
+        rows = {
+            (row.habit_id, row.year): row
+            for row in HabitYearBitmap.objects.select_for_update().filter(
+                habit_id__in={habit_id for habit_id, _ in keys},
+                year__in={year for _, year in keys},
+            )
+            if (row.habit_id, row.year) in keys
+        }
+        bits = {key: bytearray(row.bits) for key, row in rows.items()}
+        for habit_id, day, completed in changes:
+            set_bit(bits[(habit_id, day.year)], day_index(day), completed)
+        for key, row in rows.items():
+            row.bits = bytes(bits[key])
+        HabitYearBitmap.objects.bulk_update(rows.values(), ['bits'])
+
+
+def _bitmap_rows(habit_ids, start, end):
+    return HabitYearBitmap.objects.filter(
+        habit_id__in=habit_ids,
+        year__gte=start.year,
+        year__lte=(end - timedelta(days=1)).year,
+    ).values_list('habit_id', 'year', 'bits')
+
+
+def load_bitmaps(habit_ids, start, end):
+    """
+    Load the bitmaps covering `start` <= day < `end` for the given habits.
+    Returns {(habit_id, year): bytes} from a single query.
+    """
+    rows = _bitmap_rows(habit_ids, start, end)
+    return {(habit_id, year): bytes(bits) for habit_id, year, bits in rows}
+
+
+async def aload_bitmaps(habit_ids, start, end):
+    """Async version of `load_bitmaps`."""
+    rows = _bitmap_rows(habit_ids, start, end)
+    return {(habit_id, year): bytes(bits) async for habit_id, year, bits in rows}
+
+
+def completion_row(bitmaps, habit_id, start, num_days):
+    """Return one boolean per day for `num_days` days starting at `start`."""
+    row = []
+    day = start
+    for _ in range(num_days):
+        bits = bitmaps.get((habit_id, day.year))
+        row.append(bool(bits) and is_set(bits, day_index(day)))
+        day += timedelta(days=1)
+    return row
+
+
+def completed_days(bits, year):
+    """Return every completed date stored in one year's bitmap."""
+    first = date(year, 1, 1)
+    return [
+        first + timedelta(days=i)
+        for i in range(min(len(bits) * 8, 366))
+        if is_set(bits, i) and (first + timedelta(days=i)).year == year
+    ]
+
+
+def rebuild_bitmaps(habit_ids=None, batch_size=500):
+    """
+    Rebuild bitmaps from `HabitLog` rows, optionally for a subset of habits.
+    Returns the number of habit-year bitmaps written.
+    """
+    logs = HabitLog.objects.filter(completed=True)
+    existing = HabitYearBitmap.objects.all()
+    if habit_ids is not None:
+        logs = logs.filter(habit_id__in=habit_ids)
+        existing = existing.filter(habit_id__in=habit_ids)
+
+    bitmaps = {}
+    for habit_id, log_date in logs.values_list('habit_id', 'date').iterator(chunk_size=2000):
+        bits = bitmaps.setdefault((habit_id, log_date.year), bytearray(BITMAP_BYTES))
+        set_bit(bits, day_index(log_date), True)
+
+    rows = [
+        HabitYearBitmap(habit_id=habit_id, year=year, bits=bytes(bits))
+        for (habit_id, year), bits in bitmaps.items()
+    ]
+    with transaction.atomic():
+        existing.delete()
+        HabitYearBitmap.objects.bulk_create(rows, batch_size=batch_size)
+    return len(rows)
@@ -0,0 +1,134 @@
+"""
+Per-user change log for delta sync.
+
+Every write path appends (kind, key, action, data) entries describing the
+habits, habit logs, sleep logs and mood logs it created, updated or deleted.
+Entries are numbered per user, and clients keep the number of the last entry
+they applied as a sync token and ask for everything after it. Numbers are
+taken from the user's `DataVersion` row, which stays locked until the writing
+transaction commits, so a user's entries become visible in number order and a
+client never advances past an entry that is yet to commit. `compact` keeps the log bounded: superseded entries
+for the same object are dropped, and entries older than the retention window
+are trimmed, raising the user's sync floor so that older tokens are told to
+do a full resync instead of silently missing changes.
+"""
+
+from datetime import timedelta
+
+from django.db import transaction
+from django.db.models import F, Max, Subquery, Value
+from django.utils import timezone
+
+from base.models import ChangeLogEntry, DataVersion
+
+MAX_SYNC_CHANGES = 1000
+
+
+class FullResyncRequired(Exception):
+    """Raised when a sync token is older than the compacted part of the log."""
+
+    def __init__(self, token):
+        super().__init__("Sync token expired, full resync required")
+        self.token = token
+
+
+def habit_log_key(habit_id, day):
+    return f"{habit_id}:{day.isoformat()}"
+
+
+def reserve_seqs(user_id, count):
+    """
+    Reserve the next `count` sequence numbers of the user and return an
+    expression for the last one, to number the entries inserted next. Must run
+    in the transaction that inserts them.
+    """
+    versions = DataVersion.objects.filter(user_id=user_id)
+    # The UPDATE locks the row until commit, serializing the user's writers
+    if not versions.update(change_seq=F('change_seq') + count):
+        _, created = DataVersion.objects.get_or_create(user_id=user_id, defaults={'change_seq': count})
+        if not created:
+            versions.update(change_seq=F('change_seq') + count)
+    return Subquery(versions.values('change_seq'))
+
+
+def record_change(user, kind, key, action, data=None):
+    """Append one change to the user's log."""
+    with transaction.atomic(savepoint=False):
+        last = reserve_seqs(user.pk, 1)
+        ChangeLogEntry.objects.create(user_id=user.pk, seq=last, kind=kind, key=str(key), action=action, data=data)
+
+
+def record_changes(user, changes):
+    """Append many (kind, key, action, data) changes with a single insert."""
+    if not changes:
+        return
+    with transaction.atomic(savepoint=False):
+        last = reserve_seqs(user.pk, len(changes))
+        ChangeLogEntry.objects.bulk_create([
+            ChangeLogEntry(user_id=user.pk, seq=last - Value(len(changes) - 1 - i),
+                           kind=kind, key=str(key), action=action, data=data)
+            for i, (kind, key, action, data) in enumerate(changes)
+        ])
+
+
+def latest_token(user_id):
+    """Return a token that is at least as new as every committed entry of the user."""
+    seq = DataVersion.objects.filter(user_id=user_id).values_list('change_seq', flat=True).first()
+    return seq or 0
+
+
+def get_sync_floor(user):
+    floor = DataVersion.objects.filter(user_id=user.pk).values_list('sync_floor', flat=True).first()
+    return floor or 0
+
+
+def raise_sync_floor(user_id, floor):
+    """Invalidate every sync token of the user below `floor`."""
+    updated = DataVersion.objects.filter(user_id=user_id, sync_floor__lt=floor).update(sync_floor=floor)
+    if not updated:
+        DataVersion.objects.get_or_create(user_id=user_id, defaults={'sync_floor': floor})
+
+
+def require_full_resync(user):
+    """
+    Force every client of `user` to resync from scratch, e.g. after a bulk
+    import that is not recorded entry by entry.
+    """
+    # Skip a number, so that even an up-to-date token falls below the floor
+    with transaction.atomic(savepoint=False):
+        reserve_seqs(user.pk, 1)
+        raise_sync_floor(user.pk, latest_token(user.pk))
+
+
+def changes_since(user, since, limit=MAX_SYNC_CHANGES):
+    """
+    Return (entries, token, has_more) for the user's changes after `since`.
+    Raises FullResyncRequired when `since` predates the compacted log.
+    """
+    if since < get_sync_floor(user):
+        raise FullResyncRequired(latest_token(user.pk))
+    entries = list(ChangeLogEntry.objects.filter(user_id=user.pk, seq__gt=since).order_by('seq')[:limit + 1])
+    has_more = len(entries) > limit
+    entries = entries[:limit]
+    token = entries[-1].seq if entries else since
+    return entries, token, has_more
+
+
+def compact(retention_days=30):
+    """
+    Drop superseded entries and trim entries older than `retention_days`.
+    Returns (superseded, trimmed) entry counts.
+    """
+    with transaction.atomic():
+        # Only the newest entry per object matters: clients apply create and
+        # update as an upsert, so a later entry carries the full current state
+        latest = ChangeLogEntry.objects.values('user', 'kind', 'key').annotate(last=Max('id')).values('last')
+        superseded, _ = ChangeLogEntry.objects.exclude(id__in=latest).delete()
+
+        cutoff = timezone.now() - timedelta(days=retention_days)
+        old = ChangeLogEntry.objects.filter(created_at__lt=cutoff)
+        floors = old.values('user').annotate(last=Max('seq')).values_list('user', 'last')
+        for user_id, last in floors:
+            raise_sync_floor(user_id, last)
+        trimmed, _ = old.delete()
+    return superseded, trimmed
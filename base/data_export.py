@@ -0,0 +1,128 @@
+"""
+Streaming full-account export.
+
+Produces a user's habits, habit logs, sleep logs and mood logs as NDJSON or
+as a zip of CSV files, using the record format read by base.data_import.
+Rows are pulled from the database in chunks and written out as they arrive,
+so memory use does not depend on the size of the history. Under ASGI the
+streams must be wrapped in `aiter_chunks`: Django reads a sync iterator
+completely before sending anything there.
+"""
+
+import csv
+import io
+import json
+import zipfile
+
+from asgiref.sync import sync_to_async
+
+from base.models import Habit, HabitLog, MoodLog, SleepLog
+
+CHUNK_SIZE = 2000
+FLUSH_BYTES = 64 * 1024
+
+EXPORT_COLUMNS = {
+    'habits': ['type', 'habit', 'description', 'archived'],
+    'habit_logs': ['type', 'habit', 'date', 'completed'],
+    'sleep': ['type', 'start', 'end'],
+    'mood': ['type', 'date', 'mood', 'note'],
+}
+
+
+def iter_records(user):
+    """Yield (table, record) pairs for every row the user owns."""
+    habits = Habit.objects.filter(user=user).order_by('id')
+    for name, description, archived in habits.values_list('name', 'description', 'archived').iterator(chunk_size=CHUNK_SIZE):
+        yield 'habits', {'type': 'habit', 'habit': name, 'description': description, 'archived': archived}
+
+    logs = HabitLog.objects.filter(user=user).order_by('date', 'habit_id')
+    for name, log_date, completed in logs.values_list('habit__name', 'date', 'completed').iterator(chunk_size=CHUNK_SIZE):
+        yield 'habit_logs', {'type': 'habit_log', 'habit': name, 'date': log_date.isoformat(), 'completed': completed}
+
+    sleep = SleepLog.objects.filter(user=user).order_by('start', 'id')
+    for start, end in sleep.values_list('start', 'end').iterator(chunk_size=CHUNK_SIZE):
+        yield 'sleep', {'type': 'sleep', 'start': start.isoformat(), 'end': end.isoformat()}
+
+    moods = MoodLog.objects.filter(user=user).order_by('date')
+    for log_date, mood, note in moods.values_list('date', 'mood', 'note').iterator(chunk_size=CHUNK_SIZE):
+        yield 'mood', {'type': 'mood', 'date': log_date.isoformat(), 'mood': mood, 'note': note}
+
+
+def stream_ndjson(user):
+    """Yield the export as NDJSON, in chunks of roughly FLUSH_BYTES."""
+    buffer = []
+    size = 0
+    for _, record in iter_records(user):
+        line = json.dumps(record) + '\n'
+        buffer.append(line)
+        size += len(line)
+        if size >= FLUSH_BYTES:
+            yield ''.join(buffer).encode('utf-8')
+            buffer, size = [], 0
+    if buffer:
+        yield ''.join(buffer).encode('utf-8')
+
+
+class _ZipStream(io.RawIOBase):
+    """Write-only, unseekable sink that hands zip output back in pieces."""
+
+    def __init__(self):
+        self.chunks = []
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def drain(self):
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def stream_zipped_csv(user):
+    """Yield the export as a zip holding one CSV file per table."""
+    sink = _ZipStream()
+    with zipfile.ZipFile(sink, mode='w', compression=zipfile.ZIP_DEFLATED) as archive:
+        entry = writer = text = None
+        current = None
+        for table, record in iter_records(user):
+            if table != current:
+                if entry:
+                    entry.write(text.getvalue().encode('utf-8'))
+                    entry.close()
+                current = table
+                entry = archive.open(f'{table}.csv', mode='w', force_zip64=True)
+                text = io.StringIO()
+                writer = csv.DictWriter(text, fieldnames=EXPORT_COLUMNS[table])
+                writer.writeheader()
+            writer.writerow(record)
+            if text.tell() >= FLUSH_BYTES:
+                entry.write(text.getvalue().encode('utf-8'))
+                text.seek(0)
+                text.truncate()
+                yield sink.drain()
+        if entry:
+            entry.write(text.getvalue().encode('utf-8'))
+            entry.close()
+    yield sink.drain()
+
+
+async def aiter_chunks(chunks):
+    """
+    Async iterator over a sync chunk generator. Each chunk is produced in the
+    thread-sensitive sync thread, so database cursors stay on one connection.
+    """
+    chunks = iter(chunks)
+    done = object()
+    try:
+        while True:
+            chunk = await sync_to_async(next)(chunks, done)
+            if chunk is done:
+                break
+            yield chunk
+    finally:
+        # Close the generator (and its cursor) in the thread that opened it
+        await sync_to_async(chunks.close)()
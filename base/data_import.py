@@ -0,0 +1,241 @@
+"""
+Streaming bulk import of habit, sleep and mood history.
+
+Records are read one line at a time from NDJSON or CSV input and written in
+batches. Each batch resolves the one-log-per-night rule for sleep and the
+per-day uniqueness of mood and habit logs with a few set-based queries
+instead of one lookup per row.
+
+Record format (the CSV columns use the same names):
+    {"type": "habit", "habit": "Read", "description": "", "archived": false}
+    {"type": "habit_log", "habit": "Read", "date": "2026-01-31", "completed": true}
+    {"type": "sleep", "start": "2026-01-30T23:10:00Z", "end": "2026-01-31T07:00:00Z"}
+    {"type": "mood", "date": "2026-01-31", "mood": 7, "note": ""}
+"""
+
+import csv
+import json
+from datetime import date, timedelta
+
+from django.db import transaction
+from django.utils.dateparse import parse_datetime
+from django.utils.timezone import is_naive, localtime, make_aware
+
+from base.bitmaps import bitmaps_enabled, rebuild_bitmaps
+from base.change_log import require_full_resync
+from base.models import Habit, HabitLog, MoodLog, SleepLog
+from base.rollups import rebuild_user, sleep_days
+from base.sleep_timeline import night_bounds
+from base.streaks import rebuild_stats
+
+CSV_FIELDS = ['type', 'habit', 'description', 'archived', 'date', 'completed', 'start', 'end', 'mood', 'note']
+MAX_REPORTED_ERRORS = 20
+
+
+class RecordError(ValueError):
+    """Raised for a record that cannot be imported."""
+
+
+def iter_lines(stream):
+    """Yield decoded text lines from a binary or text stream without buffering it."""
+    for line in stream:
+        yield line.decode('utf-8') if isinstance(line, bytes) else line
+
+
+def iter_records(stream, fmt='ndjson'):
+    """Yield (line_number, record) pairs parsed incrementally from `stream`."""
+    lines = iter_lines(stream)
+    if fmt == 'csv':
+        reader = csv.DictReader(lines)
+        for record in reader:
+            yield reader.line_num, record
+        return
+    for line_number, line in enumerate(lines, start=1):
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError as e:
+            yield line_number, e
+            continue
+        yield line_number, record
+
+
+def _as_bool(value, default=True):
+    if value in (None, ''):
+        return default
+    if isinstance(value, str):
+        return value.strip().lower() in ('1', 'true', 'yes')
+    return bool(value)
+
+
+def _as_datetime(value):
+    parsed = parse_datetime(value or '')
+    if parsed is None:
+        raise RecordError(f"Invalid datetime: {value!r}")
+    return make_aware(parsed) if is_naive(parsed) else parsed
+
+
+class Importer:
+    """Import records for one user in batches of `batch_size`."""
+
+    def __init__(self, user, batch_size=500):
+        self.user = user
+        self.batch_size = batch_size
+        self.counts = {'habits': 0, 'habit_logs': 0, 'sleep': 0, 'mood': 0}
+        self.errors = []
+        self.error_count = 0
+        self.touched_habits = set()
+        self.habits = {habit.name: habit for habit in Habit.objects.filter(user=user)}
+
+    def run(self, records):
+        batch = []
+        for line_number, record in records:
+            batch.append((line_number, record))
+            if len(batch) >= self.batch_size:
+                self._write_batch(batch)
+                batch = []
+        if batch:
+            self._write_batch(batch)
+        self._finish()
+        return self.result()
+
+    def result(self):
+        return {'imported': self.counts, 'error_count': self.error_count, 'errors': self.errors}
+
+    def _error(self, line_number, message):
+        self.error_count += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append({'line': line_number, 'error': str(message)})
+
+    def _write_batch(self, batch):
+        habits, habit_logs, sleep, moods = {}, {}, {}, {}
+        for line_number, record in batch:
+            try:
+                if isinstance(record, Exception) or not isinstance(record, dict):
+                    raise RecordError(f"Invalid record: {record}")
+                kind = record.get('type')
+                if kind == 'habit':
+                    name = (record.get('habit') or '').strip()
+                    if not name:
+                        raise RecordError("Missing habit name")
+                    habits[name] = record
+                elif kind == 'habit_log':
+                    name = (record.get('habit') or '').strip()
+                    if not name:
+                        raise RecordError("Missing habit name")
+                    key = (name, date.fromisoformat(record['date']))
+                    habit_logs[key] = _as_bool(record.get('completed'))
+                elif kind == 'sleep':
+                    start, end = _as_datetime(record.get('start')), _as_datetime(record.get('end'))
+                    if end <= start:
+                        raise RecordError("Sleep end must be after start")
+                    # Same rule as sleep_log_create: one log per night, keyed by wake-up day
+                    sleep[localtime(end).date()] = (start, end)
+                elif kind == 'mood':
+                    mood = int(record['mood'])
+                    if not 0 <= mood <= 10:
+                        raise RecordError("Mood must be between 0 and 10")
+                    moods[date.fromisoformat(record['date'])] = (mood, record.get('note') or '')
+                else:
+                    raise RecordError(f"Unknown record type: {kind!r}")
+            except (KeyError, TypeError, ValueError) as e:
+                self._error(line_number, e)
+
+        with transaction.atomic():
+            self._write_habits(habits, habit_logs)
+            self._write_habit_logs(habit_logs)
+            self._write_sleep(sleep)
+            self._write_moods(moods)
+
+    def _write_habits(self, habits, habit_logs):
+        names = set(habits) | {name for name, _ in habit_logs}
+        new = [
+            Habit(
+                user=self.user,
+                name=name,
+                description=habits.get(name, {}).get('description') or '',
+                archived=_as_bool(habits.get(name, {}).get('archived'), default=False),
+            )
+            for name in names if name not in self.habits
+        ]
+        Habit.objects.bulk_create(new)
+        if any(habit.pk is None for habit in new):
+            # Backends without RETURNING do not set primary keys on bulk_create
+            new = list(Habit.objects.filter(user=self.user, name__in=[habit.name for habit in new]))
+        self.habits.update({habit.name: habit for habit in new})
+        self.counts['habits'] += len(new)
+
+    def _write_habit_logs(self, habit_logs):
+        if not habit_logs:
+            return
+        wanted = {(self.habits[name].id, day): completed for (name, day), completed in habit_logs.items()}
+        HabitLog.objects.bulk_create(
+            [HabitLog(habit_id=habit_id, user=self.user, date=day, completed=True)
+             for (habit_id, day), completed in wanted.items() if completed],
+            batch_size=self.batch_size,
+            ignore_conflicts=True,
+        )
+        removed = {key for key, completed in wanted.items() if not completed}
+        if removed:
+            candidates = HabitLog.objects.filter(
+                habit_id__in={habit_id for habit_id, _ in removed},
+                date__in={day for _, day in removed},
+            ).values_list('id', 'habit_id', 'date')
+            HabitLog.objects.filter(
+                id__in=[log_id for log_id, habit_id, day in candidates if (habit_id, day) in removed]
+            ).delete()
+        self.touched_habits.update(habit_id for habit_id, _ in wanted)
+        self.counts['habit_logs'] += len(wanted)
+
+    def _write_sleep(self, sleep):
+        if not sleep:
+            return
+        nights = set(sleep)
+        # Nights are keyed by wake-up day, so night D runs from 18:00 on D-1 to 18:00 on D
+        window_start, _ = night_bounds(min(nights) - timedelta(days=1))
+        _, window_end = night_bounds(max(nights) - timedelta(days=1))
+        # Fetch every existing log overlapping the affected nights once, then
+        # drop the ones sharing a night with an imported log
+        existing = SleepLog.objects.filter(
+            user=self.user,
+            start__lt=window_end,
+            end__gt=window_start,
+        ).values_list('id', 'start', 'end')
+        stale = [
+            log_id for log_id, start, end in existing
+            if nights.intersection(sleep_days(start, end))
+        ]
+        SleepLog.objects.filter(id__in=stale).delete()
+        SleepLog.objects.bulk_create(
+            [SleepLog(user=self.user, start=start, end=end) for start, end in sleep.values()],
+            batch_size=self.batch_size,
+        )
+        self.counts['sleep'] += len(sleep)
+
+    def _write_moods(self, moods):
+        if not moods:
+            return
+        MoodLog.objects.bulk_create(
+            [MoodLog(user=self.user, date=day, mood=mood, note=note) for day, (mood, note) in moods.items()],
+            batch_size=self.batch_size,
+            update_conflicts=True,
+            unique_fields=['user', 'date'],
+            update_fields=['mood', 'note'],
+        )
+        self.counts['mood'] += len(moods)
+
+    def _finish(self):
+        """Bring derived data (stats, bitmaps, rollups) back in line with the raw logs."""
+        for habit in Habit.objects.filter(id__in=self.touched_habits):
+            rebuild_stats(habit)
+        if bitmaps_enabled() and self.touched_habits:
+            rebuild_bitmaps(habit_ids=self.touched_habits, batch_size=self.batch_size)
+        rebuild_user(self.user)
+        # Imported rows are not written to the change log, so sync clients start over
+        require_full_resync(self.user)
+
+
+def import_stream(user, stream, fmt='ndjson', batch_size=500):
+    """Import an NDJSON or CSV stream for `user` and return a summary."""
+    return Importer(user, batch_size=batch_size).run(iter_records(stream, fmt))
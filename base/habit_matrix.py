@@ -0,0 +1,55 @@
+"""
+Habit completion matrix.
+
+Builds the habit x day completion grid shown by the async habit tracker views
+for a single user, using one range query over that user's habit logs (or over
+the habit-year bitmaps when they are enabled).
+"""
+
+from datetime import timedelta
+
+from base.bitmaps import aload_bitmaps, bitmaps_enabled, completion_row
+from base.models import Habit, HabitLog
+
+
+async def abuild_completion_matrix(user, days):
+    """
+    Build the completion grid for the user's active habits over `days`.
+
+    `days` must be a consecutive, ascending list of dates. Returns a tuple
+    `(habits, grid)` where `grid` maps each habit id to a list of booleans,
+    one per day.
+    """
+    habits = [habit async for habit in Habit.objects.filter(user=user, archived=False)]
+    grid = {habit.id: [False] * len(days) for habit in habits}
+    if not habits or not days:
+        return habits, grid
+
+    start = days[0]
+    end = days[-1] + timedelta(days=1)
+    if bitmaps_enabled():
+        bitmaps = await aload_bitmaps(grid.keys(), start, end)
+        for habit_id in grid:
+            grid[habit_id] = completion_row(bitmaps, habit_id, start, len(days))
+        return habits, grid
+
+    completed = HabitLog.objects.filter(
+        user=user,
+        habit_id__in=grid.keys(),
+        date__gte=start,
+        date__lt=end,
+        completed=True,
+    ).values_list('habit_id', 'date')
+    async for habit_id, log_date in completed:
+        grid[habit_id][(log_date - start).days] = True
+    return habits, grid
+
+
+def matrix_log_dict(grid, days):
+    """Flatten a completion grid into the `log_dict_json` shape used by templates."""
+    day_keys = [day.isoformat() for day in days]
+    return {
+        f"{habit_id}-{day_keys[i]}": True
+        for habit_id, row in grid.items()
+        for i, done in enumerate(row) if done
+    }
@@ -0,0 +1,86 @@
+"""
+Year-at-a-glance heatmaps for mood and habit completion.
+
+Each section is read with one range query and encoded as a flat array with
+one value per day from `start`, alongside a palette the client indexes
+into, so a 365-cell grid is drawn without per-day objects or color math.
+Colors are computed once at import time from the same gradient as the
+`mood_color` template filter.
+"""
+
+from datetime import date, timedelta
+
+import numpy as np
+from django.db.models import Count
+
+from base.models import HabitLog, MoodLog
+from base.templatetags.mood_extras import mood_to_color
+
+EMPTY_COLOR = mood_to_color(None)
+MOOD_PALETTE = [mood_to_color(mood) for mood in range(0, 11)]
+HABIT_PALETTE = [EMPTY_COLOR, '#c8e6c9', '#81c784', '#43a047', '#1b5e20']
+HABIT_LEVELS = len(HABIT_PALETTE) - 1
+SECTIONS = ('mood', 'habits')
+
+
+def year_range(year):
+    """Return the first day and the number of days of `year`."""
+    start = date(year, 1, 1)
+    return start, (date(year + 1, 1, 1) - start).days
+
+
+def _day_array(rows, start, num_days, missing=0):
+    """Spread (date, value) rows into an int array with one slot per day."""
+    values = np.full(num_days, missing, dtype=np.int16)
+    if rows:
+        days, counts = zip(*rows)
+        index = np.array([(day - start).days for day in days])
+        values[index] = counts
+    return values
+
+
+def mood_heatmap(user, start, num_days):
+    """Mood per day (-1 where nothing was logged); `palette[mood]` is its color."""
+    rows = list(MoodLog.objects.filter(
+        user=user,
+        date__gte=start,
+        date__lt=start + timedelta(days=num_days),
+    ).values_list('date', 'mood'))
+    return {
+        'values': _day_array(rows, start, num_days, missing=-1).tolist(),
+        'palette': MOOD_PALETTE,
+        'empty': EMPTY_COLOR,
+    }
+
+
+def habit_heatmap(user, start, num_days):
+    """
+    Completed habits per day plus a 0-4 level relative to the busiest day in
+    the range; `palette[level]` is its color.
+    """
+    rows = list(HabitLog.objects.filter(
+        user=user,
+        date__gte=start,
+        date__lt=start + timedelta(days=num_days),
+        completed=True,
+    ).values('date').annotate(count=Count('id')).values_list('date', 'count').order_by())
+    counts = _day_array(rows, start, num_days)
+    busiest = counts.max(initial=0)
+    levels = np.ceil(counts * HABIT_LEVELS / busiest).astype(np.int16) if busiest else counts
+    return {
+        'values': counts.tolist(),
+        'levels': levels.tolist(),
+        'palette': HABIT_PALETTE,
+    }
+
+
+HEATMAPS = {'mood': mood_heatmap, 'habits': habit_heatmap}
+
+
+def build_heatmap(user, year, sections=SECTIONS):
+    """Return the heatmaps of `sections` for `year`."""
+    start, num_days = year_range(year)
+    heatmap = {'year': year, 'start': start.isoformat(), 'days': num_days}
+    for section in sections:
+        heatmap[section] = HEATMAPS[section](user, start, num_days)
+    return heatmap
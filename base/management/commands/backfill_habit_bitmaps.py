@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from base.bitmaps import rebuild_bitmaps
+
+
+class Command(BaseCommand):
+    help = "Rebuild the per-year habit completion bitmaps from existing HabitLog rows."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--habit', type=int, action='append', dest='habits',
+                            help='Only rebuild this habit id (can be repeated).')
+        parser.add_argument('--batch-size', type=int, default=500,
+                            help='Number of bitmap rows inserted per query.')
+
+    def handle(self, *args, **options):
+        written = rebuild_bitmaps(habit_ids=options['habits'], batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f"Wrote {written} habit-year bitmaps."))
@@ -0,0 +1,96 @@
+import json
+import shutil
+import subprocess  # nosec B404
+import time
+from datetime import date
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.test.utils import override_settings
+
+from base.benchmark import compare_plans, delete_dataset, run_benchmark, seed_dataset
+from base.bitmaps import bitmaps_enabled
+
+
+def git_revision():
+    """Return the checked out commit, or None outside a git checkout."""
+    git = shutil.which('git')
+    if git is None:
+        return None
+    try:
+        # Fixed arguments to the resolved git binary, no user input
+        result = subprocess.run(  # nosec B603
+            [git, 'rev-parse', 'HEAD'], cwd=settings.BASE_DIR, capture_output=True, text=True, check=True)
+        return result.stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class Command(BaseCommand):
+    help = ("Seed benchmark users with generated history, request every tracker page and API "
+            "endpoint and report latency percentiles, query counts and response sizes as JSON, "
+            "plus the query plans of user-wide habit log reads. "
+            "Writes to the configured database, so it refuses to run with DEBUG off unless "
+            "--force is given; the benchmark users it creates are removed afterwards.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=3, help='Number of benchmark users.')
+        parser.add_argument('--habits', type=int, default=5, help='Habits per user.')
+        parser.add_argument('--years', type=float, default=1.0, help='Years of history per user.')
+        parser.add_argument('--iterations', type=int, default=5,
+                            help='Requests per endpoint per user.')
+        parser.add_argument('--seed', type=int, default=0, help='Random seed for data and requests.')
+        parser.add_argument('--output', default='-', help="File to write the JSON report to, or '-' for stdout.")
+        parser.add_argument('--no-page-cache', action='store_true',
+                            help='Disable the tracker page cache while measuring.')
+        parser.add_argument('--keep', action='store_true',
+                            help='Keep the benchmark users and their data afterwards.')
+        parser.add_argument('--force', action='store_true',
+                            help='Run even when DEBUG is off, e.g. against a production database.')
+
+    def handle(self, *args, **options):
+        if options['users'] < 1 or options['iterations'] < 1 or options['years'] <= 0:
+            raise CommandError('--users, --iterations and --years must be positive')
+        if not settings.DEBUG and not options['force']:
+            raise CommandError('DEBUG is off; pass --force to write benchmark users to this database')
+
+        started = time.perf_counter()
+        users, counts = seed_dataset(options['users'], options['habits'], options['years'], seed=options['seed'])
+        seed_seconds = time.perf_counter() - started
+
+        page_cache_timeout = 0 if options['no_page_cache'] else settings.TRACKER_PAGE_CACHE_TIMEOUT
+        try:
+            with override_settings(TRACKER_PAGE_CACHE_TIMEOUT=page_cache_timeout):
+                endpoints = run_benchmark(users, options['iterations'], options['years'], seed=options['seed'])
+            plans = compare_plans(users[0], date.today())
+        finally:
+            if not options['keep']:
+                delete_dataset(users)
+
+        report = {
+            'revision': git_revision(),
+            'dataset': {
+                'users': options['users'],
+                'habits': options['habits'],
+                'years': options['years'],
+                'seed': options['seed'],
+                **counts,
+                'seed_seconds': round(seed_seconds, 3),
+            },
+            'settings': {
+                'database': settings.DATABASES['default']['ENGINE'],
+                'session_mode': settings.SESSION_MODE,
+                'habit_bitmaps': bitmaps_enabled(),
+                'page_cache_timeout': page_cache_timeout,
+                'iterations': options['iterations'],
+            },
+            'endpoints': endpoints,
+            'plans': plans,
+        }
+        output = json.dumps(report, indent=2)
+        if options['output'] == '-':
+            self.stdout.write(output)
+        else:
+            with open(options['output'], 'w', encoding='utf-8') as stream:
+                stream.write(output + '\n')
+            self.stdout.write(self.style.SUCCESS(f"Wrote benchmark report to {options['output']}."))
@@ -0,0 +1,18 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from base.change_log import compact
+
+
+class Command(BaseCommand):
+    help = "Drop superseded change log entries and trim entries older than the retention window."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=settings.CHANGE_LOG_RETENTION_DAYS,
+                            help='Keep entries newer than this many days (default: CHANGE_LOG_RETENTION_DAYS).')
+
+    def handle(self, *args, **options):
+        superseded, trimmed = compact(retention_days=options['days'])
+        self.stdout.write(self.style.SUCCESS(
+            f"Removed {superseded} superseded and {trimmed} expired change log entries."
+        ))
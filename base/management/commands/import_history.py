@@ -0,0 +1,36 @@
+import json
+import sys
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from base.data_import import import_stream
+from base.versioning import bump_version
+
+
+class Command(BaseCommand):
+    help = "Import habit, sleep and mood history for a user from an NDJSON or CSV file."
+
+    def add_arguments(self, parser):
+        parser.add_argument('username')
+        parser.add_argument('path', help="File to import, or '-' for stdin.")
+        parser.add_argument('--format', choices=['ndjson', 'csv'],
+                            help='Input format (default: guessed from the file extension).')
+        parser.add_argument('--batch-size', type=int, default=500,
+                            help='Number of records written per batch.')
+
+    def handle(self, *args, **options):
+        try:
+            user = User.objects.get(username=options['username'])
+        except User.DoesNotExist:
+            raise CommandError(f"User {options['username']!r} does not exist")
+
+        path = options['path']
+        fmt = options['format'] or ('csv' if path.endswith('.csv') else 'ndjson')
+        if path == '-':
+            summary = import_stream(user, sys.stdin, fmt=fmt, batch_size=options['batch_size'])
+        else:
+            with open(path, encoding='utf-8', newline='') as stream:
+                summary = import_stream(user, stream, fmt=fmt, batch_size=options['batch_size'])
+        bump_version(user)
+        self.stdout.write(json.dumps(summary, indent=2))
@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand
+
+from base.models import Habit
+from base.streaks import rebuild_stats
+from base.versioning import bump_versions
+
+
+class Command(BaseCommand):
+    help = "Rebuild streak and completion stats for every habit from its HabitLog history."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--habit', type=int, action='append', dest='habits',
+                            help='Only rebuild this habit id (can be repeated).')
+
+    def handle(self, *args, **options):
+        habits = Habit.objects.all()
+        if options['habits']:
+            habits = habits.filter(id__in=options['habits'])
+        count = 0
+        user_ids = set()
+        for habit in habits.iterator():
+            rebuild_stats(habit)
+            user_ids.add(habit.user_id)
+            count += 1
+        bump_versions(user_ids)
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt stats for {count} habits."))
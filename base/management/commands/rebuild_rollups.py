@@ -0,0 +1,25 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+
+from base.rollups import rebuild_user
+from base.versioning import bump_versions
+
+
+class Command(BaseCommand):
+    help = "Rebuild the daily, weekly and monthly rollups from raw habit, sleep and mood logs."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', action='append', dest='usernames',
+                            help='Only rebuild this username (can be repeated).')
+
+    def handle(self, *args, **options):
+        users = User.objects.all()
+        if options['usernames']:
+            users = users.filter(username__in=options['usernames'])
+        total = 0
+        user_ids = set()
+        for user in users.iterator():
+            total += rebuild_user(user)
+            user_ids.add(user.pk)
+        bump_versions(user_ids)
+        self.stdout.write(self.style.SUCCESS(f"Wrote {total} rollups."))
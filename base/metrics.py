@@ -0,0 +1,169 @@
+"""
+Prometheus metrics.
+
+When METRICS_ENABLED is set, `MetricsMiddleware` records request counts,
+latency and SQL queries per URL name, and `metrics_view` exposes them at
+/metrics in the Prometheus text format together with cache hit counts and
+one series per live worker process. Outside DEBUG, METRICS_TOKEN is required:
+the endpoint is never served without it.
+
+Under gunicorn every worker writes its samples to PROMETHEUS_MULTIPROC_DIR
+(set up by gunicorn.conf.py) and a scrape of any worker aggregates them all,
+so the numbers do not depend on which worker answers the scrape.
+"""
+
+import os
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured, MiddlewareNotUsed
+from django.http import HttpResponse, HttpResponseForbidden, HttpResponseNotFound
+from django.utils.crypto import constant_time_compare
+from prometheus_client import (
+    CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Gauge, Histogram, generate_latest,
+)
+from prometheus_client import multiprocess
+
+from base.server_timing import RequestTimings, current_timings, install
+
+REQUESTS = Counter(
+    'habits_http_requests_total', 'HTTP requests by URL name, method and status.',
+    ['view', 'method', 'status'],
+)
+LATENCY = Histogram(
+    'habits_http_request_duration_seconds', 'HTTP request latency by URL name.',
+    ['view', 'method'],
+)
+QUERIES = Histogram(
+    'habits_db_queries_per_request', 'SQL queries issued per request by URL name.',
+    ['view'], buckets=(0, 1, 2, 3, 5, 8, 13, 21, 34, 55, 89),
+)
+PAGE_CACHE = Counter(
+    'habits_page_cache_lookups_total', 'Tracker page cache lookups by result.', ['result'],
+)
+# Each process's running totals, summed over the live workers
+CACHE_HITS = Gauge(
+    'habits_cache_hits', 'In-process cache hits.', ['cache'], multiprocess_mode='livesum',
+)
+CACHE_MISSES = Gauge(
+    'habits_cache_misses', 'In-process cache misses.', ['cache'], multiprocess_mode='livesum',
+)
+CACHE_SIZE = Gauge(
+    'habits_cache_entries', 'In-process cache entries.', ['cache'], multiprocess_mode='livesum',
+)
+# One series per live worker, labelled with its pid in multiprocess mode
+WORKER_STARTED = Gauge(
+    'habits_worker_start_time_seconds', 'Start time of the worker process.', ['server_mode'],
+    multiprocess_mode='liveall',
+)
+
+
+def metrics_enabled():
+    return getattr(settings, 'METRICS_ENABLED', False)
+
+
+def metrics_token():
+    """Return METRICS_TOKEN, refusing to run without one unless DEBUG is on."""
+    token = getattr(settings, 'METRICS_TOKEN', '')
+    if not token and not settings.DEBUG:
+        raise ImproperlyConfigured('METRICS_TOKEN must be set when METRICS_ENABLED is on and DEBUG is off')
+    return token
+
+
+def in_process_caches():
+    from api.authentication import token_cache
+    from base.auth_backends import user_cache
+    return {'token': token_cache, 'user': user_cache}
+
+
+def update_cache_gauges():
+    for name, ttl_cache in in_process_caches().items():
+        stats = ttl_cache.stats()
+        CACHE_HITS.labels(name).set(stats['hits'])
+        CACHE_MISSES.labels(name).set(stats['misses'])
+        CACHE_SIZE.labels(name).set(stats['size'])
+
+
+def record_page_cache_lookup(hit):
+    if metrics_enabled():
+        PAGE_CACHE.labels('hit' if hit else 'miss').inc()
+
+
+def view_name(request):
+    match = getattr(request, 'resolver_match', None)
+    if match is None:
+        return 'unresolved'
+    return match.view_name or 'unnamed'
+
+
+class MetricsMiddleware:
+    """Record every request's latency, status and query count."""
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not metrics_enabled():
+            raise MiddlewareNotUsed
+        metrics_token()
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+        install()
+        WORKER_STARTED.labels(settings.SERVER_MODE).set(time.time())
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        timings, token = self.start()
+        try:
+            response = self.get_response(request)
+        finally:
+            if token is not None:
+                current_timings.reset(token)
+        self.finish(request, response, timings)
+        return response
+
+    async def __acall__(self, request):
+        timings, token = self.start()
+        try:
+            response = await self.get_response(request)
+        finally:
+            if token is not None:
+                current_timings.reset(token)
+        self.finish(request, response, timings)
+        return response
+
+    def start(self):
+        # Share the timings ServerTimingMiddleware already collects, if it runs
+        timings = current_timings.get()
+        if timings is not None:
+            return timings, None
+        timings = RequestTimings()
+        return timings, current_timings.set(timings)
+
+    def finish(self, request, response, timings):
+        view = view_name(request)
+        REQUESTS.labels(view, request.method, response.status_code).inc()
+        LATENCY.labels(view, request.method).observe(time.perf_counter() - timings.started)
+        QUERIES.labels(view).observe(timings.queries)
+        update_cache_gauges()
+
+
+def metrics_view(request):
+    """
+    Expose metrics in the Prometheus text format.
+    If METRICS_TOKEN is set, scrapers must send it as a bearer token; it may
+    only be left empty with DEBUG on.
+    """
+    if not metrics_enabled():
+        return HttpResponseNotFound()
+    expected = metrics_token()
+    if expected and not constant_time_compare(request.headers.get('Authorization', ''), f'Bearer {expected}'):
+        return HttpResponseForbidden()
+    if os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return HttpResponse(generate_latest(registry), content_type=CONTENT_TYPE_LATEST)
@@ -0,0 +1,54 @@
+# Generated by Django 5.2.9 on 2026-10-18 19:27
+
+from datetime import timedelta
+
+from django.db import migrations, models
+
+
+def populate_stats(apps, schema_editor):
+    """Compute stats for existing habits (same rules as base.streaks.rebuild_stats)."""
+    Habit = apps.get_model('base', 'Habit')
+    HabitLog = apps.get_model('base', 'HabitLog')
+    for habit in Habit.objects.iterator():
+        dates = list(HabitLog.objects.filter(habit_id=habit.id, completed=True)
+                     .order_by('date').values_list('date', flat=True))
+        longest = run = 0
+        for i, day in enumerate(dates):
+            run = run + 1 if i and day - dates[i - 1] == timedelta(days=1) else 1
+            longest = max(longest, run)
+        habit.total_completions = len(dates)
+        habit.longest_streak = longest
+        habit.current_streak = run
+        habit.last_completed = dates[-1] if dates else None
+        habit.save(update_fields=['current_streak', 'longest_streak', 'total_completions', 'last_completed'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('base', '0002_habityearbitmap'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='habit',
+            name='current_streak',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='habit',
+            name='last_completed',
+            field=models.DateField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='habit',
+            name='longest_streak',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='habit',
+            name='total_completions',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(populate_stats, migrations.RunPython.noop),
+    ]
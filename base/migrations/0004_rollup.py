@@ -0,0 +1,35 @@
+# Generated by Django 5.2.9 on 2026-10-18 19:29
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('base', '0003_habit_stats'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Rollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('period', models.CharField(choices=[('day', 'Day'), ('week', 'Week'), ('month', 'Month')], max_length=5)),
+                ('start', models.DateField()),
+                ('habits_completed', models.PositiveIntegerField(default=0)),
+                ('habit_count', models.PositiveIntegerField(default=0)),
+                ('sleep_minutes', models.PositiveIntegerField(default=0)),
+                ('sleep_nights', models.PositiveIntegerField(default=0)),
+                ('mood_total', models.PositiveIntegerField(default=0)),
+                ('mood_count', models.PositiveIntegerField(default=0)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='rollups', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'ordering': ['start'],
+                'unique_together': {('user', 'period', 'start')},
+            },
+        ),
+    ]
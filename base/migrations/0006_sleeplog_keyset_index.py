@@ -0,0 +1,19 @@
+# Generated by Django 5.2.9 on 2026-10-18 19:39
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('base', '0005_dataversion'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='sleeplog',
+            index=models.Index(fields=['user', 'end', 'id'], name='base_sleepl_user_id_8c3bc7_idx'),
+        ),
+    ]
@@ -0,0 +1,44 @@
+# Generated by Django 5.2.9 on 2026-10-18 19:43
+
+import django.core.serializers.json
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('base', '0006_sleeplog_keyset_index'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='dataversion',
+            name='sync_floor',
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='dataversion',
+            name='change_seq',
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.CreateModel(
+            name='ChangeLogEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('seq', models.BigIntegerField()),
+                ('kind', models.CharField(choices=[('habit', 'Habit'), ('habit_log', 'Habit log'), ('sleep', 'Sleep log'), ('mood', 'Mood log')], max_length=10)),
+                ('key', models.CharField(max_length=64)),
+                ('action', models.CharField(choices=[('create', 'Create'), ('update', 'Update'), ('delete', 'Delete')], max_length=6)),
+                ('data', models.JSONField(blank=True, encoder=django.core.serializers.json.DjangoJSONEncoder, null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True, db_index=True)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='changes', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'ordering': ['id'],
+                'unique_together': {('user', 'seq')},
+            },
+        ),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 5.2.9 on 2026-10-18 20:22
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('base', '0007_change_log'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        # Nullable until 0009 has filled it in for existing rows
+        migrations.AddField(
+            model_name='habitlog',
+            name='user',
+            field=models.ForeignKey(db_index=False, editable=False, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='habit_logs', to=settings.AUTH_USER_MODEL),
+        ),
+    ]
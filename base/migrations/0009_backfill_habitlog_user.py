@@ -0,0 +1,37 @@
+from django.db import migrations, transaction
+from django.db.models import OuterRef, Subquery
+
+BATCH_SIZE = 5000
+
+
+def backfill_user(apps, schema_editor):
+    """
+    Copy each habit's owner onto its logs, BATCH_SIZE rows per transaction so
+    large tables are never locked or rewritten in one go.
+    """
+    db_alias = schema_editor.connection.alias
+    Habit = apps.get_model('base', 'Habit')
+    HabitLog = apps.get_model('base', 'HabitLog')
+    owner = Habit.objects.using(db_alias).filter(id=OuterRef('habit_id')).values('user_id')[:1]
+    pending = HabitLog.objects.using(db_alias).filter(user__isnull=True).order_by('id')
+    last_id = 0
+    while True:
+        ids = list(pending.filter(id__gt=last_id).values_list('id', flat=True)[:BATCH_SIZE])
+        if not ids:
+            break
+        with transaction.atomic(using=db_alias):
+            pending.filter(id__gte=ids[0], id__lte=ids[-1]).update(user_id=Subquery(owner))
+        last_id = ids[-1]
+
+
+class Migration(migrations.Migration):
+    # Each batch commits on its own
+    atomic = False
+
+    dependencies = [
+        ('base', '0008_habitlog_user'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_user, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 5.2.9 on 2026-10-18 20:22
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('base', '0009_backfill_habitlog_user'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='habitlog',
+            name='user',
+            field=models.ForeignKey(db_index=False, editable=False, on_delete=django.db.models.deletion.CASCADE, related_name='habit_logs', to=settings.AUTH_USER_MODEL),
+        ),
+        # Duplicates the index backing unique_together
+        migrations.RemoveIndex(
+            model_name='habitlog',
+            name='base_habitl_habit_i_7e693b_idx',
+        ),
+        migrations.AddIndex(
+            model_name='habitlog',
+            index=models.Index(fields=['user', 'date'], name='base_habitl_user_id_66e8cb_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='habitlog',
+            index=models.Index(condition=models.Q(('completed', True)), fields=['user', 'date', 'habit'], name='base_habitlog_completed_idx'),
+        ),
+    ]
@@ -1,5 +1,9 @@
+import calendar
+from datetime import date, timedelta
+
 from django.db import models
 from django.contrib.auth.models import User
+from django.core.serializers.json import DjangoJSONEncoder
 
 class Habit(models.Model):
     # Link each habit to a user - each user has their own habits
@@ -8,6 +12,12 @@ class Habit(models.Model):
     description = models.TextField(blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
     archived = models.BooleanField(default=False)
+    # Completion stats, kept up to date incrementally by base.streaks
+    # current_streak is the length of the run ending on last_completed
+    current_streak = models.PositiveIntegerField(default=0)
+    longest_streak = models.PositiveIntegerField(default=0)
+    total_completions = models.PositiveIntegerField(default=0)
+    last_completed = models.DateField(null=True, blank=True)
 
     class Meta:
         # Ensure habits are ordered by creation date
@@ -20,20 +30,43 @@ class Habit(models.Model):
     def __str__(self):
         return self.name
 
+    def active_streak(self, today=None):
+        """Return the current streak, or 0 if it was broken before yesterday."""
+        today = today or date.today()
+        if self.last_completed and self.last_completed >= today - timedelta(days=1):
+            return self.current_streak
+        return 0
+
 
 class HabitLog(models.Model):
     habit = models.ForeignKey(Habit, on_delete=models.CASCADE)
+    # Copy of habit.user, so a user's logs in a date range are one index range scan.
+    # Not indexed on its own: the (user, date) index below serves lookups by user.
+    user = models.ForeignKey(
+        User, on_delete=models.CASCADE, related_name='habit_logs', editable=False, db_index=False,
+    )
     date = models.DateField()
     completed = models.BooleanField(default=True)
     note = models.TextField(blank=True)
 
     class Meta:
-        # Ensure unique logs per habit per day
+        # Ensure unique logs per habit per day (this also indexes habit, date)
         unique_together = ['habit', 'date']
         indexes = [
-            models.Index(fields=['habit', 'date']),
+            models.Index(fields=['user', 'date']),
+            # Completed days per user, covering the (habit, date) pairs read by the trackers
+            models.Index(
+                fields=['user', 'date', 'habit'],
+                condition=models.Q(completed=True),
+                name='base_habitlog_completed_idx',
+            ),
         ]
 
+    def save(self, *args, **kwargs):
+        if self.user_id is None:
+            self.user_id = self.habit.user_id
+        super().save(*args, **kwargs)
+
     def __str__(self):
         return f"{self.habit.name} - {self.date}"
 
@@ -48,6 +81,8 @@ class SleepLog(models.Model):
         ordering = ['-end']
         indexes = [
             models.Index(fields=['user', 'start', 'end']),
+            # Keyset pagination of the sleep log API walks (end, id) per user
+            models.Index(fields=['user', 'end', 'id']),
         ]
 
     @property
@@ -79,3 +114,111 @@ class MoodLog(models.Model):
 
     def __str__(self):
         return f"{self.date}: {self.mood}"
+
+
+class HabitYearBitmap(models.Model):
+    # Compact completion store - bit N is set when the habit was completed
+    # on day N of the year (0 = January 1st), 366 bits per habit per year
+    habit = models.ForeignKey(Habit, on_delete=models.CASCADE, related_name='year_bitmaps')
+    year = models.IntegerField()
+    bits = models.BinaryField(default=bytes(46))
+
+    class Meta:
+        # One bitmap per habit per year
+        unique_together = ['habit', 'year']
+
+    def __str__(self):
+        return f"{self.habit.name} - {self.year}"
+
+
+class Rollup(models.Model):
+    # Pre-aggregated habit, sleep and mood totals per user per day, week or month
+    PERIOD_CHOICES = [
+        ('day', 'Day'),
+        ('week', 'Week'),
+        ('month', 'Month'),
+    ]
+
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='rollups')
+    period = models.CharField(max_length=5, choices=PERIOD_CHOICES)
+    start = models.DateField()
+    habits_completed = models.PositiveIntegerField(default=0)
+    # Number of active habits the last time this rollup was updated
+    habit_count = models.PositiveIntegerField(default=0)
+    sleep_minutes = models.PositiveIntegerField(default=0)
+    sleep_nights = models.PositiveIntegerField(default=0)
+    mood_total = models.PositiveIntegerField(default=0)
+    mood_count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        # One rollup per user per period
+        unique_together = ['user', 'period', 'start']
+        ordering = ['start']
+
+    @property
+    def days(self):
+        if self.period == 'week':
+            return 7
+        if self.period == 'month':
+            return calendar.monthrange(self.start.year, self.start.month)[1]
+        return 1
+
+    @property
+    def completion_rate(self):
+        slots = self.habit_count * self.days
+        return self.habits_completed / slots if slots else None
+
+    @property
+    def average_mood(self):
+        return self.mood_total / self.mood_count if self.mood_count else None
+
+    def __str__(self):
+        return f"{self.user} {self.period} {self.start}"
+
+
+class DataVersion(models.Model):
+    # Per-user counter bumped by every write, used to key caches of that user's data
+    user = models.OneToOneField(User, on_delete=models.CASCADE, primary_key=True, related_name='data_version')
+    version = models.BigIntegerField(default=0)
+    # Change log entries up to this sequence number were compacted away; older sync tokens need a full resync
+    sync_floor = models.BigIntegerField(default=0)
+    # Sequence number of the user's last change log entry
+    change_seq = models.BigIntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.user} v{self.version}"
+
+
+class ChangeLogEntry(models.Model):
+    # Append-only feed of a user's data changes, read by the delta sync endpoint.
+    # The per-user sequence number doubles as the sync token; it is allocated
+    # under a lock on the user's DataVersion row, so it follows commit order.
+    KIND_CHOICES = [
+        ('habit', 'Habit'),
+        ('habit_log', 'Habit log'),
+        ('sleep', 'Sleep log'),
+        ('mood', 'Mood log'),
+    ]
+    ACTION_CHOICES = [
+        ('create', 'Create'),
+        ('update', 'Update'),
+        ('delete', 'Delete'),
+    ]
+
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='changes')
+    seq = models.BigIntegerField()
+    kind = models.CharField(max_length=10, choices=KIND_CHOICES)
+    # Object id, or "<habit_id>:<date>" for habit logs
+    key = models.CharField(max_length=64)
+    action = models.CharField(max_length=6, choices=ACTION_CHOICES)
+    # Serialized object after the change (null for deletes of anything but habit logs)
+    data = models.JSONField(null=True, blank=True, encoder=DjangoJSONEncoder)
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    class Meta:
+        ordering = ['id']
+        # One entry per sequence number, also the index sync reads walk
+        unique_together = ['user', 'seq']
+
+    def __str__(self):
+        return f"#{self.seq} {self.user} {self.action} {self.kind} {self.key}"
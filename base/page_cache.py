@@ -0,0 +1,48 @@
+"""
+Per-user cache of rendered tracker pages.
+
+Pages are stored under a key containing the user's data version, so any
+write endpoint invalidates every cached page of that user by bumping it.
+The key also covers the browser's session and CSRF cookie, since rendered
+pages embed a CSRF token, and the current date, since pages default to today
+and pick a background by date.
+"""
+
+import hashlib
+from datetime import date
+from urllib.parse import urlencode
+
+from django.conf import settings
+from django.core.cache import cache
+from django.http import HttpResponse
+
+from base.metrics import record_page_cache_lookup
+from base.versioning import aget_version
+
+
+async def tracker_cache_key(request, user, section, period):
+    """Return the cache key for this tracker page, or None if it must not be cached."""
+    if not getattr(settings, 'TRACKER_PAGE_CACHE_TIMEOUT', 0):
+        return None
+    session_key = request.session.session_key
+    csrf_cookie = request.COOKIES.get(settings.CSRF_COOKIE_NAME)
+    if not session_key or not csrf_cookie:
+        return None
+    browser = hashlib.sha256(f"{session_key}:{csrf_cookie}".encode()).hexdigest()[:16]
+    params = hashlib.sha256(urlencode(sorted(request.GET.items())).encode()).hexdigest()[:16]
+    version = await aget_version(user)
+    return f"tracker:{user.pk}:{section}:{period}:{version}:{date.today()}:{browser}:{params}"
+
+
+async def get_cached_page(cache_key):
+    cached = await cache.aget(cache_key)
+    record_page_cache_lookup(cached is not None)
+    if cached is None:
+        return None
+    content, content_type = cached
+    return HttpResponse(content, content_type=content_type)
+
+
+async def cache_page(cache_key, response):
+    if response.status_code == 200 and not response.streaming:
+        await cache.aset(cache_key, (response.content, response['Content-Type']), settings.TRACKER_PAGE_CACHE_TIMEOUT)
@@ -0,0 +1,51 @@
+"""
+Admin pages for stored request profiles.
+
+Lists the profiles kept by base.profiling and serves them for download.
+Staff only.
+"""
+
+import json
+import os
+
+from django.contrib.admin.views.decorators import staff_member_required
+from django.http import FileResponse, Http404
+from django.shortcuts import render
+
+from .profiling import list_profiles, profile_path
+
+
+@staff_member_required
+def profile_list(request):
+    """Show the stored profiles, newest first."""
+    profiles = []
+    for name in list_profiles():
+        path = profile_path(name)
+        if path is None:
+            continue
+        try:
+            with open(path, encoding='utf-8') as stream:
+                profile = json.load(stream)
+        except (OSError, ValueError):
+            continue
+        profiles.append({
+            'name': name,
+            'size': os.path.getsize(path),
+            'hottest': profile.get('hottest', [])[:3],
+            **{key: profile.get(key) for key in (
+                'captured_at', 'method', 'path', 'user', 'status', 'total_ms', 'db_ms', 'tpl_ms', 'queries', 'samples',
+            )},
+        })
+    return render(request, 'admin/profiles.html', {
+        'title': 'Request profiles',
+        'profiles': profiles,
+    })
+
+
+@staff_member_required
+def profile_download(request, name):
+    """Download one stored profile as JSON."""
+    path = profile_path(name)
+    if path is None:
+        raise Http404('Profile not found')
+    return FileResponse(open(path, 'rb'), as_attachment=True, filename=name, content_type='application/json')
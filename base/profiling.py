@@ -0,0 +1,250 @@
+"""
+Opt-in request profiling.
+
+With PROFILING_ENABLED set, a staff user can add the PROFILE_HEADER header or
+the PROFILE_PARAM query parameter (value "1") to any request to have it run
+under a sampling profiler. A background thread records the Python stack of
+every busy thread each PROFILE_INTERVAL seconds, which covers async views whose
+work hops between the event loop and `sync_to_async` threads. The profile holds
+the folded call stacks (flame graph input), the functions with the most self
+and total samples, and the SQL and template timings. It is written as JSON to
+PROFILE_DIR, where only the newest PROFILE_RING_SIZE profiles are kept, and
+listed and downloaded from /admin/profiles/.
+
+Under ASGI, concurrent requests in the same worker show up in the samples too.
+"""
+
+import json
+import os
+import re
+import sys
+import threading
+import uuid
+from collections import Counter
+from datetime import datetime, timezone
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+
+from base.server_timing import RequestTimings, current_timings, install
+
+PROFILE_NAME = re.compile(r'^[\w.-]+\.json$')
+TOP_FUNCTIONS = 50
+
+# Python frames threads sit in while blocked; samples ending in them are idle time
+IDLE_FRAMES = {
+    ('selectors.py', 'select'),
+    ('threading.py', 'wait'),
+    ('threading.py', '_wait_for_tstate_lock'),
+    ('queue.py', 'get'),
+    ('_base.py', 'result'),
+    ('thread.py', '_worker'),
+}
+
+
+def frame_label(code):
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+# sys.setswitchinterval is process-wide: the first running sampler shortens it
+# and the last one to stop puts back the original value
+_switch_lock = threading.Lock()
+_running_samplers = 0
+_original_switch_interval = None
+
+
+def _shorten_switch_interval(interval):
+    global _running_samplers, _original_switch_interval
+    with _switch_lock:
+        if _running_samplers == 0:
+            _original_switch_interval = sys.getswitchinterval()
+        _running_samplers += 1
+        # Let the samplers take the GIL about as often as the most frequent one wants to sample
+        sys.setswitchinterval(min(sys.getswitchinterval(), interval / 4))
+
+
+def _restore_switch_interval():
+    global _running_samplers
+    with _switch_lock:
+        _running_samplers -= 1
+        if _running_samplers == 0:
+            sys.setswitchinterval(_original_switch_interval)
+
+
+class StackSampler:
+    """Count the stacks of every busy thread until stopped."""
+
+    def __init__(self, interval):
+        self.interval = interval
+        self.stacks = Counter()
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='profile-sampler', daemon=True)
+
+    def start(self):
+        _shorten_switch_interval(self.interval)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        _restore_switch_interval()
+
+    def _run(self):
+        own_id = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            self.samples += 1
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                code = frame.f_code
+                if (os.path.basename(code.co_filename), code.co_name) in IDLE_FRAMES:
+                    continue
+                stack = []
+                while frame is not None:
+                    stack.append(frame.f_code)
+                    frame = frame.f_back
+                self.stacks[tuple(reversed(stack))] += 1
+
+    def functions(self, limit=TOP_FUNCTIONS):
+        """
+        Return the functions with the most samples on top of the stack (self time)
+        and anywhere in it (total time), each as a list of the `limit` highest.
+        """
+        own, total = Counter(), Counter()
+        for stack, count in self.stacks.items():
+            own[stack[-1]] += count
+            for code in set(stack):
+                total[code] += count
+
+        def rows(ranking):
+            return [
+                {'function': frame_label(code), 'self': own[code], 'total': total[code]}
+                for code, _ in ranking.most_common(limit)
+            ]
+        return rows(own), rows(total)
+
+    def folded(self):
+        """Return the stacks in the folded format read by flame graph tools."""
+        return '\n'.join(
+            f"{';'.join(frame_label(code) for code in stack)} {count}"
+            for stack, count in self.stacks.most_common()
+        )
+
+
+def profile_dir():
+    return str(settings.PROFILE_DIR)
+
+
+def list_profiles():
+    """Return the stored profile file names, newest first."""
+    try:
+        names = [name for name in os.listdir(profile_dir()) if PROFILE_NAME.match(name)]
+    except FileNotFoundError:
+        return []
+    return sorted(names, reverse=True)
+
+
+def profile_path(name):
+    """Return the path of a stored profile, or None if `name` is not one."""
+    if not PROFILE_NAME.match(name) or name not in list_profiles():
+        return None
+    return os.path.join(profile_dir(), name)
+
+
+def save_profile(profile):
+    """Write `profile` to the ring and drop the oldest profiles beyond PROFILE_RING_SIZE."""
+    directory = profile_dir()
+    os.makedirs(directory, exist_ok=True)
+    stamp = datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%S%f')
+    name = f"{stamp}-{os.getpid()}-{uuid.uuid4().hex[:8]}.json"
+    with open(os.path.join(directory, name), 'w', encoding='utf-8') as stream:
+        json.dump(profile, stream, indent=1)
+    for old in list_profiles()[settings.PROFILE_RING_SIZE:]:
+        try:
+            os.remove(os.path.join(directory, old))
+        except FileNotFoundError:
+            pass
+    return name
+
+
+def is_requested(request):
+    """Whether the request asks to be profiled through the configured header or parameter."""
+    header = settings.PROFILE_HEADER
+    param = settings.PROFILE_PARAM
+    return bool(
+        (header and request.headers.get(header) == '1')
+        or (param and request.GET.get(param) == '1')
+    )
+
+
+class ProfilingMiddleware:
+    """Profile requests from staff users that ask for it."""
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not getattr(settings, 'PROFILING_ENABLED', False):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+        install()
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        if not (is_requested(request) and request.user.is_staff):
+            return self.get_response(request)
+        sampler, timings, token = self.start()
+        try:
+            response = self.get_response(request)
+        finally:
+            self.stop(sampler, token)
+        return self.finish(request, response, sampler, timings)
+
+    async def __acall__(self, request):
+        if not is_requested(request) or not (await request.auser()).is_staff:
+            return await self.get_response(request)
+        sampler, timings, token = self.start()
+        try:
+            response = await self.get_response(request)
+        finally:
+            self.stop(sampler, token)
+        return await sync_to_async(self.finish)(request, response, sampler, timings)
+
+    def start(self):
+        timings = current_timings.get()
+        token = None
+        if timings is None:
+            timings = RequestTimings()
+            token = current_timings.set(timings)
+        sampler = StackSampler(settings.PROFILE_INTERVAL)
+        sampler.start()
+        return sampler, timings, token
+
+    def stop(self, sampler, token):
+        sampler.stop()
+        if token is not None:
+            current_timings.reset(token)
+
+    def finish(self, request, response, sampler, timings):
+        hottest, cumulative = sampler.functions()
+        profile = {
+            'method': request.method,
+            'path': request.get_full_path(),
+            'user': request.user.get_username(),
+            'status': response.status_code,
+            'pid': os.getpid(),
+            'captured_at': datetime.now(timezone.utc).isoformat(),
+            'interval_ms': settings.PROFILE_INTERVAL * 1000,
+            'samples': sampler.samples,
+            'queries': timings.queries,
+            **{f'{name}_ms': round(ms, 1) for name, ms, _ in timings.metrics()},
+            'hottest': hottest,
+            'cumulative': cumulative,
+            'folded_stacks': sampler.folded(),
+        }
+        response['X-Profile-Id'] = save_profile(profile)
+        return response
@@ -0,0 +1,192 @@
+"""
+Materialized habit, sleep and mood rollups.
+
+Keeps one `Rollup` row per user per day, week and month. The write endpoints
+call `refresh_days` for the days they touch: the day rows are recomputed from
+the raw logs and the differences are added to their week and month rows, so
+summary views read a handful of rows instead of thousands of logs.
+"""
+
+import operator
+from datetime import timedelta
+from functools import reduce
+
+from django.db import transaction
+from django.db.models import Case, Count, F, Q, Value, When
+from django.utils.timezone import localtime
+
+from base.models import Habit, HabitLog, MoodLog, Rollup, SleepLog
+from base.sleep_timeline import build_sleep_timeline
+
+SECTIONS = ('habits', 'sleep', 'mood')
+
+SECTION_FIELDS = {
+    'habits': ('habits_completed',),
+    'sleep': ('sleep_minutes', 'sleep_nights'),
+    'mood': ('mood_total', 'mood_count'),
+}
+
+
+def period_starts(day):
+    """Return the first day of the day, week and month containing `day`."""
+    return {
+        'day': day,
+        'week': day - timedelta(days=day.weekday()),
+        'month': day.replace(day=1),
+    }
+
+
+def sleep_days(start, end):
+    """
+    Return the wake-up days whose 18:00-18:00 night overlaps the interval.
+    Shifting by six hours maps each night onto a calendar day.
+    """
+    first = localtime(start + timedelta(hours=6)).date()
+    last = localtime(end + timedelta(hours=6) - timedelta(microseconds=1)).date()
+    return [first + timedelta(days=i) for i in range((last - first).days + 1)]
+
+
+def _day_values(user, days, sections):
+    """Compute fresh rollup values for each of `days` from the raw logs."""
+    values = {day: {} for day in days}
+    if 'habits' in sections:
+        counts = dict(HabitLog.objects.filter(
+            user=user, date__in=days, completed=True,
+        ).values('date').annotate(n=Count('id')).values_list('date', 'n'))
+        for day in days:
+            values[day]['habits_completed'] = counts.get(day, 0)
+    if 'sleep' in sections:
+        first, last = min(days), max(days)
+        nights = build_sleep_timeline(user, first - timedelta(days=1), (last - first).days + 1)
+        for night in nights:
+            wake_day = night['date'] + timedelta(days=1)
+            if wake_day in values:
+                values[wake_day]['sleep_minutes'] = int(night['total'].total_seconds() // 60)
+                values[wake_day]['sleep_nights'] = 1 if night['log'] else 0
+    if 'mood' in sections:
+        moods = dict(MoodLog.objects.filter(user=user, date__in=days).values_list('date', 'mood'))
+        for day in days:
+            values[day]['mood_total'] = moods.get(day, 0)
+            values[day]['mood_count'] = 1 if day in moods else 0
+    return values
+
+
+def refresh_days(user, days, sections=SECTIONS):
+    """
+    Recompute the given sections of the user's rollups for `days` and apply
+    the changes to the week and month rollups containing them.
+    """
+    days = sorted(set(days))
+    if not days:
+        return
+    values = _day_values(user, days, sections)
+    habit_count = Habit.objects.filter(user=user, archived=False).count()
+
+    with transaction.atomic():
+        day_rows = {
+            rollup.start: rollup
+            for rollup in Rollup.objects.select_for_update().filter(user=user, period='day', start__in=days)
+        }
+        missing = [Rollup(user=user, period='day', start=day) for day in days if day not in day_rows]
+        Rollup.objects.bulk_create(missing, ignore_conflicts=True)
+        if missing:
+            day_rows = {
+                rollup.start: rollup
+                for rollup in Rollup.objects.select_for_update().filter(user=user, period='day', start__in=days)
+            }
+
+        # Sum the per-day differences for every week and month touched
+        deltas = {}
+        for day in days:
+            day_row = day_rows[day]
+            starts = period_starts(day)
+            week_deltas = deltas.setdefault(('week', starts['week']), {})
+            month_deltas = deltas.setdefault(('month', starts['month']), {})
+            for field, value in values[day].items():
+                delta = value - getattr(day_row, field)
+                setattr(day_row, field, value)
+                for period_deltas in (week_deltas, month_deltas):
+                    period_deltas[field] = period_deltas.get(field, 0) + delta
+            day_row.habit_count = habit_count
+        Rollup.objects.bulk_update(
+            day_rows.values(),
+            ['habit_count'] + [field for section in sections for field in SECTION_FIELDS[section]],
+        )
+
+        Rollup.objects.bulk_create(
+            [Rollup(user=user, period=period, start=start) for period, start in deltas],
+            ignore_conflicts=True,
+        )
+        # One UPDATE for all touched weeks and months, however many days changed
+        matches = {key: Q(period=key[0], start=key[1]) for key in deltas}
+        fields = {field for period_deltas in deltas.values() for field in period_deltas}
+        Rollup.objects.filter(reduce(operator.or_, matches.values()), user=user).update(
+            habit_count=habit_count,
+            **{
+                field: F(field) + Case(
+                    *(When(matches[key], then=Value(period_deltas.get(field, 0)))
+                      for key, period_deltas in deltas.items()),
+                    default=Value(0),
+                )
+                for field in fields
+            },
+        )
+
+
+def refresh_day(user, day, sections=SECTIONS):
+    """Refresh the user's rollups for a single day."""
+    refresh_days(user, [day], sections)
+
+
+def refresh_sleep_intervals(user, intervals):
+    """Refresh the sleep rollups of every day touched by (start, end) intervals."""
+    days = {day for start, end in intervals for day in sleep_days(start, end)}
+    refresh_days(user, days, sections=('sleep',))
+
+
+def refresh_habit_count(user):
+    """Store the user's number of active habits on all of their rollups, after it changed."""
+    habit_count = Habit.objects.filter(user=user, archived=False).count()
+    Rollup.objects.filter(user=user).exclude(habit_count=habit_count).update(habit_count=habit_count)
+
+
+def rebuild_user(user):
+    """Rebuild all of the user's rollups from raw logs."""
+    days = {}
+
+    def row(day):
+        return days.setdefault(day, {field: 0 for fields in SECTION_FIELDS.values() for field in fields})
+
+    completed = HabitLog.objects.filter(user=user, completed=True).values('date').annotate(n=Count('id'))
+    for entry in completed:
+        row(entry['date'])['habits_completed'] = entry['n']
+
+    for log_date, mood in MoodLog.objects.filter(user=user).values_list('date', 'mood'):
+        row(log_date).update(mood_total=mood, mood_count=1)
+
+    first_log = SleepLog.objects.filter(user=user).order_by('start').first()
+    last_log = SleepLog.objects.filter(user=user).order_by('-end').first()
+    if first_log and last_log:
+        first_day = sleep_days(first_log.start, first_log.end)[0]
+        last_day = sleep_days(last_log.start, last_log.end)[-1]
+        nights = build_sleep_timeline(user, first_day - timedelta(days=1), (last_day - first_day).days + 1)
+        for night in nights:
+            if night['log']:
+                values = row(night['date'] + timedelta(days=1))
+                values['sleep_minutes'] = int(night['total'].total_seconds() // 60)
+                values['sleep_nights'] = 1
+
+    habit_count = Habit.objects.filter(user=user, archived=False).count()
+    rollups = {}
+    for day, values in days.items():
+        for period, start in period_starts(day).items():
+            rollup = rollups.setdefault((period, start), Rollup(
+                user=user, period=period, start=start, habit_count=habit_count,
+            ))
+            for field, value in values.items():
+                setattr(rollup, field, getattr(rollup, field) + value)
+
+    with transaction.atomic():
+        Rollup.objects.filter(user=user).delete()
+        Rollup.objects.bulk_create(rollups.values(), batch_size=500)
+    return len(rollups)
@@ -0,0 +1,162 @@
+"""
+Per-request timing instrumentation.
+
+When SERVER_TIMING_ENABLED is set, `ServerTimingMiddleware` records for every
+request the number of SQL queries and the time spent in them (through a
+database execute wrapper), the view time and the template render time. They
+are sent back as a `Server-Timing` header, which browser devtools show in the
+network panel, and logged as one JSON line on the `base.server_timing` logger.
+
+Timings live in a context variable, so queries made from async views through
+`sync_to_async` are counted against the request that made them.
+"""
+
+import json
+import logging
+import time
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.core.signals import request_started
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.template.base import Template
+
+logger = logging.getLogger(__name__)
+
+current_timings = ContextVar('current_timings', default=None)
+
+
+class RequestTimings:
+    """Counters collected while handling one request."""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.queries = 0
+        self.db = 0.0
+        self.template = 0.0
+        self.template_depth = 0
+        self.view_started = None
+        self.view = None
+
+    def metrics(self):
+        """Return (name, milliseconds, description) for each recorded metric."""
+        total = time.perf_counter() - self.started
+        metrics = [
+            ('db', self.db, f'{self.queries} queries'),
+            ('tpl', self.template, 'Template render'),
+        ]
+        if self.view is not None:
+            metrics.append(('view', self.view, 'View'))
+        metrics.append(('total', total, 'Total'))
+        return [(name, seconds * 1000, desc) for name, seconds, desc in metrics]
+
+
+def record_query(execute, sql, params, many, context):
+    """Database execute wrapper adding each query to the current request's timings."""
+    timings = current_timings.get()
+    if timings is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        timings.db += time.perf_counter() - started
+        timings.queries += 1
+
+
+def install_wrapper(connection):
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_query)
+
+
+def connection_opened(sender, connection, **kwargs):
+    install_wrapper(connection)
+
+
+def request_began(sender, **kwargs):
+    # Runs in the thread that handles the request's queries, under WSGI and ASGI alike
+    for connection in connections.all():
+        install_wrapper(connection)
+
+
+_template_render = Template.render
+
+
+def timed_render(self, context):
+    """Template.render that adds the outermost render to the current request's timings."""
+    timings = current_timings.get()
+    if timings is None:
+        return _template_render(self, context)
+    timings.template_depth += 1
+    started = time.perf_counter()
+    try:
+        return _template_render(self, context)
+    finally:
+        timings.template_depth -= 1
+        if not timings.template_depth:
+            timings.template += time.perf_counter() - started
+
+
+def install():
+    """Hook the database and template engine; safe to call more than once."""
+    connection_created.connect(connection_opened, dispatch_uid='server_timing_connection')
+    request_started.connect(request_began, dispatch_uid='server_timing_request')
+    Template.render = timed_render
+
+
+class ServerTimingMiddleware:
+    """Add a Server-Timing header and a timing log line to every response."""
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not getattr(settings, 'SERVER_TIMING_ENABLED', False):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+        install()
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        timings = RequestTimings()
+        token = current_timings.set(timings)
+        try:
+            response = self.get_response(request)
+        finally:
+            current_timings.reset(token)
+        return self.finish(request, response, timings)
+
+    async def __acall__(self, request):
+        timings = RequestTimings()
+        token = current_timings.set(timings)
+        try:
+            response = await self.get_response(request)
+        finally:
+            current_timings.reset(token)
+        return self.finish(request, response, timings)
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        timings = current_timings.get()
+        if timings is not None:
+            timings.view_started = time.perf_counter()
+
+    def finish(self, request, response, timings):
+        if timings.view_started is not None:
+            timings.view = time.perf_counter() - timings.view_started
+        metrics = timings.metrics()
+        response['Server-Timing'] = ', '.join(
+            f'{name};dur={ms:.1f};desc="{desc}"' for name, ms, desc in metrics
+        )
+        logger.info(json.dumps({
+            'method': request.method,
+            'path': request.path,
+            'status': response.status_code,
+            'queries': timings.queries,
+            **{f'{name}_ms': round(ms, 1) for name, ms, _ in metrics},
+        }))
+        return response
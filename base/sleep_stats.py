@@ -0,0 +1,84 @@
+"""
+Sleep statistics over arbitrary ranges.
+
+Computes duration, bedtime and wake-time consistency, sleep debt and a
+weekday/weekend breakdown from one range query, using the same night rules
+and vectorized arrays as the sleep timeline. Nights are labelled by wake-up
+day, and bed and wake times are measured from the night's 18:00 start so
+that averaging times around midnight works. Results are cached per user and
+data version, so repeated dashboard loads skip the query entirely.
+"""
+
+from datetime import timedelta
+
+import numpy as np
+from django.conf import settings
+from django.core.cache import cache
+
+from base.sleep_timeline import NIGHT_START, _timeline_logs, sleep_arrays
+from base.versioning import get_version
+
+MAX_STATS_DAYS = 1096
+
+
+def _clock(offset_minutes):
+    """Format minutes after the night's start as a wall-clock HH:MM."""
+    minutes = int(round(NIGHT_START.hour * 60 + offset_minutes)) % (24 * 60)
+    return f"{minutes // 60:02d}:{minutes % 60:02d}"
+
+
+def _time_stats(offsets):
+    minutes = offsets / 60
+    return {
+        'mean': _clock(minutes.mean()),
+        'std_minutes': round(float(minutes.std()), 1),
+        'variance_minutes': round(float(minutes.var()), 1),
+    }
+
+
+def _summary(starts, ends, target_hours):
+    """Summarize the nights described by the (start, end) offset arrays."""
+    if not len(starts):
+        return {'nights': 0, 'duration': None, 'bedtime': None, 'wake_time': None, 'sleep_debt_hours': 0.0}
+    hours = (ends - starts) / 3600
+    return {
+        'nights': int(len(hours)),
+        'duration': {
+            'mean_hours': round(float(hours.mean()), 2),
+            'std_hours': round(float(hours.std()), 2),
+        },
+        'bedtime': _time_stats(starts),
+        'wake_time': _time_stats(ends),
+        # Hours missing from the target on short nights; long nights do not pay debt back
+        'sleep_debt_hours': round(float(np.maximum(target_hours - hours, 0).sum()), 2),
+    }
+
+
+def compute_sleep_stats(user, first_day, last_day):
+    """Compute sleep statistics for the nights waking up from `first_day` to `last_day`."""
+    target_hours = getattr(settings, 'SLEEP_TARGET_HOURS', 8)
+    num_nights = (last_day - first_day).days + 1
+    range_start, logs = _timeline_logs(user, first_day - timedelta(days=1), num_nights)
+    owner, starts, ends = sleep_arrays(list(logs), range_start, num_nights)
+
+    logged = owner >= 0
+    weekend = (first_day.weekday() + np.arange(num_nights)) % 7 >= 5
+    stats = {
+        'from': first_day.isoformat(),
+        'to': last_day.isoformat(),
+        'target_hours': target_hours,
+        **_summary(starts[logged], ends[logged], target_hours),
+    }
+    stats['weekday'] = _summary(starts[logged & ~weekend], ends[logged & ~weekend], target_hours)
+    stats['weekend'] = _summary(starts[logged & weekend], ends[logged & weekend], target_hours)
+    return stats
+
+
+def cached_sleep_stats(user, first_day, last_day):
+    """Return `compute_sleep_stats`, cached until the user's data version changes."""
+    key = f"sleep_stats:{user.pk}:{get_version(user)}:{first_day}:{last_day}"
+    stats = cache.get(key)
+    if stats is None:
+        stats = compute_sleep_stats(user, first_day, last_day)
+        cache.set(key, stats, getattr(settings, 'SLEEP_STATS_CACHE_TIMEOUT', 3600))
+    return stats
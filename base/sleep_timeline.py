@@ -0,0 +1,173 @@
+"""
+Sleep timeline engine.
+
+Builds the per-night sleep blocks shown by the sleep tracker views from a
+single query. A "night" runs from 18:00 on a given day to 18:00 the next day,
+and only the newest overlapping log (latest end) is counted for each night -
+the same rules `process_day` has always used.
+
+The counted logs are turned into a nights x 1440 boolean minute occupancy
+array with NumPy; hourly blocks, partial-hour coverage and per-night totals
+are all reductions over that array and the interval offsets behind it.
+"""
+
+from datetime import datetime, time, timedelta
+
+import numpy as np
+from django.utils.timezone import make_aware
+
+from base.models import SleepLog
+
+NIGHT_START = time(18, 0)
+NIGHT_LENGTH = timedelta(hours=24)
+BLOCKS_PER_NIGHT = 24
+MINUTES_PER_NIGHT = 24 * 60
+
+# Block labels never change (18:00, 19:00, ... 17:00), so build them once
+HOUR_LABELS = [f"{(NIGHT_START.hour + i) % 24:02d}:00" for i in range(BLOCKS_PER_NIGHT + 1)]
+
+
+def night_bounds(day):
+    """Return the (start, end) datetimes of the night starting on `day`."""
+    night_start = make_aware(datetime.combine(day, NIGHT_START))
+    return night_start, night_start + NIGHT_LENGTH
+
+
+def format_sleep_time(total_sleep):
+    """Format a sleep duration the way the tracker templates display it."""
+    if not total_sleep:
+        return "–"
+    hours = total_sleep.seconds // 3600
+    minutes = (total_sleep.seconds % 3600) // 60
+    return f"{hours}h {minutes}min"
+
+
+def night_edges(range_start, num_nights):
+    """Return the POSIX timestamps of the num_nights + 1 night boundaries from `range_start`."""
+    return np.array([(range_start + NIGHT_LENGTH * i).timestamp() for i in range(num_nights + 1)])
+
+
+def assign_nights(log_starts, log_ends, edges):
+    """
+    Return, for each night, the index of the log counted for it (-1 if none).
+    Logs must be ordered newest first: the lowest index overlapping a night wins.
+    """
+    num_nights = len(edges) - 1
+    owner = np.full(num_nights, len(log_starts))
+    if len(log_starts):
+        # Night j overlaps a log when edges[j] < end and edges[j + 1] > start
+        first = np.searchsorted(edges[1:], log_starts, side='right')
+        last = np.searchsorted(edges[:-1], log_ends, side='left')
+        counts = np.maximum(last - first, 0)
+        offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+        nights = np.repeat(first, counts) + offsets
+        np.minimum.at(owner, nights, np.repeat(np.arange(len(log_starts)), counts))
+    owner[owner == len(log_starts)] = -1
+    return owner
+
+
+def night_offsets(owner, log_starts, log_ends, edges):
+    """
+    Return (start, end) arrays of seconds since each night's 18:00 covered by
+    its log, clipped to the night; nights without a log get (0, 0).
+    """
+    has_log = owner >= 0
+    index = np.where(has_log, owner, 0)
+    night_starts = edges[:-1]
+    lengths = np.diff(edges)
+    starts = np.zeros(len(owner))
+    ends = np.zeros(len(owner))
+    if len(log_starts):
+        starts = np.where(has_log, log_starts[index] - night_starts, 0)
+        ends = np.where(has_log, log_ends[index] - night_starts, 0)
+    return np.clip(starts, 0, lengths), np.clip(ends, 0, lengths)
+
+
+def sleep_occupancy(starts, ends):
+    """
+    Build the nights x MINUTES_PER_NIGHT boolean array of minutes slept.
+    A minute counts when the log covers any part of it.
+    """
+    first = np.floor(starts / 60)
+    last = np.ceil(ends / 60)
+    minutes = np.arange(MINUTES_PER_NIGHT)
+    return (minutes >= first[:, None]) & (minutes < last[:, None])
+
+
+def hourly_minutes(occupancy):
+    """Return the nights x BLOCKS_PER_NIGHT array of minutes slept in each hour."""
+    return occupancy.reshape(len(occupancy), BLOCKS_PER_NIGHT, -1).sum(axis=2)
+
+
+# Templates only read blocks, so every (hour, minutes slept) pair maps to one shared dict
+BLOCK_TABLE = [
+    [{"label": label, "slept": minutes > 0, "coverage": minutes / 60} for minutes in range(61)]
+    for label in HOUR_LABELS[:-1]
+]
+
+
+def sleep_arrays(logs, range_start, num_nights):
+    """
+    Vectorize `logs` (newest first) over `num_nights` nights from `range_start`.
+    Returns (owner, starts, ends): the index of the log counted for each night
+    (-1 if none) and the second offsets it covers within that night.
+    """
+    log_starts = np.array([log.start.timestamp() for log in logs])
+    log_ends = np.array([log.end.timestamp() for log in logs])
+    edges = night_edges(range_start, num_nights)
+    owner = assign_nights(log_starts, log_ends, edges)
+    starts, ends = night_offsets(owner, log_starts, log_ends, edges)
+    return owner, starts, ends
+
+
+def _timeline_logs(user, first_night, num_nights):
+    """Return the range start and the query for every log overlapping the nights."""
+    range_start, _ = night_bounds(first_night)
+    range_end = range_start + NIGHT_LENGTH * num_nights
+    logs = SleepLog.objects.filter(
+        user=user,
+        start__lt=range_end,
+        end__gt=range_start,
+    ).order_by('-end').only('start', 'end')
+    return range_start, logs
+
+
+def _assemble_timeline(logs, range_start, first_night, num_nights):
+    logs = list(logs)
+    owner, starts, ends = sleep_arrays(logs, range_start, num_nights)
+    hours = hourly_minutes(sleep_occupancy(starts, ends)).tolist()
+    totals = (ends - starts).tolist()
+
+    nights = []
+    for i, log_index in enumerate(owner.tolist()):
+        total = timedelta(seconds=totals[i])
+        nights.append({
+            'date': first_night + timedelta(days=i),
+            'log': logs[log_index] if log_index >= 0 else None,
+            'total': total,
+            'blocks': [table[minutes] for table, minutes in zip(BLOCK_TABLE, hours[i])],
+            'sleep_time': format_sleep_time(total),
+        })
+    return nights
+
+
+def build_sleep_timeline(user, first_night, num_nights):
+    """
+    Build sleep data for `num_nights` consecutive nights, starting with the
+    night that begins at 18:00 on `first_night`.
+
+    All logs overlapping the whole range are fetched in one query and
+    assigned newest-first, so each night keeps the newest log that overlaps it.
+
+    Returns a list with one dict per night:
+        {'date', 'log', 'total', 'blocks', 'sleep_time'}
+    """
+    range_start, logs = _timeline_logs(user, first_night, num_nights)
+    return _assemble_timeline(logs, range_start, first_night, num_nights)
+
+
+async def abuild_sleep_timeline(user, first_night, num_nights):
+    """Async version of `build_sleep_timeline`, using the async ORM."""
+    range_start, logs = _timeline_logs(user, first_night, num_nights)
+    logs = [log async for log in logs]
+    return _assemble_timeline(logs, range_start, first_night, num_nights)
@@ -0,0 +1,212 @@
+"""
+Slow-query log.
+
+When SLOW_QUERY_THRESHOLD_MS is set, every database connection gets an
+execute wrapper that logs statements slower than the threshold as one JSON
+line on the `base.slow_queries` logger, with:
+
+- the normalized SQL (literals and placeholders replaced by ?, IN lists folded)
+- the parameters' types rather than their values
+- the project call site that issued it, e.g. base/views.py:113 in process_day,
+  and the view handling the request (async views run their queries in
+  another thread, so for them the view is the best call site there is)
+- for SELECTs, the backend's EXPLAIN plan plus the indexes it uses and the
+  tables it scans in full
+
+To keep the log readable under load, only SLOW_QUERY_SAMPLE_RATE of the slow
+statements are considered and each normalized statement is logged at most
+once per SLOW_QUERY_COOLDOWN seconds per process.
+"""
+
+import json
+import logging
+import os
+import random
+import re
+import sys
+import time
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import DatabaseError, transaction
+from django.db.backends.signals import connection_created
+
+from base.ttl_cache import TTLCache
+
+logger = logging.getLogger(__name__)
+
+explaining = ContextVar('explaining', default=False)
+current_view = ContextVar('current_view', default=None)
+recently_logged = TTLCache(max_size=1000, ttl=getattr(settings, 'SLOW_QUERY_COOLDOWN', 60))
+
+STRING_LITERAL = re.compile(r"'(?:[^']|'')*'")
+NUMBER_LITERAL = re.compile(r'\b\d+(?:\.\d+)?\b')
+PLACEHOLDER = re.compile(r'%s|\?')
+VALUE_LIST = re.compile(r'\(\s*\?(?:\s*,\s*\?)+\s*\)')
+WHITESPACE = re.compile(r'\s+')
+
+# Index and full-table usage in SQLite and PostgreSQL plans
+INDEX_USED = re.compile(r'USING (?:COVERING )?INDEX (\w+)|Index (?:Only )?Scan (?:Backward )?using (\w+)|Bitmap Index Scan on (\w+)')
+FULL_SCAN = re.compile(r'^SCAN (?:TABLE )?(\w+)$|Seq Scan on (\w+)')
+
+MAX_PARAMS = 20
+# Frames that every query passes through and that say nothing about its origin
+ENTRY_POINTS = ('manage.py', os.path.join('habits_project', ''))
+
+
+def normalize_sql(sql):
+    """Replace literal values with ? and fold value lists, so equal statements compare equal."""
+    sql = STRING_LITERAL.sub('?', sql)
+    sql = NUMBER_LITERAL.sub('?', sql)
+    sql = PLACEHOLDER.sub('?', sql)
+    sql = VALUE_LIST.sub('(...)', sql)
+    return WHITESPACE.sub(' ', sql).strip()
+
+
+def params_shape(params, many):
+    """Describe the parameters by type, never by value."""
+    if many:
+        rows = list(params or [])
+        return {'rows': len(rows), 'row': params_shape(rows[0], False) if rows else []}
+    if isinstance(params, dict):
+        return {key: type(value).__name__ for key, value in list(params.items())[:MAX_PARAMS]}
+    shape = [type(value).__name__ for value in list(params or [])[:MAX_PARAMS]]
+    if params and len(params) > MAX_PARAMS:
+        shape.append(f'... {len(params) - MAX_PARAMS} more')
+    return shape
+
+
+def call_site(connection):
+    """Return the innermost project frame on the stack, as path:line in function."""
+    base_dir = str(settings.BASE_DIR) + os.sep
+    # Other execute wrappers are on the stack too, between the ORM and this module
+    wrappers = {getattr(wrapper, '__code__', None) for wrapper in connection.execute_wrappers}
+    frame = sys._getframe(1)
+    while frame is not None:
+        filename = frame.f_code.co_filename
+        path = os.path.relpath(filename, base_dir)
+        if (filename.startswith(base_dir) and filename != __file__ and 'site-packages' not in filename
+                and not path.startswith(ENTRY_POINTS) and frame.f_code not in wrappers):
+            return f"{path}:{frame.f_lineno} in {frame.f_code.co_name}"
+        frame = frame.f_back
+    return None
+
+
+def explain(connection, sql, params):
+    """Return the plan lines of a SELECT, or an error string if EXPLAIN failed."""
+    prefix = connection.ops.explain_query_prefix()
+    token = explaining.set(True)
+    try:
+        # A savepoint keeps a failed EXPLAIN from breaking the caller's transaction
+        with transaction.atomic(using=connection.alias), connection.cursor() as cursor:
+            cursor.execute(f'{prefix} {sql}', params)
+            rows = cursor.fetchall()
+    except DatabaseError as error:
+        return [f'EXPLAIN failed: {error}']
+    finally:
+        explaining.reset(token)
+    if connection.vendor == 'sqlite':
+        return [str(row[-1]) for row in rows]
+    return [' '.join(str(value) for value in row) for row in rows]
+
+
+def plan_usage(plan):
+    """Return the indexes a plan uses and the tables it scans in full."""
+    indexes, full_scans = [], []
+    for line in plan:
+        line = line.strip()
+        indexes += [name for match in INDEX_USED.findall(line) for name in match if name]
+        full_scans += [name for match in FULL_SCAN.findall(line) for name in match if name]
+    return sorted(set(indexes)), sorted(set(full_scans))
+
+
+def should_log(normalized):
+    # Sampling only; nothing here is security sensitive
+    if random.random() >= settings.SLOW_QUERY_SAMPLE_RATE:  # nosec B311
+        return False
+    if recently_logged.get(normalized):
+        return False
+    recently_logged.set(normalized, True)
+    return True
+
+
+def log_slow_queries(execute, sql, params, many, context):
+    """Database execute wrapper logging statements slower than SLOW_QUERY_THRESHOLD_MS."""
+    threshold = settings.SLOW_QUERY_THRESHOLD_MS
+    if threshold <= 0 or explaining.get():
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    result = execute(sql, params, many, context)
+    duration_ms = (time.perf_counter() - started) * 1000
+    if duration_ms >= threshold:
+        normalized = normalize_sql(sql)
+        if should_log(normalized):
+            record_slow_query(context['connection'], sql, params, many, normalized, duration_ms)
+    return result
+
+
+def record_slow_query(connection, sql, params, many, normalized, duration_ms):
+    record = {
+        'duration_ms': round(duration_ms, 2),
+        'sql': normalized,
+        'params': params_shape(params, many),
+        'call_site': call_site(connection),
+        'view': current_view.get(),
+        'database': connection.alias,
+    }
+    if not many and sql.lstrip()[:6].upper() == 'SELECT':
+        plan = explain(connection, sql, params)
+        record['plan'] = plan
+        record['indexes'], record['full_scans'] = plan_usage(plan)
+    logger.warning(json.dumps(record, default=str))
+
+
+def install_wrapper(connection):
+    if log_slow_queries not in connection.execute_wrappers:
+        connection.execute_wrappers.append(log_slow_queries)
+
+
+def connection_opened(sender, connection, **kwargs):
+    install_wrapper(connection)
+
+
+def install():
+    """Log slow queries on every connection opened from now on."""
+    connection_created.connect(connection_opened, dispatch_uid='slow_query_log')
+
+
+class SlowQueryMiddleware:
+    """Remember which view is handling the request, for the slow-query log."""
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not getattr(settings, 'SLOW_QUERY_THRESHOLD_MS', 0) > 0:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        token = current_view.set(None)
+        try:
+            return self.get_response(request)
+        finally:
+            current_view.reset(token)
+
+    async def __acall__(self, request):
+        token = current_view.set(None)
+        try:
+            return await self.get_response(request)
+        finally:
+            current_view.reset(token)
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        # Context changes made here carry over to the view, including its sync_to_async calls
+        # Class-based and DRF function views are named after their class
+        view = getattr(view_func, 'view_class', view_func)
+        current_view.set(f"{view.__module__}.{getattr(view, '__name__', type(view).__name__)}")
@@ -0,0 +1,194 @@
+"""
+Incrementally maintained habit completion stats.
+
+Keeps `current_streak`, `longest_streak`, `total_completions` and
+`last_completed` on `Habit` in step with its `HabitLog` rows. Toggling a day
+only reads the logs of the runs next to that day, in one query bounded by
+the longest streak, so list endpoints can show the stats without scanning a
+habit's whole history.
+"""
+
+from datetime import timedelta
+
+from base.models import Habit, HabitLog
+
+
+def _completed_dates(habit_id, first, last):
+    return set(HabitLog.objects.filter(
+        habit_id=habit_id,
+        completed=True,
+        date__gte=first,
+        date__lte=last,
+    ).values_list('date', flat=True))
+
+
+class _CompletedDays:
+    """
+    A habit's completed days around the days being changed, read in one query.
+    Each run next to a changed day was at most `longest_streak` days long, so
+    reading that many days (plus the gap) on either side finds every gap a
+    walk along a run needs. Days outside the window are read on demand.
+    """
+
+    def __init__(self, habit, first, last):
+        self.habit_id = habit.id
+        self.margin = timedelta(days=habit.longest_streak + 1)
+        self.first, self.last = first - self.margin, last + self.margin
+        self.dates = _completed_dates(self.habit_id, self.first, self.last)
+
+    def __contains__(self, day):
+        if day < self.first:
+            self.dates |= _completed_dates(self.habit_id, day - self.margin, self.first - timedelta(days=1))
+            self.first = day - self.margin
+        elif day > self.last:
+            self.dates |= _completed_dates(self.habit_id, self.last + timedelta(days=1), day + self.margin)
+            self.last = day + self.margin
+        return day in self.dates
+
+    def latest_before(self, day):
+        """Return the latest completed day before `day`, or None."""
+        earlier = [d for d in self.dates if d < day]
+        if earlier:
+            return max(earlier)
+        return HabitLog.objects.filter(
+            habit_id=self.habit_id, completed=True, date__lt=self.first,
+        ).order_by('-date').values_list('date', flat=True).first()
+
+
+def _run_length(days, day, step):
+    """
+    Count the completed days directly before (step=-1) or after (step=1)
+    `day`, stopping at the first gap.
+    """
+    length = 0
+    day += timedelta(days=step)
+    while day in days:
+        length += 1
+        day += timedelta(days=step)
+    return length
+
+
+def _longest_run(dates):
+    """Return the length of the longest run in an ascending list of dates."""
+    longest = run = 0
+    previous = None
+    for day in dates:
+        run = run + 1 if previous and day - previous == timedelta(days=1) else 1
+        longest = max(longest, run)
+        previous = day
+    return longest
+
+
+def _apply_completion(habit, days, day):
+    left = _run_length(days, day, -1)
+    right = _run_length(days, day, 1)
+    run = left + 1 + right
+    run_end = day + timedelta(days=right)
+
+    habit.total_completions += 1
+    habit.longest_streak = max(habit.longest_streak, run)
+    if habit.last_completed is None or run_end >= habit.last_completed:
+        habit.last_completed = run_end
+        habit.current_streak = run
+
+
+def _apply_removal(habit, days, day):
+    """Returns whether the removed day was part of a longest run."""
+    left = _run_length(days, day, -1)
+    right = _run_length(days, day, 1)
+
+    habit.total_completions = max(habit.total_completions - 1, 0)
+    if habit.last_completed == day:
+        # The newest completion was removed - the latest run now ends earlier
+        previous = days.latest_before(day)
+        habit.last_completed = previous
+        if previous is None:
+            habit.current_streak = 0
+        elif previous == day - timedelta(days=1):
+            habit.current_streak = left
+        else:
+            habit.current_streak = _run_length(days, previous, -1) + 1
+    elif habit.last_completed and day + timedelta(days=right) == habit.last_completed:
+        # A day inside the latest run was removed - only the part after it remains
+        habit.current_streak = right
+    return left + 1 + right >= habit.longest_streak
+
+
+def record_completion(habit, day):
+    """Update the habit's stats after a log for `day` was created."""
+    _apply_completion(habit, _CompletedDays(habit, day, day), day)
+    _save_stats(habit)
+
+
+def record_removal(habit, day):
+    """
+    Update the habit's stats after the log for `day` was removed.
+    Removing a day can split a run in two, so the latest and longest runs
+    are recalculated from the runs on either side of it.
+    """
+    if _apply_removal(habit, _CompletedDays(habit, day, day), day):
+        # Another run may be just as long, so fall back to a full scan of this habit's history
+        habit.longest_streak = _longest_run(_all_dates(habit.id))
+    _save_stats(habit)
+
+
+def record_batch(habit, changes):
+    """
+    Update the habit's stats after many of its logs were created or removed.
+    `changes` maps each changed day to whether it is now completed. The
+    changes are replayed one by one against the days around them, read in
+    one query, and the longest run is settled once at the end.
+    """
+    longest = habit.longest_streak
+    days = _CompletedDays(habit, min(changes), max(changes))
+    # Start from the days as they were before the batch
+    days.dates.difference_update(day for day, completed in changes.items() if completed)
+    days.dates.update(day for day, completed in changes.items() if not completed)
+    for day, completed in sorted(changes.items()):
+        if completed:
+            days.dates.add(day)
+            _apply_completion(habit, days, day)
+        else:
+            days.dates.discard(day)
+            _apply_removal(habit, days, day)
+
+    # Every run touching a changed day lies inside the window; runs outside it
+    # are unchanged and at most `longest` long
+    window_longest = _longest_run(sorted(days.dates))
+    if all(changes.values()):
+        habit.longest_streak = max(longest, window_longest)
+    elif window_longest >= longest:
+        habit.longest_streak = window_longest
+    else:
+        habit.longest_streak = _longest_run(_all_dates(habit.id))
+    _save_stats(habit)
+
+
+def _all_dates(habit_id):
+    return HabitLog.objects.filter(
+        habit_id=habit_id, completed=True,
+    ).order_by('date').values_list('date', flat=True).iterator(chunk_size=2000)
+
+
+def rebuild_stats(habit):
+    """Recalculate every stat for the habit from its full log history."""
+    dates = list(_all_dates(habit.id))
+    habit.total_completions = len(dates)
+    habit.longest_streak = _longest_run(dates)
+    habit.last_completed = dates[-1] if dates else None
+    current = 0
+    for i in range(len(dates) - 1, -1, -1):
+        if i < len(dates) - 1 and dates[i + 1] - dates[i] != timedelta(days=1):
+            break
+        current += 1
+    habit.current_streak = current
+    _save_stats(habit)
+
+
+def _save_stats(habit):
+    habit.save(update_fields=['current_streak', 'longest_streak', 'total_completions', 'last_completed'])
+
+
+def lock_habit(habit_id, user):
+    """Fetch the user's habit with its row locked for a stats update."""
+    return Habit.objects.select_for_update().get(id=habit_id, user=user)
@@ -1,14 +1,56 @@
-from django.test import TestCase, Client
-from django.contrib.auth.models import User
+import io
+import json
+import os
+import random
+import sys
+import tempfile
+import warnings
+import zipfile
+from io import StringIO
+
+from django.test import TestCase, Client, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.contrib.auth.models import User, update_last_login
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management import CommandError, call_command
+from django.db import connection
 from django.urls import reverse
+from django.utils.timezone import make_aware
+from prometheus_client import REGISTRY
 from rest_framework.test import APIClient
 from rest_framework.authtoken.models import Token
-from base.models import Habit, HabitLog, SleepLog, MoodLog
-from datetime import date, datetime, timedelta
+from api.authentication import token_cache
+from base.auth_backends import user_cache
+from base.bitmaps import completed_days, completion_row, load_bitmaps
+from base.change_log import compact, record_changes
+from base.data_import import import_stream
+from base.models import Habit, HabitLog, SleepLog, MoodLog, ChangeLogEntry, HabitYearBitmap, Rollup
+from base.profiling import StackSampler
+from base.rollups import rebuild_user
+from base.sleep_timeline import build_sleep_timeline, night_bounds, sleep_arrays, sleep_occupancy
+from base.slow_queries import install_wrapper, log_slow_queries, normalize_sql, recently_logged
+from base.streaks import rebuild_stats
+from base.templatetags.mood_extras import mood_to_color
+from base.ttl_cache import TTLCache
+from datetime import date, datetime, timedelta, timezone
 
 # Test credentials - not used in production
 TEST_PASSWORD = 'testpass123'  # nosec B105
 TEST_PASSWORD_STRONG = 'TestPass123!'  # nosec B105
+METRICS_TOKEN = 'scrape-secret'  # nosec B105
+
+
+class AuthenticatedAPITestCase(TestCase):
+    """Base for API tests: `self.client` sends a token for `self.user`, named `username`."""
+
+    username = 'testuser'
+
+    def setUp(self):
+        self.user = User.objects.create_user(username=self.username, password=TEST_PASSWORD)
+        self.client = APIClient()
+        self.token = Token.objects.create(user=self.user)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {self.token.key}')
 
 
 class HabitAPITestCase(TestCase):
@@ -118,6 +160,7 @@ class HabitAPITestCase(TestCase):
         )
         self.assertEqual(response.status_code, 201)
         self.assertEqual(HabitLog.objects.count(), 1)
+        self.assertEqual(HabitLog.objects.get().user, self.user)
         
         # Remove log
         response = self.client.post(
@@ -129,18 +172,11 @@ class HabitAPITestCase(TestCase):
         self.assertEqual(HabitLog.objects.count(), 0)
 
 
-class SleepLogAPITestCase(TestCase):
+class SleepLogAPITestCase(AuthenticatedAPITestCase):
     """Test API endpoints for sleep logs."""
     
-    def setUp(self):
-        self.user = User.objects.create_user(username='testuser', password=TEST_PASSWORD)
-        self.client = APIClient()
-        self.token = Token.objects.create(user=self.user)
-        self.client.credentials(HTTP_AUTHORIZATION=f'Token {self.token.key}')
-    
     def test_create_sleep_log(self):
         """Test creating a sleep log."""
-        from django.utils.timezone import make_aware
         start = make_aware(datetime.now() - timedelta(hours=8))
         end = make_aware(datetime.now())
         response = self.client.post(
@@ -156,7 +192,6 @@ class SleepLogAPITestCase(TestCase):
     
     def test_get_sleep_logs(self):
         """Test getting sleep logs."""
-        from django.utils.timezone import make_aware
         SleepLog.objects.create(
             user=self.user,
             start=make_aware(datetime.now() - timedelta(hours=8)),
@@ -164,18 +199,55 @@ class SleepLogAPITestCase(TestCase):
         )
         response = self.client.get('/api/sleep/')
         self.assertEqual(response.status_code, 200)
-        self.assertEqual(len(response.data), 1)
+        self.assertEqual(len(response.data['results']), 1)
+
+    def test_sleep_logs_keyset_pages(self):
+        """Test that following next links returns every log once, newest first."""
+        base = make_aware(datetime(2026, 3, 1, 23, 0))
+        SleepLog.objects.bulk_create([
+            SleepLog(user=self.user, start=base + timedelta(days=i), end=base + timedelta(days=i, hours=8))
+            for i in range(7)
+        ])
+        ends, url = [], '/api/sleep/?limit=3'
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            self.assertLessEqual(len(response.data['results']), 3)
+            ends.extend(log['end'] for log in response.data['results'])
+            url = response.data['next']
+        self.assertEqual(len(ends), 7)
+        self.assertEqual(ends, sorted(ends, reverse=True))
 
+    def test_sleep_logs_cursor_keeps_microseconds(self):
+        """Test that logs ending within the same millisecond are neither skipped nor repeated."""
+        end = make_aware(datetime(2026, 3, 2, 7, 0, 0, 500))
+        SleepLog.objects.bulk_create([
+            SleepLog(user=self.user, start=end - timedelta(hours=8), end=end + timedelta(microseconds=i * 100))
+            for i in range(4)
+        ])
+        ids, url = [], '/api/sleep/?limit=1'
+        while url:
+            response = self.client.get(url)
+            ids.extend(log['id'] for log in response.data['results'])
+            url = response.data['next']
+        self.assertEqual(sorted(ids), sorted(SleepLog.objects.filter(user=self.user).values_list('id', flat=True)))
+
+    def test_sleep_logs_range_filter(self):
+        """Test that ?from=&to= keeps only logs overlapping the range."""
+        base = make_aware(datetime(2026, 3, 1, 23, 0))
+        for i in range(5):
+            SleepLog.objects.create(user=self.user, start=base + timedelta(days=i), end=base + timedelta(days=i, hours=8))
+        response = self.client.get('/api/sleep/?from=2026-03-03&to=2026-03-04')
+        self.assertEqual(response.status_code, 200)
+        # Nights ending on 3 and 4 March, plus the one starting on the evening of 4 March
+        self.assertEqual(len(response.data['results']), 3)
+        self.assertEqual(self.client.get('/api/sleep/?from=yesterday').status_code, 400)
+        self.assertEqual(self.client.get('/api/sleep/?cursor=bogus').status_code, 400)
 
-class MoodLogAPITestCase(TestCase):
+
+class MoodLogAPITestCase(AuthenticatedAPITestCase):
     """Test API endpoints for mood logs."""
     
-    def setUp(self):
-        self.user = User.objects.create_user(username='testuser', password=TEST_PASSWORD)
-        self.client = APIClient()
-        self.token = Token.objects.create(user=self.user)
-        self.client.credentials(HTTP_AUTHORIZATION=f'Token {self.token.key}')
-    
     def test_create_mood_log(self):
         """Test creating a mood log."""
         today = date.today().isoformat()
@@ -234,3 +306,1150 @@ class WebAuthTestCase(TestCase):
         response = self.client.get('/logout/')
         self.assertEqual(response.status_code, 302)  # Redirect to login
 
+
+
+class SleepTimelineTestCase(TestCase):
+    """Test the single-query sleep timeline used by the sleep views."""
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='sleeper', password=TEST_PASSWORD)
+        self.client = Client()
+        self.client.login(username='sleeper', password=TEST_PASSWORD)
+        self.make_aware = make_aware
+
+    def test_newest_log_wins_per_night(self):
+        """Test that only the newest overlapping log counts for a night."""
+        SleepLog.objects.create(
+            user=self.user,
+            start=self.make_aware(datetime(2026, 3, 1, 22, 0)),
+            end=self.make_aware(datetime(2026, 3, 2, 6, 0)),
+        )
+        SleepLog.objects.create(
+            user=self.user,
+            start=self.make_aware(datetime(2026, 3, 2, 1, 0)),
+            end=self.make_aware(datetime(2026, 3, 2, 7, 30)),
+        )
+        nights = build_sleep_timeline(self.user, date(2026, 3, 1), 2)
+        self.assertEqual(nights[0]['sleep_time'], '6h 30min')
+        self.assertEqual([b['slept'] for b in nights[0]['blocks']].count(True), 7)
+        self.assertEqual(nights[1]['sleep_time'], '–')
+
+    def test_minute_occupancy(self):
+        """Test minute-resolution occupancy and partial-hour coverage."""
+        log = SleepLog.objects.create(
+            user=self.user,
+            start=self.make_aware(datetime(2026, 3, 1, 22, 45)),
+            end=self.make_aware(datetime(2026, 3, 2, 6, 15)),
+        )
+        night = build_sleep_timeline(self.user, date(2026, 3, 1), 1)[0]
+        coverage = [b['coverage'] for b in night['blocks']]
+        self.assertEqual(coverage[4], 0.25)  # 22:00-23:00
+        self.assertEqual(coverage[5:12], [1.0] * 7)
+        self.assertEqual(coverage[12], 0.25)  # 06:00-07:00
+        self.assertEqual(sum(b['slept'] for b in night['blocks']), 9)
+
+        owner, starts, ends = sleep_arrays([log], night_bounds(date(2026, 3, 1))[0], 2)
+        self.assertEqual(owner.tolist(), [0, -1])
+        occupancy = sleep_occupancy(starts, ends)
+        self.assertEqual(occupancy.shape, (2, 1440))
+        self.assertEqual(occupancy[0].sum(), 450)
+        self.assertFalse(occupancy[1].any())
+
+    def test_month_view_single_query(self):
+        """Test that the month view reads sleep logs with one query."""
+        for day in range(1, 29):
+            SleepLog.objects.create(
+                user=self.user,
+                start=self.make_aware(datetime(2026, 2, day, 23, 0)),
+                end=self.make_aware(datetime(2026, 2, day, 23, 0)) + timedelta(hours=8),
+            )
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get('/track/sleep/month/', {'month': '2026-02'})
+        self.assertEqual(response.status_code, 200)
+        sleep_queries = [q for q in ctx.captured_queries if 'base_sleeplog' in q['sql']]
+        self.assertEqual(len(sleep_queries), 1)
+
+
+class HabitTrackerViewTestCase(TestCase):
+    """Test the habit tracker pages."""
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='tracker', password=TEST_PASSWORD)
+        self.client = Client()
+        self.client.login(username='tracker', password=TEST_PASSWORD)
+
+    def test_month_view_only_own_logs(self):
+        """Test that the completion grid only contains the user's habits."""
+        habit = Habit.objects.create(name='Exercise', user=self.user)
+        other_user = User.objects.create_user(username='other', password=TEST_PASSWORD)
+        other_habit = Habit.objects.create(name='Other', user=other_user)
+        HabitLog.objects.create(habit=habit, date=date(2026, 5, 3))
+        HabitLog.objects.create(habit=other_habit, date=date(2026, 5, 3))
+        HabitLog.objects.create(habit=habit, date=date(2026, 6, 1))
+
+        response = self.client.get('/track/habits/month/', {'start_date': '2026-05-10'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json.loads(response.context['log_dict_json']), {f'{habit.id}-2026-05-03': True})
+
+    def test_month_view_query_count_independent_of_logs(self):
+        """Test that habit logs are read with a single query."""
+        habits = [Habit.objects.create(name=f'Habit {i}', user=self.user) for i in range(5)]
+        for habit in habits:
+            for day in range(1, 31):
+                HabitLog.objects.create(habit=habit, date=date(2026, 4, day))
+
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get('/track/habits/month/', {'start_date': '2026-04-01'})
+        self.assertEqual(response.status_code, 200)
+        log_queries = [q for q in ctx.captured_queries if 'base_habitlog' in q['sql']]
+        self.assertEqual(len(log_queries), 1)
+        self.assertEqual(len(response.context['log_dict_json'].split(',')), 150)
+
+
+@override_settings(HABIT_BITMAPS_ENABLED=True)
+class HabitBitmapTestCase(AuthenticatedAPITestCase):
+    """Test the bitmap-backed habit completion store."""
+
+    username = 'bitmapper'
+
+    def setUp(self):
+        super().setUp()
+        self.habit = Habit.objects.create(name='Exercise', user=self.user)
+
+    def test_toggle_updates_bitmap(self):
+        """Test that toggling a log sets and clears its bit."""
+        for day in ['2024-12-31', '2025-01-01']:
+            self.client.post('/api/habits/toggle/', {'habit_id': self.habit.id, 'date': day}, format='json')
+        bitmap = HabitYearBitmap.objects.get(habit=self.habit, year=2024)
+        self.assertEqual(completed_days(bitmap.bits, 2024), [date(2024, 12, 31)])
+
+        self.client.post('/api/habits/toggle/', {'habit_id': self.habit.id, 'date': '2024-12-31'}, format='json')
+        bitmap.refresh_from_db()
+        self.assertEqual(completed_days(bitmap.bits, 2024), [])
+        self.assertEqual(HabitYearBitmap.objects.count(), 2)
+
+    def test_backfill_command_matches_logs(self):
+        """Test that the backfill command converts existing HabitLog rows."""
+        for day in [date(2025, 3, 1), date(2025, 3, 2), date(2025, 3, 5)]:
+            HabitLog.objects.create(habit=self.habit, date=day)
+        call_command('backfill_habit_bitmaps', stdout=StringIO())
+
+        bitmaps = load_bitmaps([self.habit.id], date(2025, 3, 1), date(2025, 3, 6))
+        row = completion_row(bitmaps, self.habit.id, date(2025, 3, 1), 5)
+        self.assertEqual(row, [True, True, False, False, True])
+
+
+class HabitStatsTestCase(AuthenticatedAPITestCase):
+    """Test incrementally maintained streak and completion stats."""
+
+    username = 'streaker'
+
+    def setUp(self):
+        super().setUp()
+        self.habit = Habit.objects.create(name='Exercise', user=self.user)
+
+    def toggle(self, day):
+        return self.client.post('/api/habits/toggle/', {'habit_id': self.habit.id, 'date': day.isoformat()}, format='json')
+
+    def stats(self):
+        self.habit.refresh_from_db()
+        return (self.habit.current_streak, self.habit.longest_streak,
+                self.habit.total_completions, self.habit.last_completed)
+
+    def test_untoggle_splits_streak(self):
+        """Test that removing a day in the middle of a streak splits it."""
+        start = date(2026, 1, 1)
+        for i in range(7):
+            self.toggle(start + timedelta(days=i))
+        self.assertEqual(self.stats(), (7, 7, 7, date(2026, 1, 7)))
+
+        self.toggle(start + timedelta(days=2))
+        self.assertEqual(self.stats(), (4, 4, 6, date(2026, 1, 7)))
+
+        self.toggle(start + timedelta(days=6))
+        self.assertEqual(self.stats(), (3, 3, 5, date(2026, 1, 6)))
+
+    def test_incremental_stats_match_rebuild(self):
+        """Test that random toggles leave the same stats as a full rebuild."""
+        rnd = random.Random(7)  # nosec B311
+        start = date(2026, 1, 1)
+        for _ in range(80):
+            self.toggle(start + timedelta(days=rnd.randint(0, 40)))
+            incremental = self.stats()
+            rebuild_stats(self.habit)
+            self.assertEqual(incremental, self.stats())
+
+    def test_batch_stats_match_rebuild(self):
+        """Test that random batches leave the same stats as a full rebuild."""
+        rnd = random.Random(11)  # nosec B311
+        start = date(2026, 1, 1)
+        for _ in range(30):
+            operations = [
+                {'habit_id': self.habit.id, 'date': (start + timedelta(days=rnd.randint(0, 40))).isoformat(),
+                 'completed': rnd.random() < 0.6}
+                for _ in range(rnd.randint(1, 12))
+            ]
+            self.client.post('/api/habits/batch/', {'operations': operations}, format='json')
+            incremental = self.stats()
+            rebuild_stats(self.habit)
+            self.assertEqual(incremental, self.stats())
+
+    def test_toggle_queries_do_not_grow_with_streak(self):
+        """Test that the runs next to a toggled day are read in one query however long they are."""
+        def toggle_queries(days):
+            HabitLog.objects.filter(habit=self.habit).delete()
+            start = date(2026, 1, 1)
+            HabitLog.objects.bulk_create([
+                HabitLog(habit=self.habit, user=self.user, date=start + timedelta(days=i))
+                for i in range(days) if i != days // 2
+            ])
+            rebuild_stats(self.habit)
+            with CaptureQueriesContext(connection) as ctx:
+                self.toggle(start + timedelta(days=days // 2))
+            return len([q for q in ctx.captured_queries if 'base_habitlog' in q['sql']])
+
+        self.assertEqual(toggle_queries(20), toggle_queries(400))
+        self.assertEqual(self.stats()[:2], (400, 400))
+
+    def test_habit_list_includes_stats(self):
+        """Test that the habits endpoint exposes the stats."""
+        self.toggle(date.today())
+        response = self.client.get('/api/habits/')
+        self.assertEqual(response.data[0]['current_streak'], 1)
+        self.assertEqual(response.data[0]['total_completions'], 1)
+
+
+class RollupTestCase(AuthenticatedAPITestCase):
+    """Test incrementally maintained day/week/month rollups."""
+
+    username = 'roller'
+
+    def setUp(self):
+        super().setUp()
+        self.habits = [Habit.objects.create(name=f'Habit {i}', user=self.user) for i in range(2)]
+
+    def snapshot(self):
+        fields = ['habits_completed', 'sleep_minutes', 'sleep_nights', 'mood_total', 'mood_count']
+        return {
+            (r.period, r.start): tuple(getattr(r, f) for f in fields)
+            for r in Rollup.objects.filter(user=self.user)
+            if any(getattr(r, f) for f in fields)
+        }
+
+    def test_writes_match_rebuild(self):
+        """Test that incremental updates match a full rebuild."""
+        for day in ['2026-03-30', '2026-03-31', '2026-04-01']:
+            for habit in self.habits:
+                self.client.post('/api/habits/toggle/', {'habit_id': habit.id, 'date': day}, format='json')
+        self.client.post('/api/habits/toggle/', {'habit_id': self.habits[0].id, 'date': '2026-03-31'}, format='json')
+        self.client.post('/api/mood/', {'date': '2026-03-31', 'mood': 7}, format='json')
+        self.client.post('/api/mood/', {'date': '2026-04-01', 'mood': 4}, format='json')
+        self.client.delete('/api/mood/delete_day/?date=2026-04-01')
+        self.client.post('/api/sleep/', {
+            'start': '2026-03-31T01:00:00Z', 'end': '2026-03-31T08:30:00Z',
+        }, format='json')
+
+        incremental = self.snapshot()
+        rebuild_user(self.user)
+        self.assertEqual(incremental, self.snapshot())
+        self.assertEqual(incremental[('day', date(2026, 3, 31))], (1, 450, 1, 7, 1))
+        self.assertEqual(incremental[('month', date(2026, 3, 1))], (3, 450, 1, 7, 1))
+
+    def test_habit_changes_match_rebuild(self):
+        """Test that adding, archiving and deleting habits keep counts and rates current."""
+        def rollups():
+            return {
+                (r.period, r.start): (r.habits_completed, r.habit_count)
+                for r in Rollup.objects.filter(user=self.user) if r.habits_completed
+            }
+
+        for day in ['2026-03-30', '2026-04-02']:
+            for habit in self.habits:
+                self.client.post('/api/habits/toggle/', {'habit_id': habit.id, 'date': day}, format='json')
+        self.client.post('/api/habits/add_habit/', {'name': 'Habit 2'}, format='json')
+        self.assertEqual(rollups()[('week', date(2026, 3, 30))], (4, 3))
+        self.client.patch(f'/api/habits/archive/{self.habits[1].id}/')
+        self.assertEqual(rollups()[('week', date(2026, 3, 30))], (4, 2))
+        self.client.delete(f'/api/habits/delete/{self.habits[0].id}/')
+
+        incremental = rollups()
+        rebuild_user(self.user)
+        self.assertEqual(incremental, rollups())
+        self.assertEqual(incremental[('month', date(2026, 4, 1))], (1, 1))
+
+    def test_summary_endpoint(self):
+        """Test reading rollups through the summary endpoint."""
+        for habit in self.habits:
+            self.client.post('/api/habits/toggle/', {'habit_id': habit.id, 'date': '2026-03-02'}, format='json')
+        response = self.client.get('/api/summary/', {'period': 'week', 'from': '2026-03-01'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data['results']), 1)
+        self.assertEqual(response.data['results'][0]['habits_completed'], 2)
+        self.assertAlmostEqual(response.data['results'][0]['completion_rate'], 2 / 14)
+
+
+class BatchHabitLogTestCase(AuthenticatedAPITestCase):
+    """Test the batch habit log endpoint."""
+
+    username = 'batcher'
+
+    def setUp(self):
+        super().setUp()
+        self.habit = Habit.objects.create(name='Exercise', user=self.user)
+
+    def test_batch_creates_and_removes(self):
+        """Test applying a mixed batch with per-item results."""
+        other_user = User.objects.create_user(username='other', password=TEST_PASSWORD)
+        other_habit = Habit.objects.create(name='Other', user=other_user)
+        HabitLog.objects.create(habit=self.habit, date=date(2026, 2, 1))
+        operations = [
+            {'habit_id': self.habit.id, 'date': f'2026-02-{day:02d}', 'completed': True}
+            for day in range(2, 11)
+        ] + [
+            {'habit_id': self.habit.id, 'date': '2026-02-01', 'completed': False},
+            {'habit_id': self.habit.id, 'date': '2026-02-20', 'completed': False},
+            {'habit_id': other_habit.id, 'date': '2026-02-01', 'completed': True},
+            {'habit_id': self.habit.id, 'date': 'not a date'},
+        ]
+        response = self.client.post('/api/habits/batch/', {'operations': operations}, format='json')
+        self.assertEqual(response.status_code, 200)
+        statuses = [result['status'] for result in response.data['results']]
+        self.assertEqual(statuses, ['created'] * 9 + ['removed', 'unchanged', 'error', 'error'])
+        self.assertEqual(HabitLog.objects.filter(habit=self.habit).count(), 9)
+        self.assertEqual(HabitLog.objects.filter(user=self.user).count(), 9)
+        self.assertFalse(HabitLog.objects.filter(habit=other_habit).exists())
+
+        self.habit.refresh_from_db()
+        self.assertEqual((self.habit.longest_streak, self.habit.total_completions), (9, 9))
+
+    def test_batch_requires_boolean_completed(self):
+        """Test that a non-boolean completed value is an error, not a completion."""
+        HabitLog.objects.create(habit=self.habit, date=date(2026, 2, 1))
+        operations = [
+            {'habit_id': self.habit.id, 'date': '2026-02-01', 'completed': 'false'},
+            {'habit_id': self.habit.id, 'date': '2026-02-02', 'completed': 0},
+            {'habit_id': self.habit.id, 'date': '2026-02-03', 'completed': None},
+        ]
+        response = self.client.post('/api/habits/batch/', {'operations': operations}, format='json')
+        self.assertEqual(response.status_code, 200)
+        for result in response.data['results']:
+            self.assertEqual(result['status'], 'error')
+            self.assertIn('completed', result['error'])
+        self.assertEqual(list(HabitLog.objects.filter(habit=self.habit).values_list('date', flat=True)),
+                         [date(2026, 2, 1)])
+
+    def test_batch_query_count_is_constant(self):
+        """Test that a month of changes does not cost a query per item."""
+        operations = [
+            {'habit_id': self.habit.id, 'date': (date(2026, 1, 1) + timedelta(days=i)).isoformat()}
+            for i in range(31)
+        ]
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.post('/api/habits/batch/', {'operations': operations}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(HabitLog.objects.count(), 31)
+        self.assertLess(len(ctx.captured_queries), 26)
+
+
+class ImportHistoryTestCase(AuthenticatedAPITestCase):
+    """Test streaming bulk import of history."""
+
+    username = 'importer'
+
+    def test_import_ndjson(self):
+        """Test importing NDJSON, including replacing an existing night."""
+        SleepLog.objects.create(
+            user=self.user,
+            start=datetime(2026, 1, 1, 22, 0, tzinfo=timezone.utc),
+            end=datetime(2026, 1, 2, 6, 0, tzinfo=timezone.utc),
+        )
+        MoodLog.objects.create(user=self.user, date=date(2026, 1, 2), mood=3)
+        records = [
+            {'type': 'habit', 'habit': 'Read', 'archived': False},
+            {'type': 'habit_log', 'habit': 'Read', 'date': '2026-01-01'},
+            {'type': 'habit_log', 'habit': 'Read', 'date': '2026-01-02'},
+            {'type': 'habit_log', 'habit': 'Walk', 'date': '2026-01-02'},
+            {'type': 'sleep', 'start': '2026-01-01T23:00:00Z', 'end': '2026-01-02T07:30:00Z'},
+            {'type': 'sleep', 'start': '2026-01-02T23:00:00Z', 'end': '2026-01-03T07:00:00Z'},
+            {'type': 'mood', 'date': '2026-01-02', 'mood': 8},
+            {'type': 'mood', 'date': '2026-01-03', 'mood': 11},
+        ]
+        body = '\n'.join(json.dumps(record) for record in records) + '\n'
+        response = self.client.post('/api/import/', body, content_type='application/x-ndjson')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['imported'], {'habits': 2, 'habit_logs': 3, 'sleep': 2, 'mood': 1})
+        self.assertEqual(response.data['error_count'], 1)
+
+        self.assertEqual(SleepLog.objects.filter(user=self.user).count(), 2)
+        self.assertEqual(MoodLog.objects.get(user=self.user, date=date(2026, 1, 2)).mood, 8)
+        read = Habit.objects.get(user=self.user, name='Read')
+        self.assertEqual((read.total_completions, read.longest_streak), (2, 2))
+
+    def test_import_replaces_whole_night(self):
+        """Test that a log anywhere in an imported night is replaced, not just overlapping ones."""
+        SleepLog.objects.create(
+            user=self.user,
+            start=datetime(2026, 1, 1, 19, 0, tzinfo=timezone.utc),
+            end=datetime(2026, 1, 1, 20, 30, tzinfo=timezone.utc),
+        )
+        SleepLog.objects.create(
+            user=self.user,
+            start=datetime(2026, 1, 2, 18, 30, tzinfo=timezone.utc),
+            end=datetime(2026, 1, 2, 19, 0, tzinfo=timezone.utc),
+        )
+        import_stream(self.user, ['{"type": "sleep", "start": "2026-01-01T23:00:00Z", "end": "2026-01-02T07:00:00Z"}\n'])
+        self.assertEqual(
+            list(SleepLog.objects.filter(user=self.user).order_by('start').values_list('start', flat=True)),
+            [datetime(2026, 1, 1, 23, 0, tzinfo=timezone.utc), datetime(2026, 1, 2, 18, 30, tzinfo=timezone.utc)],
+        )
+
+    def test_import_csv_command(self):
+        """Test the import management command with a CSV file."""
+        with tempfile.NamedTemporaryFile('w', suffix='.csv', delete=False) as f:
+            f.write('type,habit,date,completed,mood\n')
+            for day in range(1, 11):
+                f.write(f'habit_log,Run,2026-02-{day:02d},true,\n')
+                f.write(f'mood,,2026-02-{day:02d},,{day}\n')
+        try:
+            call_command('import_history', 'importer', f.name, '--batch-size', '4', stdout=StringIO())
+        finally:
+            os.unlink(f.name)
+        self.assertEqual(HabitLog.objects.filter(user=self.user).count(), 10)
+        self.assertEqual(MoodLog.objects.filter(user=self.user).count(), 10)
+
+
+class ExportHistoryTestCase(AuthenticatedAPITestCase):
+    """Test the streaming account export."""
+
+    username = 'exporter'
+
+    def setUp(self):
+        super().setUp()
+        habit = Habit.objects.create(name='Read', user=self.user)
+        for day in range(1, 6):
+            HabitLog.objects.create(habit=habit, date=date(2026, 1, day))
+            MoodLog.objects.create(user=self.user, date=date(2026, 1, day), mood=day)
+        SleepLog.objects.create(
+            user=self.user,
+            start=datetime(2026, 1, 1, 23, 0, tzinfo=timezone.utc),
+            end=datetime(2026, 1, 2, 7, 0, tzinfo=timezone.utc),
+        )
+        other = User.objects.create_user(username='other', password=TEST_PASSWORD)
+        MoodLog.objects.create(user=other, date=date(2026, 1, 1), mood=1)
+
+    def test_export_ndjson_round_trips(self):
+        """Test that an NDJSON export can be imported into another account."""
+        response = self.client.get('/api/export/', {'fmt': 'ndjson'})
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        body = b''.join(response.streaming_content)
+        records = [json.loads(line) for line in body.decode().splitlines()]
+        self.assertEqual([r['type'] for r in records].count('mood'), 5)
+        self.assertEqual(len(records), 1 + 5 + 1 + 5)
+
+        clone = User.objects.create_user(username='clone', password=TEST_PASSWORD)
+        summary = import_stream(clone, body.splitlines(keepends=True))
+        self.assertEqual(summary['error_count'], 0)
+        self.assertEqual(HabitLog.objects.filter(habit__user=clone).count(), 5)
+        self.assertEqual(SleepLog.objects.filter(user=clone).count(), 1)
+
+    def test_export_zipped_csv(self):
+        """Test that the CSV export is a zip with one file per table."""
+        response = self.client.get('/api/export/', {'fmt': 'csv'})
+        self.assertEqual(response.status_code, 200)
+        archive = zipfile.ZipFile(io.BytesIO(b''.join(response.streaming_content)))
+        self.assertEqual(sorted(archive.namelist()), ['habit_logs.csv', 'habits.csv', 'mood.csv', 'sleep.csv'])
+        self.assertEqual(len(archive.read('mood.csv').decode().splitlines()), 6)
+
+    async def test_export_streams_under_asgi(self):
+        """Test that ASGI gets an async stream instead of one Django reads whole first."""
+        headers = {'Authorization': f'Token {self.token.key}'}
+        for fmt in ('ndjson', 'csv'):
+            response = await self.async_client.get('/api/export/', {'fmt': fmt}, headers=headers)
+            self.assertEqual(response.status_code, 200)
+            self.assertTrue(response.is_async, fmt)
+            with warnings.catch_warnings():
+                warnings.simplefilter('error')
+                body = b''.join([chunk async for chunk in response])
+            if fmt == 'ndjson':
+                self.assertEqual(len([json.loads(line) for line in body.decode().splitlines()]), 12)
+
+
+class TrackerPageCacheTestCase(TestCase):
+    """Test the per-user versioned tracker page cache."""
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='cached', password=TEST_PASSWORD)
+        self.habit = Habit.objects.create(name='Exercise', user=self.user)
+        self.client = Client()
+        self.client.login(username='cached', password=TEST_PASSWORD)
+
+    def test_page_cached_until_write(self):
+        """Test that a cached page is reused and dropped after a toggle."""
+        url = '/track/habits/week/'
+        params = {'start_date': '2026-03-02'}
+        # Pages are only cached once the browser holds a CSRF cookie
+        self.client.get('/track/habits/day/')
+        first = self.client.get(url, params)
+        self.assertIsNotNone(first.context)
+
+        with CaptureQueriesContext(connection) as ctx:
+            second = self.client.get(url, params)
+        self.assertIsNone(second.context)
+        self.assertEqual(second.content, first.content)
+        self.assertFalse([q for q in ctx.captured_queries if 'base_habit' in q['sql']])
+
+        csrf = self.client.cookies['csrftoken'].value
+        response = self.client.post(
+            '/api/habits/toggle/',
+            json.dumps({'habit_id': self.habit.id, 'date': '2026-03-03'}),
+            content_type='application/json',
+            HTTP_X_CSRFTOKEN=csrf,
+        )
+        self.assertEqual(response.status_code, 201)
+
+        third = self.client.get(url, params)
+        self.assertIsNotNone(third.context)
+        self.assertIn(f'{self.habit.id}-2026-03-03', third.context['log_dict_json'])
+
+
+class ETagTestCase(AuthenticatedAPITestCase):
+    """Test conditional GET support on API read endpoints."""
+
+    username = 'poller'
+
+    def setUp(self):
+        super().setUp()
+        Habit.objects.create(name='Exercise', user=self.user)
+
+    def test_not_modified_until_write(self):
+        """Test 304 responses skip the query and expire after a write."""
+        first = self.client.get('/api/habits/')
+        etag = first['ETag']
+        self.assertTrue(etag.startswith('"'))
+
+        with CaptureQueriesContext(connection) as ctx:
+            cached = self.client.get('/api/habits/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(cached.status_code, 304)
+        self.assertEqual(cached['ETag'], etag)
+        self.assertFalse([q for q in ctx.captured_queries if 'base_habit' in q['sql']])
+
+        self.client.post('/api/habits/add_habit/', {'name': 'Read'}, format='json')
+        fresh = self.client.get('/api/habits/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(fresh.status_code, 200)
+        self.assertEqual(len(fresh.data), 2)
+        self.assertNotEqual(fresh['ETag'], etag)
+
+    def test_etag_differs_per_user(self):
+        """Test that another user's ETag never matches."""
+        other = User.objects.create_user(username='other', password=TEST_PASSWORD)
+        etag = self.client.get('/api/sleep/')['ETag']
+        self.client.force_authenticate(user=other)
+        response = self.client.get('/api/sleep/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+
+class DeltaSyncTestCase(AuthenticatedAPITestCase):
+    """Test the change log and the delta sync endpoint."""
+
+    username = 'syncer'
+
+    def test_changes_after_token(self):
+        """Test that a sync returns only the changes after the given token."""
+        habit_id = self.client.post('/api/habits/add_habit/', {'name': 'Read'}, format='json').data['id']
+        first = self.client.get('/api/sync/')
+        self.assertEqual(first.status_code, 200)
+        self.assertEqual([(c['kind'], c['action']) for c in first.data['changes']], [('habit', 'create')])
+
+        self.client.post('/api/habits/toggle/', {'habit_id': habit_id, 'date': '2026-03-02'}, format='json')
+        self.client.post('/api/mood/', {'date': '2026-03-02', 'mood': 6}, format='json')
+        self.client.patch(f'/api/habits/update/{habit_id}/', {'name': 'Read more'}, format='json')
+
+        delta = self.client.get(f"/api/sync/?since={first.data['token']}")
+        changes = delta.data['changes']
+        self.assertEqual([(c['kind'], c['action']) for c in changes],
+                         [('habit_log', 'create'), ('mood', 'create'), ('habit', 'update')])
+        self.assertEqual(changes[0]['key'], f'{habit_id}:2026-03-02')
+        self.assertEqual(changes[1]['data']['mood'], 6)
+        self.assertEqual(changes[2]['data']['name'], 'Read more')
+        self.assertFalse(delta.data['has_more'])
+
+        empty = self.client.get(f"/api/sync/?since={delta.data['token']}")
+        self.assertEqual(empty.data['changes'], [])
+        self.assertEqual(empty.data['token'], delta.data['token'])
+
+    def test_compaction_and_full_resync(self):
+        """Test that compaction keeps the newest entry per object and expires old tokens."""
+        habit_id = self.client.post('/api/habits/add_habit/', {'name': 'Read'}, format='json').data['id']
+        for _ in range(3):
+            self.client.post('/api/habits/toggle/', {'habit_id': habit_id, 'date': '2026-03-02'}, format='json')
+        self.assertEqual(compact(retention_days=30), (2, 0))
+        changes = self.client.get('/api/sync/').data['changes']
+        self.assertEqual([(c['kind'], c['action']) for c in changes], [('habit', 'create'), ('habit_log', 'create')])
+
+        token = self.client.get('/api/sync/').data['token']
+        ChangeLogEntry.objects.update(created_at=datetime(2020, 1, 1, tzinfo=timezone.utc))
+        self.client.post('/api/mood/', {'date': '2026-03-02', 'mood': 6}, format='json')
+        self.assertEqual(compact(retention_days=30), (0, 2))
+
+        # The holder of the last trimmed token saw everything and can keep syncing
+        current = self.client.get(f'/api/sync/?since={token}')
+        self.assertEqual(len(current.data['changes']), 1)
+        stale = self.client.get('/api/sync/?since=0')
+        self.assertEqual(stale.status_code, 410)
+        self.assertTrue(stale.data['full_resync'])
+        self.assertEqual(stale.data['token'], current.data['token'])
+
+    def test_tokens_are_per_user_sequence_numbers(self):
+        """Test that tokens count the user's own changes, whatever other users write."""
+        other = User.objects.create_user(username='other', password=TEST_PASSWORD)
+        self.client.post('/api/habits/add_habit/', {'name': 'Read'}, format='json')
+        record_changes(other, [('mood', i, 'delete', None) for i in range(5)])
+        self.client.post('/api/habits/add_habit/', {'name': 'Walk'}, format='json')
+        first = self.client.get('/api/sync/?since=0')
+        self.assertEqual(first.data['token'], 2)
+        self.assertEqual(len(self.client.get('/api/sync/?since=1').data['changes']), 1)
+
+    def test_import_requires_full_resync(self):
+        """Test that a bulk import expires existing sync tokens."""
+        token = self.client.get('/api/sync/').data['token']
+        self.client.post('/api/habits/add_habit/', {'name': 'Read'}, format='json')
+        self.client.generic('POST', '/api/import/',
+                            '{"type": "habit_log", "habit": "Read", "date": "2026-03-02"}\n',
+                            content_type='application/x-ndjson')
+        self.assertEqual(self.client.get(f'/api/sync/?since={token}').status_code, 410)
+
+    def test_import_expires_current_token(self):
+        """Test that a bulk import also expires a token that had seen every change."""
+        self.client.post('/api/habits/add_habit/', {'name': 'Read'}, format='json')
+        token = self.client.get('/api/sync/').data['token']
+        self.client.generic('POST', '/api/import/',
+                            '{"type": "habit_log", "habit": "Read", "date": "2026-03-02"}\n',
+                            content_type='application/x-ndjson')
+        stale = self.client.get(f'/api/sync/?since={token}')
+        self.assertEqual(stale.status_code, 410)
+        self.assertEqual(self.client.get(f"/api/sync/?since={stale.data['token']}").status_code, 200)
+
+
+class AsyncViewTestCase(TestCase):
+    """Test the async tracker and API views through the ASGI request handler."""
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='asyncuser', password=TEST_PASSWORD)
+        self.token = Token.objects.create(user=self.user)
+        self.habit = Habit.objects.create(name='Exercise', user=self.user)
+        HabitLog.objects.create(habit=self.habit, date=date(2026, 3, 3), completed=True)
+
+    async def test_tracker_pages(self):
+        """Test that every tracker page renders from the async views."""
+        await self.async_client.aforce_login(self.user)
+        for section in ('habits', 'sleep', 'mood'):
+            for period in ('day', 'week', 'month'):
+                response = await self.async_client.get(f'/track/{section}/{period}/')
+                self.assertEqual(response.status_code, 200, f'{section}/{period}')
+        response = await self.async_client.get('/track/habits/week/?start_date=2026-03-02')
+        self.assertIn(f'{self.habit.id}-2026-03-03', response.context['log_dict_json'])
+
+    async def test_api_reads(self):
+        """Test the async API reads, including the conditional GET."""
+        headers = {'Authorization': f'Token {self.token.key}'}
+        habits = await self.async_client.get('/api/habits/', headers=headers)
+        self.assertEqual(habits.status_code, 200)
+        self.assertEqual(habits.json()[0]['name'], 'Exercise')
+        cached = await self.async_client.get('/api/habits/', headers={**headers, 'If-None-Match': habits['ETag']})
+        self.assertEqual(cached.status_code, 304)
+
+        sleep = await self.async_client.get('/api/sleep/?limit=5', headers=headers)
+        self.assertEqual(sleep.json(), {'next': None, 'results': []})
+        self.assertEqual((await self.async_client.get('/api/sleep/')).status_code, 401)
+
+
+class CachedTokenAuthTestCase(AuthenticatedAPITestCase):
+    """Test the cached token authentication class."""
+
+    username = 'mobile'
+
+    def setUp(self):
+        token_cache.clear()
+        self.cache = token_cache
+        # Off by default without a shared cache; the tests run in one process
+        self.addCleanup(setattr, token_cache, 'ttl', token_cache.ttl)
+        token_cache.ttl = 60
+        super().setUp()
+
+    def test_cached_requests_skip_token_query(self):
+        """Test that repeat requests authenticate without the token query."""
+        self.client.get('/api/auth/verify/')
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get('/api/auth/verify/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['username'], 'mobile')
+        self.assertFalse([q for q in ctx.captured_queries if 'authtoken_token' in q['sql']])
+        self.assertEqual((self.cache.hits, self.cache.misses), (1, 1))
+
+    def test_logout_invalidates(self):
+        """Test that a logged out token stops working at once."""
+        self.client.get('/api/auth/verify/')
+        self.assertEqual(self.client.post('/api/auth/logout/').status_code, 200)
+        self.assertEqual(self.client.get('/api/auth/verify/').status_code, 401)
+
+    def test_logout_invalidates_other_workers(self):
+        """Test that a token logged out elsewhere is rejected despite a local cache entry."""
+        self.client.get('/api/auth/verify/')
+        entry = self.cache.get(self.token.key)
+        self.assertEqual(self.client.post('/api/auth/logout/').status_code, 200)
+        # Another worker never saw the logout and still holds the entry
+        self.cache.set(self.token.key, entry)
+        self.assertEqual(self.client.get('/api/auth/verify/').status_code, 401)
+
+    def test_last_login_keeps_entries(self):
+        """Test that login bookkeeping does not invalidate cached tokens."""
+        self.client.get('/api/auth/verify/')
+        update_last_login(None, self.user)
+        self.client.get('/api/auth/verify/')
+        self.assertEqual(self.cache.hits, 1)
+
+    def test_user_changes_invalidate(self):
+        """Test that deactivating or renaming a user is seen by the next request."""
+        self.client.get('/api/auth/verify/')
+        self.user.username = 'renamed'
+        self.user.save()
+        self.assertEqual(self.client.get('/api/auth/verify/').data['username'], 'renamed')
+        self.user.is_active = False
+        self.user.save()
+        self.assertEqual(self.client.get('/api/auth/verify/').status_code, 401)
+
+    def test_stats_are_staff_only(self):
+        """Test the cache statistics endpoint."""
+        self.assertEqual(self.client.get('/api/auth/token-cache/').status_code, 403)
+        self.user.is_staff = True
+        self.user.save()
+        response = self.client.get('/api/auth/token-cache/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['size'], 1)
+        self.assertIn('hit_rate', response.data)
+
+    def test_ttl_cache_bounds(self):
+        """Test LRU eviction and expiry of the underlying cache."""
+        bounded = TTLCache(max_size=2, ttl=60)
+        bounded.set('a', 1)
+        bounded.set('b', 2)
+        bounded.get('a')
+        bounded.set('c', 3)
+        self.assertIsNone(bounded.get('b'))
+        self.assertEqual(bounded.get('a'), 1)
+        self.assertEqual(bounded.evictions, 1)
+        expired = TTLCache(max_size=2, ttl=-1)
+        expired.set('a', 1)
+        self.assertIsNone(expired.get('a'))
+
+
+@override_settings(TRACKER_PAGE_CACHE_TIMEOUT=0)
+class SessionModeTestCase(TestCase):
+    """Test that cached sessions and the cached user loader take queries off page views."""
+
+    def setUp(self):
+        user_cache.clear()
+        self.user_cache = user_cache
+        # Off by default without a shared cache; the tests run in one process
+        self.addCleanup(setattr, user_cache, 'ttl', user_cache.ttl)
+        user_cache.ttl = 60
+        self.user = User.objects.create_user(username='browser', password=TEST_PASSWORD)
+
+    def page_queries(self):
+        """Log in, warm up, then return the SQL of one tracker page view."""
+        self.client = self.client_class()
+        self.client.login(username='browser', password=TEST_PASSWORD)
+        self.client.get('/track/mood/day/')
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get('/track/mood/day/')
+        self.assertEqual(response.status_code, 200)
+        return [q['sql'] for q in ctx.captured_queries]
+
+    def test_db_sessions_without_user_cache(self):
+        """Test the baseline: a session read and a user fetch on every page."""
+        with override_settings(SESSION_ENGINE='django.contrib.sessions.backends.db'):
+            self.user_cache.ttl = 0
+            try:
+                queries = self.page_queries()
+            finally:
+                self.user_cache.ttl = 60
+        self.assertTrue([q for q in queries if 'django_session' in q])
+        self.assertTrue([q for q in queries if 'auth_user' in q])
+
+    def test_cached_modes_skip_session_and_user_queries(self):
+        """Test that cached_db and signed_cookies sessions need neither query."""
+        for engine in ('cached_db', 'signed_cookies'):
+            with self.subTest(engine=engine), \
+                    override_settings(SESSION_ENGINE=f'django.contrib.sessions.backends.{engine}'):
+                queries = self.page_queries()
+                self.assertFalse([q for q in queries if 'django_session' in q or 'auth_user' in q])
+
+    def test_password_change_logs_out_sessions(self):
+        """Test that a cached user does not keep an old session alive after a password change."""
+        self.client.login(username='browser', password=TEST_PASSWORD)
+        self.assertEqual(self.client.get('/track/mood/day/').status_code, 200)
+        self.user.set_password('another-' + TEST_PASSWORD)
+        self.user.save()
+        self.assertEqual(self.client.get('/track/mood/day/').status_code, 302)
+
+    def test_deactivation_seen_by_other_workers(self):
+        """Test that a user cached before a change made elsewhere is not trusted."""
+        self.client.login(username='browser', password=TEST_PASSWORD)
+        self.assertEqual(self.client.get('/track/mood/day/').status_code, 200)
+        entry = self.user_cache.get(self.user.pk)
+        self.user.is_active = False
+        self.user.save()
+        # Another worker never saw the save and still holds the old user
+        self.user_cache.set(self.user.pk, entry)
+        self.assertEqual(self.client.get('/track/mood/day/').status_code, 302)
+
+
+class SleepStatsTestCase(AuthenticatedAPITestCase):
+    """Test the server-side sleep statistics endpoint."""
+
+    username = 'stats'
+
+    def setUp(self):
+        cache.clear()
+        super().setUp()
+        # Weekday nights waking Tue and Wed, weekend night waking Sat
+        for start, end in [
+            (datetime(2026, 3, 2, 23, 30), datetime(2026, 3, 3, 7, 0)),
+            (datetime(2026, 3, 4, 0, 30), datetime(2026, 3, 4, 7, 30)),
+            (datetime(2026, 3, 7, 1, 0), datetime(2026, 3, 7, 10, 0)),
+        ]:
+            SleepLog.objects.create(user=self.user, start=make_aware(start), end=make_aware(end))
+        self.params = {'from': '2026-03-03', 'to': '2026-03-08'}
+
+    def test_statistics(self):
+        """Test averages, consistency, sleep debt and the weekday/weekend split."""
+        response = self.client.get('/api/sleep/stats/', self.params)
+        self.assertEqual(response.status_code, 200)
+        stats = response.data
+        self.assertEqual(stats['nights'], 3)
+        self.assertEqual(stats['duration']['mean_hours'], 7.83)
+        self.assertEqual(stats['sleep_debt_hours'], 1.5)
+        weekday = stats['weekday']
+        self.assertEqual(weekday['nights'], 2)
+        # Bedtimes either side of midnight average to midnight
+        self.assertEqual(weekday['bedtime']['mean'], '00:00')
+        self.assertEqual(weekday['bedtime']['std_minutes'], 30.0)
+        self.assertEqual(weekday['wake_time']['mean'], '07:15')
+        self.assertEqual(weekday['wake_time']['variance_minutes'], 225.0)
+        self.assertEqual(stats['weekend']['nights'], 1)
+        self.assertEqual(stats['weekend']['bedtime']['mean'], '01:00')
+        self.assertEqual(stats['weekend']['sleep_debt_hours'], 0.0)
+
+    def test_cached_until_write(self):
+        """Test that repeat requests skip the sleep query until a log is added."""
+        self.client.get('/api/sleep/stats/', self.params)
+        with CaptureQueriesContext(connection) as ctx:
+            cached = self.client.get('/api/sleep/stats/', self.params)
+        self.assertEqual(cached.data['nights'], 3)
+        self.assertFalse([q for q in ctx.captured_queries if 'base_sleeplog' in q['sql']])
+
+        self.client.post('/api/sleep/', {'start': '2026-03-05T00:00:00', 'end': '2026-03-05T08:00:00'}, format='json')
+        response = self.client.get('/api/sleep/stats/', self.params)
+        self.assertEqual(response.data['nights'], 4)
+
+    def test_invalid_range(self):
+        """Test that malformed and reversed ranges are rejected."""
+        self.assertEqual(self.client.get('/api/sleep/stats/', {'from': 'March'}).status_code, 400)
+        response = self.client.get('/api/sleep/stats/', {'from': '2026-03-08', 'to': '2026-03-03'})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.client.get('/api/sleep/stats/', {'from': '2020-01-01', 'to': '2026-03-03'}).status_code, 400)
+
+
+class YearHeatmapTestCase(AuthenticatedAPITestCase):
+    """Test the year-at-a-glance heatmap endpoint."""
+
+    username = 'heat'
+
+    def setUp(self):
+        super().setUp()
+        first = Habit.objects.create(name='Read', user=self.user)
+        second = Habit.objects.create(name='Run', user=self.user)
+        HabitLog.objects.create(habit=first, date=date(2026, 1, 1))
+        HabitLog.objects.create(habit=second, date=date(2026, 1, 1))
+        HabitLog.objects.create(habit=first, date=date(2026, 1, 3))
+        HabitLog.objects.create(habit=first, date=date(2025, 12, 31))
+        MoodLog.objects.create(user=self.user, date=date(2026, 1, 2), mood=10)
+        MoodLog.objects.create(user=self.user, date=date(2026, 12, 31), mood=0)
+
+    def test_year_encoding(self):
+        """Test per-day arrays and palettes for both sections."""
+        response = self.client.get('/api/heatmap/', {'year': 2026})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual((response.data['start'], response.data['days']), ('2026-01-01', 365))
+        mood = response.data['mood']
+        self.assertEqual(len(mood['values']), 365)
+        self.assertEqual(mood['values'][:3], [-1, 10, -1])
+        self.assertEqual(mood['values'][-1], 0)
+        self.assertEqual(mood['palette'][10], mood_to_color(10))
+        habits = response.data['habits']
+        self.assertEqual(habits['values'][:4], [2, 0, 1, 0])
+        self.assertEqual(habits['levels'][:4], [4, 0, 2, 0])
+        self.assertEqual(sum(habits['values']), 3)
+
+    def test_one_query_per_section(self):
+        """Test that each section is read with a single query."""
+        for section, table in [('mood', 'base_moodlog'), ('habits', 'base_habitlog')]:
+            with CaptureQueriesContext(connection) as ctx:
+                response = self.client.get('/api/heatmap/', {'year': 2026, 'section': section})
+            self.assertNotIn('mood' if section == 'habits' else 'habits', response.data)
+            self.assertEqual(len([q for q in ctx.captured_queries if table in q['sql']]), 1)
+
+    def test_invalid_parameters(self):
+        """Test that unknown sections and years are rejected."""
+        self.assertEqual(self.client.get('/api/heatmap/', {'section': 'sleep'}).status_code, 400)
+        self.assertEqual(self.client.get('/api/heatmap/', {'year': 'soon'}).status_code, 400)
+        self.assertEqual(self.client.get('/api/heatmap/', {'year': 0}).status_code, 400)
+
+
+class BenchmarkCommandTestCase(TestCase):
+    """Test the seeded benchmark management command."""
+
+    def test_report(self):
+        """Test that every page and endpoint is measured and benchmark users are removed."""
+        bench_press = User.objects.create_user(username='bench-press', password=TEST_PASSWORD)
+        output = StringIO()
+        call_command('benchmark', users=1, habits=2, years=0.1, iterations=1, force=True, stdout=output)
+        report = json.loads(output.getvalue())
+        self.assertGreater(report['dataset']['habit_logs'], 0)
+        endpoints = report['endpoints']
+        self.assertIn('/track/sleep/month/', endpoints)
+        self.assertIn('GET /api/heatmap/', endpoints)
+        self.assertIn('POST /api/import/', endpoints)
+        self.assertIn('DELETE /api/habits/delete/', endpoints)
+        for name, stats in endpoints.items():
+            self.assertTrue(all(code.startswith('2') for code in stats['status']), name)
+            self.assertLessEqual(stats['p50_ms'], stats['p99_ms'])
+        for name, variants in report['plans'].items():
+            self.assertEqual(variants['after']['indexes'], ['base_habitlog_completed_idx'], name)
+            self.assertEqual(variants['after']['full_scans'], [], name)
+        self.assertEqual(list(User.objects.filter(username__startswith='bench-')), [bench_press])
+
+    def test_refuses_without_debug(self):
+        """Test that the command will not write benchmark users with DEBUG off unless forced."""
+        with self.assertRaisesMessage(CommandError, '--force'):
+            call_command('benchmark', users=1, habits=1, years=0.1, iterations=1)
+        self.assertFalse(User.objects.filter(username__startswith='bench-').exists())
+
+
+class ServerTimingTestCase(TestCase):
+    """Test the Server-Timing instrumentation middleware."""
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='timed', password=TEST_PASSWORD)
+        Habit.objects.create(name='Exercise', user=self.user)
+
+    def metrics(self, response):
+        header = response.headers['Server-Timing']
+        return {part.split(';')[0].strip(): part for part in header.split(',')}
+
+    @override_settings(SERVER_TIMING_ENABLED=True, TRACKER_PAGE_CACHE_TIMEOUT=0)
+    def test_tracker_page_timings(self):
+        """Test that async tracker pages report queries, view and template time."""
+        client = Client()
+        client.login(username='timed', password=TEST_PASSWORD)
+        with self.assertLogs('base.server_timing', level='INFO') as logs:
+            response = client.get('/track/habits/week/')
+        metrics = self.metrics(response)
+        self.assertEqual(set(metrics), {'db', 'tpl', 'view', 'total'})
+        record = json.loads(logs.records[-1].getMessage())
+        self.assertEqual((record['path'], record['status']), ('/track/habits/week/', 200))
+        self.assertGreater(record['queries'], 0)
+        self.assertIn(f'desc="{record["queries"]} queries"', metrics['db'])
+        self.assertGreater(record['tpl_ms'], 0)
+
+    @override_settings(SERVER_TIMING_ENABLED=True)
+    def test_api_timings(self):
+        """Test that API responses count their queries."""
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f'Token {Token.objects.create(user=self.user).key}')
+        with self.assertLogs('base.server_timing', level='INFO'):
+            response = client.get('/api/habits/')
+        self.assertRegex(self.metrics(response)['db'], r'desc="[1-9]\d* queries"')
+
+    def test_disabled_by_default(self):
+        """Test that no header is sent unless enabled."""
+        client = Client()
+        client.login(username='timed', password=TEST_PASSWORD)
+        self.assertNotIn('Server-Timing', client.get('/track/habits/week/').headers)
+
+
+class MetricsTestCase(AuthenticatedAPITestCase):
+    """Test the Prometheus metrics middleware and endpoint."""
+
+    username = 'scraped'
+
+    @override_settings(METRICS_ENABLED=True, DEBUG=True)
+    def test_request_metrics(self):
+        """Test that requests are counted and timed per URL name."""
+        labels = {'view': 'get_data', 'method': 'GET', 'status': '200'}
+        before = REGISTRY.get_sample_value('habits_http_requests_total', labels) or 0
+        self.client.get('/api/habits/')
+        self.assertEqual(REGISTRY.get_sample_value('habits_http_requests_total', labels), before + 1)
+
+        response = Client().get('/metrics')
+        self.assertEqual(response.status_code, 200)
+        body = response.content.decode()
+        self.assertIn('habits_http_request_duration_seconds_bucket{le="0.005",method="GET",view="get_data"}', body)
+        self.assertIn('habits_db_queries_per_request_count{view="get_data"}', body)
+        self.assertIn('habits_cache_hits{cache="token"}', body)
+
+    @override_settings(METRICS_ENABLED=True, METRICS_TOKEN=METRICS_TOKEN)
+    def test_token_required(self):
+        """Test that a configured token must be sent as a bearer token."""
+        self.assertEqual(Client().get('/metrics').status_code, 403)
+        response = Client().get('/metrics', HTTP_AUTHORIZATION=f'Bearer {METRICS_TOKEN}')
+        self.assertEqual(response.status_code, 200)
+
+    @override_settings(METRICS_ENABLED=True, METRICS_TOKEN='')  # nosec B106
+    def test_token_required_without_debug(self):
+        """Test that metrics refuse to run unprotected with DEBUG off."""
+        with self.assertRaisesMessage(ImproperlyConfigured, 'METRICS_TOKEN'):
+            Client().get('/metrics')
+
+    def test_disabled_by_default(self):
+        """Test that /metrics is hidden unless enabled."""
+        self.assertEqual(Client().get('/metrics').status_code, 404)
+
+
+class ProfilingTestCase(TestCase):
+    """Test opt-in request profiling and the admin profile pages."""
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        self.staff = User.objects.create_user(username='staff', password=TEST_PASSWORD, is_staff=True)
+        User.objects.create_user(username='member', password=TEST_PASSWORD)
+        Habit.objects.create(name='Exercise', user=self.staff)
+        self.settings_override = override_settings(
+            PROFILING_ENABLED=True, PROFILE_DIR=self.directory.name, PROFILE_RING_SIZE=2,
+            PROFILE_INTERVAL=0.0005, TRACKER_PAGE_CACHE_TIMEOUT=0,
+        )
+        self.settings_override.enable()
+        self.addCleanup(self.settings_override.disable)
+
+    def client_for(self, username):
+        client = Client()
+        client.login(username=username, password=TEST_PASSWORD)
+        return client
+
+    def test_staff_profile_saved(self):
+        """Test that a staff request with the header is profiled and stored."""
+        response = self.client_for('staff').get('/track/habits/month/', HTTP_X_PROFILE='1')
+        self.assertEqual(response.status_code, 200)
+        name = response.headers['X-Profile-Id']
+        with open(os.path.join(self.directory.name, name)) as stream:
+            profile = json.load(stream)
+        self.assertEqual((profile['path'], profile['user'], profile['status']), ('/track/habits/month/', 'staff', 200))
+        self.assertGreater(profile['queries'], 0)
+        self.assertIn('tpl_ms', profile)
+        self.assertIsInstance(profile['hottest'], list)
+
+    def test_only_staff_and_opt_in(self):
+        """Test that plain requests and non-staff users are never profiled."""
+        self.assertNotIn('X-Profile-Id', self.client_for('staff').get('/track/habits/week/').headers)
+        response = self.client_for('member').get('/track/habits/week/', {'profile': '1'})
+        self.assertNotIn('X-Profile-Id', response.headers)
+
+    def test_ring_and_admin_pages(self):
+        """Test that only the newest profiles are kept, listed and downloadable by staff."""
+        client = self.client_for('staff')
+        names = [client.get('/track/habits/day/', {'profile': '1'}).headers['X-Profile-Id'] for _ in range(3)]
+        listing = client.get('/admin/profiles/')
+        self.assertEqual(listing.status_code, 200)
+        self.assertEqual([p['name'] for p in listing.context['profiles']], names[:0:-1])
+        download = client.get(f'/admin/profiles/{names[-1]}/')
+        self.assertEqual(download.status_code, 200)
+        self.assertEqual(client.get(f'/admin/profiles/{names[0]}/').status_code, 404)
+        self.assertEqual(client.get('/admin/profiles/..%2Fsettings.json/').status_code, 404)
+        self.assertEqual(self.client_for('member').get('/admin/profiles/').status_code, 302)
+
+    def test_overlapping_samplers_restore_switch_interval(self):
+        """Test that the switch interval comes back only when the last sampler stops."""
+        original = sys.getswitchinterval()
+        first, second = StackSampler(0.001), StackSampler(0.001)
+        first.start()
+        second.start()
+        first.stop()
+        self.assertLess(sys.getswitchinterval(), original)
+        second.stop()
+        self.assertEqual(sys.getswitchinterval(), original)
+
+
+class SlowQueryLogTestCase(TestCase):
+    """Test the slow-query log execute wrapper."""
+
+    def setUp(self):
+        recently_logged.clear()
+        self.user = User.objects.create_user(username='slow', password=TEST_PASSWORD)
+
+    def install(self):
+        """Install the wrapper once the test's settings are in effect."""
+        install_wrapper(connection)
+        self.addCleanup(connection.execute_wrappers.remove, log_slow_queries)
+
+    def slow_records(self, logs, table):
+        records = [json.loads(record.getMessage()) for record in logs.records]
+        return [record for record in records if f'"{table}"' in record['sql']]
+
+    @override_settings(SLOW_QUERY_THRESHOLD_MS=0.001, SLOW_QUERY_SAMPLE_RATE=1.0)
+    def test_logs_plan_and_call_site(self):
+        """Test that slow SELECTs are logged normalized, with call site, plan and indexes."""
+        self.install()
+        with self.assertLogs('base.slow_queries', level='WARNING') as logs:
+            build_sleep_timeline(self.user, date(2026, 3, 1), 7)
+        record, = self.slow_records(logs, 'base_sleeplog')
+        self.assertIn('"user_id" = ?', record['sql'])
+        # Parameter types as the backend receives them, never their values
+        self.assertEqual(len(record['params']), 3)
+        self.assertRegex(record['call_site'], r'^base/sleep_timeline\.py:\d+ in ')
+        self.assertTrue(record['plan'])
+        self.assertTrue(record['indexes'])
+        self.assertEqual(record['full_scans'], [])
+
+    @override_settings(SLOW_QUERY_THRESHOLD_MS=0.001, SLOW_QUERY_SAMPLE_RATE=1.0)
+    def test_each_statement_logged_once(self):
+        """Test that repeats of a statement are not logged again within the cooldown."""
+        self.install()
+        with self.assertLogs('base.slow_queries', level='WARNING') as logs:
+            list(MoodLog.objects.filter(user=self.user, mood=3))
+            list(MoodLog.objects.filter(user=self.user, mood=9))
+        self.assertEqual(len(self.slow_records(logs, 'base_moodlog')), 1)
+
+    @override_settings(SLOW_QUERY_THRESHOLD_MS=0.001, SLOW_QUERY_SAMPLE_RATE=1.0)
+    def test_records_view(self):
+        """Test that queries are tagged with the view handling the request."""
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f'Token {Token.objects.create(user=self.user).key}')
+        self.install()
+        with self.assertLogs('base.slow_queries', level='WARNING') as logs:
+            client.get('/api/heatmap/')
+        records = self.slow_records(logs, 'base_moodlog')
+        self.assertTrue(records)
+        self.assertEqual(records[0]['view'], 'api.views.year_heatmap')
+
+    @override_settings(SLOW_QUERY_THRESHOLD_MS=10000)
+    def test_fast_queries_not_logged(self):
+        """Test that statements under the threshold are not logged."""
+        self.install()
+        with self.assertNoLogs('base.slow_queries', level='WARNING'):
+            list(MoodLog.objects.filter(user=self.user))
+
+    @override_settings(SLOW_QUERY_THRESHOLD_MS=0)
+    def test_zero_threshold_disables(self):
+        """Test that a threshold of 0 logs nothing even where the wrapper is installed."""
+        self.install()
+        with self.assertNoLogs('base.slow_queries', level='WARNING'):
+            list(MoodLog.objects.filter(user=self.user))
+
+    def test_normalize_sql(self):
+        """Test that literals and value lists are normalized."""
+        self.assertEqual(
+            normalize_sql("SELECT * FROM t WHERE a = 'x''y' AND b IN (%s, %s, %s)\n LIMIT 21"),
+            'SELECT * FROM t WHERE a = ? AND b IN (...) LIMIT ?',
+        )
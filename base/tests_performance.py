@@ -0,0 +1,135 @@
+"""
+Query budgets for every tracker page and API endpoint.
+
+Each page and endpoint is requested by a light user (one habit, a few days of
+history) and by a heavy user (many habits, two years of seeded history) while
+other users' data sits in the same tables. Reads must stay within their budget
+and issue exactly as many queries for both users, and every period of a
+section must cost the same, so a change that reintroduces per-day, per-habit
+or unscoped queries fails here.
+"""
+
+from datetime import date, timedelta
+
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import connection
+from django.test import Client, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from api.authentication import token_cache
+from base.auth_backends import user_cache
+from base.benchmark import seed_dataset
+from base.models import Habit, HabitLog, MoodLog
+
+# Queries per tracker page with cold session, user and page caches
+PAGE_BUDGETS = {'habits': 4, 'sleep': 3, 'mood': 3}
+
+# Queries per API read with a cold token cache
+API_BUDGETS = {
+    '/api/auth/verify/': 1,
+    '/api/habits/': 3,
+    '/api/sleep/': 3,
+    '/api/sleep/stats/': 4,
+    '/api/summary/': 3,
+    '/api/heatmap/': 4,
+    '/api/sync/': 3,
+    '/api/export/': 6,
+}
+
+# Writes also maintain streaks, rollups, the change log and the data version
+WRITE_BUDGETS = {
+    '/api/habits/toggle/': 20,
+    '/api/habits/batch/': 19,
+    '/api/mood/': 16,
+    '/api/sleep/': 13,
+}
+
+
+@override_settings(TRACKER_PAGE_CACHE_TIMEOUT=0)
+class QueryBudgetTestCase(TestCase):
+    """Test that no page or endpoint issues more queries as data grows."""
+
+    @classmethod
+    def setUpTestData(cls):
+        # The first seeded user is measured, the others only add rows to scan past
+        users, _ = seed_dataset(num_users=3, num_habits=8, years=2, seed=21)
+        cls.heavy = users[0]
+        cls.light = User.objects.create_user(username='light')
+        habit = Habit.objects.create(name='Read', user=cls.light)
+        HabitLog.objects.create(habit=habit, date=date.today())
+        MoodLog.objects.create(user=cls.light, date=date.today(), mood=7)
+        Token.objects.create(user=cls.light)
+
+    def setUp(self):
+        cache.clear()
+
+    def count_queries(self, client, method, path, data=None):
+        """Request `path` with cold in-process caches and return the query count."""
+        token_cache.clear()
+        user_cache.clear()
+        with CaptureQueriesContext(connection) as ctx:
+            if method == 'get':
+                response = client.get(path, data)
+            else:
+                response = client.post(path, data, format='json')
+            if response.streaming:
+                b''.join(response.streaming_content)
+        self.assertLess(response.status_code, 300, path)
+        return len(ctx.captured_queries)
+
+    def browser(self, user):
+        client = Client()
+        client.force_login(user)
+        return client
+
+    def api(self, user):
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f'Token {Token.objects.get(user=user).key}')
+        return client
+
+    def test_tracker_pages(self):
+        """Test every tracker page against its budget, for any data size and period."""
+        today = date.today()
+        params = {'start_date': today.isoformat(), 'week': today.isoformat(), 'month': today.strftime('%Y-%m')}
+        for section, budget in PAGE_BUDGETS.items():
+            counts = {}
+            for period in ('day', 'week', 'month'):
+                path = f'/track/{section}/{period}/'
+                light = self.count_queries(self.browser(self.light), 'get', path, params)
+                heavy = self.count_queries(self.browser(self.heavy), 'get', path, params)
+                self.assertEqual(light, heavy, f'{path} grows with the amount of data')
+                self.assertLessEqual(heavy, budget, path)
+                counts[period] = heavy
+            self.assertEqual(len(set(counts.values())), 1, f'{section} pages grow with the days shown: {counts}')
+
+    def test_api_reads(self):
+        """Test every API read against its budget, for any data size."""
+        today = date.today()
+        params = {
+            '/api/sleep/': {'from': (today - timedelta(days=365)).isoformat(), 'to': today.isoformat()},
+            '/api/sleep/stats/': {'from': (today - timedelta(days=365)).isoformat(), 'to': today.isoformat()},
+            '/api/summary/': {'period': 'day'},
+            '/api/sync/': {'since': 0},
+        }
+        for path, budget in API_BUDGETS.items():
+            light = self.count_queries(self.api(self.light), 'get', path, params.get(path))
+            heavy = self.count_queries(self.api(self.heavy), 'get', path, params.get(path))
+            self.assertEqual(light, heavy, f'{path} grows with the amount of data')
+            self.assertLessEqual(heavy, budget, path)
+
+    def test_api_writes(self):
+        """Test the write endpoints against their budgets."""
+        day = (date.today() - timedelta(days=400)).isoformat()
+        habit_id = Habit.objects.filter(user=self.heavy).values_list('id', flat=True).first()
+        requests = [
+            ('/api/habits/toggle/', {'habit_id': habit_id, 'date': day}),
+            ('/api/habits/batch/', {'operations': [{'habit_id': habit_id, 'date': day, 'completed': True}]}),
+            ('/api/mood/', {'date': day, 'mood': 5}),
+            ('/api/sleep/', {'start': f'{day}T23:00:00', 'end': f'{day}T23:30:00'}),
+        ]
+        for path, data in requests:
+            count = self.count_queries(self.api(self.heavy), 'post', path, data)
+            self.assertLessEqual(count, WRITE_BUDGETS[path], path)
@@ -1,12 +1,19 @@
-from datetime import date, timedelta, datetime, time
+from datetime import date, timedelta, datetime
 import json
 import calendar
+from asgiref.sync import sync_to_async
 from django.shortcuts import render, redirect
 from django.contrib.auth.decorators import login_required
-from django.utils.timezone import make_aware
-from base.models import SleepLog, Habit, HabitLog, MoodLog
+from base.models import Habit, MoodLog
+from .habit_matrix import abuild_completion_matrix, matrix_log_dict
+from .page_cache import cache_page, get_cached_page, tracker_cache_key
+from .sleep_timeline import abuild_sleep_timeline, HOUR_LABELS
 from .utils import get_background, return_motto
 
+# Tracker views are async and load their data with the async ORM. Templates
+# read request.user and the session lazily, so rendering stays in a thread.
+arender = sync_to_async(render)
+
 def homepage(request):
     """
     Public homepage - shows welcome message with login/register options.
@@ -40,13 +47,12 @@ def edit_habits(request):
 # Habits tracking views
 
 @login_required
-def track_habits(request, view_mode='week'):
+async def track_habits(request, view_mode='week'):
     """
     Track habits for authenticated user only.
     Shows habits in day/week/month views.
     """
     background_image, button_gradient = get_background()
-    habits = Habit.objects.filter(user=request.user, archived=False)
 
     # Get start date from GET params or use today
     start_date_str = request.GET.get('start_date')
@@ -82,8 +88,8 @@ def track_habits(request, view_mode='week'):
         prev_start = start_of_week - timedelta(days=7)
         next_start = start_of_week + timedelta(days=7)
 
-    habit_logs = HabitLog.objects.filter(date__in=days, completed=True)
-    log_dict = {f"{log.habit.id}-{log.date.isoformat()}": log.completed for log in habit_logs}
+    habits, grid = await abuild_completion_matrix(await request.auser(), days)
+    log_dict = matrix_log_dict(grid, days)
 
     context = {
         'habits': habits,
@@ -100,53 +106,20 @@ def track_habits(request, view_mode='week'):
         'active_period': view_mode,
     }
 
-    return render(request, template_name, context)
+    return await arender(request, template_name, context)
 
 # Sleep tracking views
 
-def process_day(day: datetime, user):
+async def process_day(day: datetime, user):
     """
     Process sleep data for a specific day and user.
     Calculate the night period (18:00 current day to 18:00 next day).
     """
-    # Calculate the period (18:00 current day to 18:00 next day) - 24 hours
-    night_start = make_aware(datetime.combine(day, time(18, 0)))
-    night_end = night_start + timedelta(hours=24)
-
-    logs = SleepLog.objects.filter(
-        user=user,
-        start__lt=night_end,
-        end__gt=night_start
-    ).order_by('-end')
-    log = logs.first()  # Use only the newest log
-
-    total_sleep = timedelta(0)
-    if log:
-        overlap_start = max(log.start, night_start)
-        overlap_end = min(log.end, night_end)
-        total_sleep += max(overlap_end - overlap_start, timedelta(0))
-
-    hours = total_sleep.seconds // 3600
-    minutes = (total_sleep.seconds % 3600) // 60
-    sleep_time_str = f"{hours}h {minutes}min" if total_sleep else "–"
-
-    # Split into 24 hourly blocks and mark if slept
-    blocks = []
-    current = night_start
-    for _ in range(24):
-        block_end = current + timedelta(hours=1)
-        slept = log and log.start < block_end and log.end > current
-        blocks.append({
-            "label": current.strftime("%H:%M"),
-            "slept": slept
-        })
-        current = block_end
-
-    hour_labels = [(night_start + timedelta(hours=i)).strftime("%H:%M") for i in range(25)]
-    return blocks, sleep_time_str, hour_labels
+    night = (await abuild_sleep_timeline(user, day, 1))[0]
+    return night['blocks'], night['sleep_time'], HOUR_LABELS
 
 @login_required
-def sleep_tracker(request):
+async def sleep_tracker(request):
     """
     Track sleep for authenticated user only - day view.
     Shows the night starting at 18:00 the day before and labeled as the wake-up day.
@@ -163,7 +136,7 @@ def sleep_tracker(request):
     # The night period calculation: 18:00 on (display_date - 1) to 18:00 on display_date
     # This represents the night before waking up on display_date
     base_date = display_date - timedelta(days=1)
-    blocks, sleep_time_str, hour_labels = process_day(base_date, request.user)
+    blocks, sleep_time_str, hour_labels = await process_day(base_date, await request.auser())
 
     context = {
         'background_image': background_image,
@@ -180,10 +153,10 @@ def sleep_tracker(request):
         'active_period': 'day',
     }
 
-    return render(request, 'sleep_day.html', context)
+    return await arender(request, 'sleep_day.html', context)
 
 @login_required
-def sleep_tracker_week(request):
+async def sleep_tracker_week(request):
     """
     Track sleep for authenticated user only - week view.
     Shows nights labeled by wake-up date.
@@ -199,19 +172,15 @@ def sleep_tracker_week(request):
 
     week_start = base_date - timedelta(days=base_date.weekday())
     week_days = [week_start + timedelta(days=i) for i in range(7)]
-    week_blocks = []
-    sleep_times = []
 
-    # Aggregate sleep data for each day in the week
-    # Process the night before each display day (labeled by wake-up date)
-    for day in week_days:
-        night_date = day - timedelta(days=1)
-        blocks, sleep_time, _ = process_day(night_date, request.user)
-        week_blocks.append(blocks)
-        sleep_times.append(sleep_time)
+    # Fetch the whole week in one query; each night is labeled by wake-up date
+    nights = await abuild_sleep_timeline(await request.auser(), week_start - timedelta(days=1), len(week_days))
 
-    hour_labels = [block["label"] for block in week_blocks[0]]
-    zipped_days_blocks = list(zip(week_days, week_blocks, sleep_times))
+    hour_labels = HOUR_LABELS[:-1]
+    zipped_days_blocks = [
+        (day, night['blocks'], night['sleep_time'])
+        for day, night in zip(week_days, nights)
+    ]
 
     week_range_str = f"{week_start.strftime('%d %b')} – {(week_start + timedelta(days=6)).strftime('%d %b %Y')}"
 
@@ -229,10 +198,10 @@ def sleep_tracker_week(request):
         'active_period': 'week',
     }
 
-    return render(request, 'sleep_week.html', context)
+    return await arender(request, 'sleep_week.html', context)
 
 @login_required
-def sleep_tracker_month(request):
+async def sleep_tracker_month(request):
     """
     Track sleep for authenticated user only - month view.
     Shows nights labeled by wake-up date.
@@ -250,19 +219,14 @@ def sleep_tracker_month(request):
     num_days = calendar.monthrange(year, month)[1]
     all_days = [date(year, month, day) for day in range(1, num_days + 1)]
 
-    blocks_list = []
-    sleep_times = []
-
-    # Aggregate sleep data for each day in the month
-    # Process the night before each display day (labeled by wake-up date)
-    for day in all_days:
-        night_date = day - timedelta(days=1)
-        blocks, sleep_time, _ = process_day(night_date, request.user)
-        blocks_list.append(blocks)
-        sleep_times.append(sleep_time)
+    # Fetch the whole month in one query; each night is labeled by wake-up date
+    nights = await abuild_sleep_timeline(await request.auser(), all_days[0] - timedelta(days=1), len(all_days))
 
-    hour_labels = [block["label"] for block in blocks_list[0]]
-    zipped_days_blocks = list(zip(all_days, blocks_list, sleep_times))
+    hour_labels = HOUR_LABELS[:-1]
+    zipped_days_blocks = [
+        (day, night['blocks'], night['sleep_time'])
+        for day, night in zip(all_days, nights)
+    ]
 
     prev_month = (base_date.replace(day=1) - timedelta(days=1)).replace(day=1)
     next_month = (base_date.replace(day=28) + timedelta(days=4)).replace(day=1)
@@ -279,12 +243,12 @@ def sleep_tracker_month(request):
         'active_period': 'month',
     }
 
-    return render(request, 'sleep_month.html', context)
+    return await arender(request, 'sleep_month.html', context)
 
 # Mood tracking views
 
 @login_required
-def mood_tracker_day(request):
+async def mood_tracker_day(request):
     """
     Track mood for authenticated user only - day view.
     """
@@ -295,7 +259,7 @@ def mood_tracker_day(request):
     else:
         base_date = datetime.now().date()
 
-    mood_log = MoodLog.objects.filter(user=request.user, date=base_date).first()
+    mood_log = await MoodLog.objects.filter(user=await request.auser(), date=base_date).afirst()
     mood_value = mood_log.mood if mood_log else None
     context = {
         'background_image': background_image,
@@ -310,10 +274,10 @@ def mood_tracker_day(request):
         'mood_value': mood_value,
         'mood_range': range(1, 11),
     }
-    return render(request, 'mood_day.html', context)
+    return await arender(request, 'mood_day.html', context)
 
 @login_required
-def mood_tracker_week(request):
+async def mood_tracker_week(request):
     """
     Track mood for authenticated user only - week view.
     """
@@ -326,7 +290,7 @@ def mood_tracker_week(request):
 
     week_start = base_date - timedelta(days=base_date.weekday())
     week_days = [week_start + timedelta(days=i) for i in range(7)]
-    mood_logs = {log.date: log for log in MoodLog.objects.filter(user=request.user, date__in=week_days)}
+    mood_logs = {log.date: log async for log in MoodLog.objects.filter(user=await request.auser(), date__in=week_days)}
     zipped_days_moods = [(day, mood_logs.get(day)) for day in week_days]
 
     context = {
@@ -340,10 +304,10 @@ def mood_tracker_week(request):
         'next_week': (week_start + timedelta(days=7)).strftime("%Y-%m-%d"),
         'week_range': f"{week_start.strftime('%d %b')} – {(week_start + timedelta(days=6)).strftime('%d %b %Y')}",
     }
-    return render(request, 'mood_week.html', context)
+    return await arender(request, 'mood_week.html', context)
 
 @login_required
-def mood_tracker_month(request):
+async def mood_tracker_month(request):
     """
     Track mood for authenticated user only - month view.
     """
@@ -358,7 +322,10 @@ def mood_tracker_month(request):
     month = base_date.month
     num_days = calendar.monthrange(year, month)[1]
     all_days = [date(year, month, day) for day in range(1, num_days + 1)]
-    mood_logs = {log.date: log for log in MoodLog.objects.filter(user=request.user, date__year=year, date__month=month)}
+    mood_logs = {
+        log.date: log
+        async for log in MoodLog.objects.filter(user=await request.auser(), date__year=year, date__month=month)
+    }
     zipped_days_moods = [(day, mood_logs.get(day)) for day in all_days]
 
     # Calculate empty slots before the first day of the month (Monday=0, Sunday=6)
@@ -378,16 +345,30 @@ def mood_tracker_month(request):
         'weekday_names': ['Mon', 'Tue', 'Wed', 'Thu', 'Fri', 'Sat', 'Sun'],
         'month_start_empty_slots': month_start_empty_slots,
     }
-    return render(request, 'mood_month.html', context)
+    return await arender(request, 'mood_month.html', context)
 
 # Unified tracker view
 
 @login_required
-def tracker(request, section, period):
+async def tracker(request, section, period):
     """
     Unified tracker view - routes to appropriate tracker based on section and period.
-    Requires authentication.
+    Requires authentication. Rendered pages are cached until the user's data changes.
     """
+    # Templates read request.user, which would load the user a second time
+    request.user = await request.auser()
+    cache_key = await tracker_cache_key(request, request.user, section, period)
+    if cache_key:
+        cached = await get_cached_page(cache_key)
+        if cached is not None:
+            return cached
+    response = await render_tracker(request, section, period)
+    if cache_key:
+        await cache_page(cache_key, response)
+    return response
+
+async def render_tracker(request, section, period):
+    """Route to the tracker view for the given section and period."""
     background_image, button_gradient = get_background()
     context = {
         'background_image': background_image,
@@ -397,20 +378,20 @@ def tracker(request, section, period):
     }
 
     if section == 'habits':
-        return track_habits(request, view_mode=period)
+        return await track_habits(request, view_mode=period)
     elif section == 'sleep':
         if period == 'day':
-            return sleep_tracker(request)
+            return await sleep_tracker(request)
         elif period == 'week':
-            return sleep_tracker_week(request)
+            return await sleep_tracker_week(request)
         elif period == 'month':
-            return sleep_tracker_month(request)
+            return await sleep_tracker_month(request)
     elif section == 'mood':
         if period == 'day':
-            return mood_tracker_day(request)
+            return await mood_tracker_day(request)
         elif period == 'week':
-            return mood_tracker_week(request)
+            return await mood_tracker_week(request)
         elif period == 'month':
-            return mood_tracker_month(request)
+            return await mood_tracker_month(request)
 
-    return homepage(request)
\ No newline at end of file
+    return await sync_to_async(homepage)(request)
\ No newline at end of file
@@ -7,5 +7,11 @@ python manage.py migrate --noinput
 echo "Collecting static files..."
 python manage.py collectstatic --noinput
 
+# SERVER_MODE=asgi runs the async views on uvicorn workers
+if [ "${SERVER_MODE:-wsgi}" = "asgi" ]; then
+    echo "Starting gunicorn (ASGI)..."
+    exec gunicorn habits_project.asgi:application --worker-class uvicorn_worker.UvicornWorker --bind 0.0.0.0:$PORT
+fi
+
 echo "Starting gunicorn..."
 exec gunicorn habits_project.wsgi:application --bind 0.0.0.0:$PORT
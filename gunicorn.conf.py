@@ -0,0 +1,29 @@
+"""
+Gunicorn settings, loaded automatically from the working directory.
+
+With METRICS_ENABLED=True every worker writes its Prometheus samples to
+PROMETHEUS_MULTIPROC_DIR so /metrics aggregates all of them. The directory is
+emptied when the master starts, and a worker's live gauges are dropped when
+it exits.
+"""
+
+import os
+import shutil
+import tempfile
+
+if os.environ.get('METRICS_ENABLED', 'False') == 'True':
+    # Set before the workers are forked and import prometheus_client
+    os.environ.setdefault('PROMETHEUS_MULTIPROC_DIR', os.path.join(tempfile.gettempdir(), 'habits-prometheus'))
+
+
+def on_starting(server):
+    directory = os.environ.get('PROMETHEUS_MULTIPROC_DIR')
+    if directory:
+        shutil.rmtree(directory, ignore_errors=True)
+        os.makedirs(directory)
+
+
+def child_exit(server, worker):
+    if os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+        from prometheus_client import multiprocess
+        multiprocess.mark_process_dead(worker.pid)
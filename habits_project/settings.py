@@ -14,6 +14,7 @@ from pathlib import Path
 import os
 import sys
 import dj_database_url
+from django.core.exceptions import ImproperlyConfigured
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -66,6 +67,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'base.server_timing.ServerTimingMiddleware',  # No-op unless SERVER_TIMING_ENABLED
+    'base.metrics.MetricsMiddleware',  # No-op unless METRICS_ENABLED
     'django.middleware.security.SecurityMiddleware',
     'whitenoise.middleware.WhiteNoiseMiddleware',  # Serve static files
     'corsheaders.middleware.CorsMiddleware',
@@ -73,10 +76,39 @@ MIDDLEWARE = [
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'base.profiling.ProfilingMiddleware',  # No-op unless PROFILING_ENABLED
+    'base.slow_queries.SlowQueryMiddleware',  # No-op unless SLOW_QUERY_THRESHOLD_MS
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
 
+# Send SQL, view and template timings as a Server-Timing header and log one JSON
+# line per request on the base.server_timing logger
+SERVER_TIMING_ENABLED = os.environ.get('SERVER_TIMING_ENABLED', 'False') == 'True'
+
+# Prometheus metrics at /metrics, served to scrapers sending METRICS_TOKEN as a bearer
+# token. METRICS_TOKEN may only be empty with DEBUG on; otherwise workers refuse to start.
+# Under gunicorn, gunicorn.conf.py aggregates all workers through PROMETHEUS_MULTIPROC_DIR.
+METRICS_ENABLED = os.environ.get('METRICS_ENABLED', 'False') == 'True'
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN', '')
+
+# Staff requests carrying PROFILE_HEADER: 1 or ?PROFILE_PARAM=1 run under a sampling
+# profiler; the newest PROFILE_RING_SIZE profiles are kept and listed at /admin/profiles/.
+# Set either trigger to '' to disable it.
+PROFILING_ENABLED = os.environ.get('PROFILING_ENABLED', 'False') == 'True'
+PROFILE_HEADER = os.environ.get('PROFILE_HEADER', 'X-Profile')
+PROFILE_PARAM = os.environ.get('PROFILE_PARAM', 'profile')
+PROFILE_INTERVAL = float(os.environ.get('PROFILE_INTERVAL', 0.001))
+PROFILE_RING_SIZE = int(os.environ.get('PROFILE_RING_SIZE', 50))
+PROFILE_DIR = os.environ.get('PROFILE_DIR', os.path.join(BASE_DIR, 'logs', 'profiles'))
+
+# Log statements slower than SLOW_QUERY_THRESHOLD_MS (0 disables) with their call site
+# and EXPLAIN plan on the base.slow_queries logger. SLOW_QUERY_SAMPLE_RATE of them are
+# considered, and each normalized statement is logged once per SLOW_QUERY_COOLDOWN seconds.
+SLOW_QUERY_THRESHOLD_MS = float(os.environ.get('SLOW_QUERY_THRESHOLD_MS', 0))
+SLOW_QUERY_SAMPLE_RATE = float(os.environ.get('SLOW_QUERY_SAMPLE_RATE', 1.0))
+SLOW_QUERY_COOLDOWN = int(os.environ.get('SLOW_QUERY_COOLDOWN', 60))
+
 ROOT_URLCONF = 'habits_project.urls'
 
 TEMPLATES = [
@@ -98,13 +130,21 @@ TEMPLATES = [
 WSGI_APPLICATION = 'habits_project.wsgi.application'
 
 
+# Server mode: 'wsgi' (sync gunicorn workers) or 'asgi' (gunicorn with uvicorn workers),
+# picked up by start.sh and entrypoint.sh
+SERVER_MODE = os.environ.get('SERVER_MODE', 'wsgi')
+ASGI_APPLICATION = 'habits_project.asgi.application'
+
+
 # Database
 # https://docs.djangoproject.com/en/5.2/ref/settings/#databases
 # Always use DATABASE_URL if set, fallback to SQLite for local dev
+# Persistent connections are not reused across requests under ASGI, so they are
+# disabled there; put a pooler such as PgBouncer in front of the database instead.
 DATABASES = {
     'default': dj_database_url.config(
         default=f'sqlite:///{BASE_DIR / "db.sqlite3"}',
-        conn_max_age=600,
+        conn_max_age=0 if SERVER_MODE == 'asgi' else 600,
         conn_health_checks=True,
     )
 }
@@ -159,6 +199,71 @@ MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 
+# Cache
+# https://docs.djangoproject.com/en/5.2/topics/cache/
+# Local memory by default; set REDIS_URL to share the cache between workers.
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'habits-tracker',
+    }
+}
+if os.environ.get('REDIS_URL'):
+    CACHES['default'] = {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': os.environ['REDIS_URL'],
+    }
+# The in-process token and user caches learn about logouts and user changes made in
+# other workers through this cache, so they are only on by default when it is shared
+SHARED_CACHE = bool(os.environ.get('REDIS_URL'))
+
+# Rendered tracker pages are cached per user and data version (0 disables)
+TRACKER_PAGE_CACHE_TIMEOUT = int(os.environ.get('TRACKER_PAGE_CACHE_TIMEOUT', 300))
+
+# /api/sleep/stats/ results are cached the same way; sleep debt counts hours below the target
+SLEEP_STATS_CACHE_TIMEOUT = int(os.environ.get('SLEEP_STATS_CACHE_TIMEOUT', 3600))
+SLEEP_TARGET_HOURS = float(os.environ.get('SLEEP_TARGET_HOURS', 8))
+
+
+# Sessions
+# https://docs.djangoproject.com/en/5.2/topics/http/sessions/
+# SESSION_MODE=db (default) reads the session table on every request,
+# cached_db serves sessions from the cache above and only writes through to the
+# table, signed_cookies keeps the (signed, client-readable) session in the cookie.
+SESSION_ENGINES = {
+    'db': 'django.contrib.sessions.backends.db',
+    'cached_db': 'django.contrib.sessions.backends.cached_db',
+    'signed_cookies': 'django.contrib.sessions.backends.signed_cookies',
+}
+SESSION_MODE = os.environ.get('SESSION_MODE', 'db')
+if SESSION_MODE not in SESSION_ENGINES:
+    raise ImproperlyConfigured(f"SESSION_MODE must be one of {', '.join(SESSION_ENGINES)}")
+SESSION_ENGINE = SESSION_ENGINES[SESSION_MODE]
+
+# Users behind sessions are cached in each process for up to USER_CACHE_TTL seconds
+# (0 disables); like cached tokens, they are invalidated through the shared cache, so
+# the default is 60 with REDIS_URL set and 0 without.
+# ModelBackend stays listed so sessions created before keep working.
+AUTHENTICATION_BACKENDS = [
+    'base.auth_backends.CachedModelBackend',
+    'django.contrib.auth.backends.ModelBackend',
+]
+USER_CACHE_TTL = int(os.environ.get('USER_CACHE_TTL', 60 if SHARED_CACHE else 0))
+USER_CACHE_SIZE = int(os.environ.get('USER_CACHE_SIZE', 10000))
+
+
+# Habit completion bitmaps
+# Keep one compact completion bitmap per habit per year alongside HabitLog.
+# Run `python manage.py backfill_habit_bitmaps` before enabling on existing data.
+HABIT_BITMAPS_ENABLED = os.environ.get('HABIT_BITMAPS_ENABLED', 'False') == 'True'
+
+
+# Delta sync change log
+# `python manage.py compact_change_log` trims entries older than this; clients
+# holding an older sync token are told to do a full resync.
+CHANGE_LOG_RETENTION_DAYS = int(os.environ.get('CHANGE_LOG_RETENTION_DAYS', 30))
+
+
 # CORS settings
 # https://pypi.org/project/django-cors-headers/
 CORS_ALLOW_ALL_ORIGINS = os.environ.get('CORS_ALLOW_ALL_ORIGINS', 'False') == 'True'
@@ -177,7 +282,7 @@ REST_FRAMEWORK = {
     'PAGE_SIZE': 100,
     # Authentication: Token for API, Session for browsable API
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework.authentication.TokenAuthentication',
+        'api.authentication.CachedTokenAuthentication',
         'rest_framework.authentication.SessionAuthentication',
     ],
     'DEFAULT_PERMISSION_CLASSES': [
@@ -185,6 +290,13 @@ REST_FRAMEWORK = {
     ],
 }
 
+# Token to user lookups are cached in each process for up to TOKEN_CACHE_TTL seconds
+# (0 disables). Logout and user changes invalidate them in every process through the
+# shared cache, so the default is 60 with REDIS_URL set and 0 without; only set it
+# without REDIS_URL when a single process serves the API.
+TOKEN_CACHE_TTL = int(os.environ.get('TOKEN_CACHE_TTL', 60 if SHARED_CACHE else 0))
+TOKEN_CACHE_SIZE = int(os.environ.get('TOKEN_CACHE_SIZE', 10000))
+
 # Add browsable API renderer in DEBUG mode
 if DEBUG:
     REST_FRAMEWORK['DEFAULT_RENDERER_CLASSES'].append('rest_framework.renderers.BrowsableAPIRenderer')
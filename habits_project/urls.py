@@ -4,6 +4,8 @@ from django.http import JsonResponse
 from django.db import connection
 from base import views
 from base import auth_views
+from base import profile_views
+from base.metrics import metrics_view
 
 
 def health_check(request):
@@ -27,6 +29,7 @@ urlpatterns = [
     # Public pages
     path('', views.homepage, name='home'),
     path('health/', health_check, name='health'),
+    path('metrics', metrics_view, name='metrics'),
     
     # Authentication pages
     path('login/', auth_views.login_view, name='login'),
@@ -34,6 +37,8 @@ urlpatterns = [
     path('logout/', auth_views.logout_view, name='logout'),
     
     # Admin
+    path('admin/profiles/', profile_views.profile_list, name='profile_list'),
+    path('admin/profiles/<str:name>/', profile_views.profile_download, name='profile_download'),
     path('admin/', admin.site.urls),
     
     # API endpoints
@@ -9,6 +9,11 @@ python manage.py migrate --noinput
 echo "Collecting static files..."
 python manage.py collectstatic --noinput
 
-# Start Gunicorn
-echo "Starting Gunicorn..."
-gunicorn habits_project.wsgi:application --bind 0.0.0.0:8000
+# Start Gunicorn (SERVER_MODE=asgi runs the async views on uvicorn workers)
+if [ "${SERVER_MODE:-wsgi}" = "asgi" ]; then
+    echo "Starting Gunicorn (ASGI)..."
+    gunicorn habits_project.asgi:application --worker-class uvicorn_worker.UvicornWorker --bind 0.0.0.0:8000
+else
+    echo "Starting Gunicorn..."
+    gunicorn habits_project.wsgi:application --bind 0.0.0.0:8000
+fi